@@ -4,6 +4,16 @@
 -- Create schema
 CREATE SCHEMA real_estate;
 
+-- Trigram operator classes for the street address search index
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Versioned migrations in db/migrations applied to this database. A fresh
+-- database already includes every migration listed at the end of this file.
+CREATE TABLE "schema_migrations" (
+    "version" VARCHAR(50) PRIMARY KEY,
+    "applied_at" TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
 -- Create lookup tables first
 CREATE TABLE "housing_form_types" (
     "housing_form_id" SERIAL PRIMARY KEY,
@@ -127,6 +137,11 @@ CREATE TABLE "listings" (
     "latitude" DECIMAL(10, 8),
     "longitude" DECIMAL(11, 8),
     "description" TEXT,
+    -- Full-text document for search_listings: the address weighted above the description
+    "search_vector" TSVECTOR GENERATED ALWAYS AS (
+        setweight(to_tsvector('swedish', coalesce(street_address, '')), 'A') ||
+        setweight(to_tsvector('swedish', coalesce(description, '')), 'B')
+    ) STORED,
     "created_at" TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     "updated_at" TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     CONSTRAINT "listings_tenure_id_fkey" FOREIGN KEY ("tenure_id") 
@@ -144,9 +159,13 @@ CREATE TABLE "listings" (
     CONSTRAINT "listing_land_area_check" CHECK (land_area >= 0)
 );
 
+-- Sales are range-partitioned by sale_date (one partition per year). Unique
+-- constraints on a partitioned table must include the partition key, so
+-- sale_hemnet_id and url are unique per sale_date; a sale always carries the
+-- same sale_date, so this still rejects re-inserted sales.
 CREATE TABLE "property_sales" (
-    "sale_id" BIGSERIAL PRIMARY KEY,
-    "sale_hemnet_id" BIGINT NOT NULL UNIQUE,
+    "sale_id" BIGSERIAL,
+    "sale_hemnet_id" BIGINT NOT NULL,
     "listing_id" BIGINT,  -- Can be NULL if we don't have the original listing
     "listing_hemnet_id" BIGINT NOT NULL,  -- original_hemnet_id from the scraper
     "final_price" DECIMAL(15, 2) NOT NULL,
@@ -164,14 +183,56 @@ CREATE TABLE "property_sales" (
     "area" VARCHAR(255),
     "municipality" VARCHAR(255),
     "running_costs" DECIMAL(10, 2),
-    "url" VARCHAR(255) NOT NULL UNIQUE,
+    "url" VARCHAR(255) NOT NULL,
+    "latitude" DECIMAL(10, 8),
+    "longitude" DECIMAL(11, 8),
     "created_at" TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     "updated_at" TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT "property_sales_pkey" PRIMARY KEY ("sale_id", "sale_date"),
+    CONSTRAINT "property_sales_sale_hemnet_id_key" UNIQUE ("sale_hemnet_id", "sale_date"),
+    CONSTRAINT "property_sales_url_key" UNIQUE ("url", "sale_date"),
     CONSTRAINT "property_sales_listing_id_fkey" FOREIGN KEY ("listing_id") 
         REFERENCES "listings" ("listing_id") ON DELETE SET NULL,
     CONSTRAINT "property_sales_price_check" CHECK (final_price >= 0)
+) PARTITION BY RANGE ("sale_date");
+
+-- Create the yearly partition of property_sales for the given year if it doesn't exist
+CREATE OR REPLACE FUNCTION create_property_sales_partition(partition_year INTEGER)
+RETURNS VOID AS $$
+BEGIN
+    EXECUTE format(
+        'CREATE TABLE IF NOT EXISTS %I PARTITION OF property_sales FOR VALUES FROM (%L) TO (%L)',
+        'property_sales_y' || partition_year,
+        make_date(partition_year, 1, 1),
+        make_date(partition_year + 1, 1, 1)
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TABLE "property_sales_default" PARTITION OF "property_sales" DEFAULT;
+
+SELECT create_property_sales_partition(partition_year)
+FROM generate_series(2010, EXTRACT(YEAR FROM CURRENT_DATE)::INTEGER + 1) AS partition_year;
+
+-- property_sales keeps sale_hemnet_id and url unique only per sale_date (unique keys of a
+-- partitioned table must include the partition key); store_sold_listing claims them here,
+-- in the sale's transaction, so they are unique across partitions
+CREATE TABLE "sale_keys" (
+    "sale_hemnet_id" BIGINT PRIMARY KEY,
+    "url" VARCHAR(255) NOT NULL UNIQUE
 );
 
+CREATE OR REPLACE FUNCTION delete_sale_key()
+RETURNS TRIGGER AS $$
+BEGIN
+    DELETE FROM sale_keys WHERE sale_hemnet_id = OLD.sale_hemnet_id AND url = OLD.url;
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER delete_property_sales_key AFTER DELETE ON "property_sales"
+FOR EACH ROW EXECUTE PROCEDURE delete_sale_key();
+
 CREATE TABLE "listing_amenities" (
     "listing_id" BIGINT NOT NULL,
     "amenity_id" BIGINT NOT NULL,
@@ -232,6 +293,113 @@ CREATE TABLE "listing_viewings" (
     CONSTRAINT "listing_viewings_time_check" CHECK (end_time > start_time)
 );
 
+-- One row per scheduled scraper job run, written by the scheduler in main.py
+CREATE TABLE "scraper_runs" (
+    "run_id" BIGSERIAL PRIMARY KEY,
+    "job" VARCHAR(50) NOT NULL,
+    "status" VARCHAR(20) NOT NULL DEFAULT 'running',
+    "started_at" TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "finished_at" TIMESTAMP WITH TIME ZONE,
+    "duration_seconds" DECIMAL(10, 2),
+    "time_budget_seconds" INTEGER,
+    "items_processed" INTEGER,
+    "stats" JSONB,
+    "error" TEXT,
+    CONSTRAINT "scraper_runs_status_check" CHECK (status IN ('running', 'completed', 'budget_exhausted', 'failed', 'skipped'))
+);
+
+-- Scraped records that failed validation against the constraints above (utils/validation.py)
+CREATE TABLE "ingest_rejects" (
+    "reject_id" BIGSERIAL PRIMARY KEY,
+    "record_type" VARCHAR(20) NOT NULL,
+    "hemnet_id" BIGINT,
+    "url" TEXT,
+    "fields" TEXT[] NOT NULL,  -- Fields that failed validation
+    "reasons" JSONB NOT NULL,  -- {field: reason}
+    "record" JSONB NOT NULL,  -- The extracted record as it was rejected
+    "rejected_at" TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT "ingest_rejects_record_type_check" CHECK (record_type IN ('listing', 'sale'))
+);
+
+-- Checkpoints of the sold listings backfill (scrapers/sold_backfill.py), one row per search slice
+CREATE TABLE "backfill_slices" (
+    "slice_key" VARCHAR(255) PRIMARY KEY,  -- The slice's search parameters
+    "location_hemnet_id" BIGINT NOT NULL,
+    "item_type" VARCHAR(50) NOT NULL,
+    "price_min" BIGINT NOT NULL,
+    "price_max" BIGINT,  -- NULL for the open-ended top band
+    "sold_age" VARCHAR(20),
+    "parent_key" VARCHAR(255),  -- The slice this one was split from
+    "status" VARCHAR(20) NOT NULL DEFAULT 'pending',
+    "last_page" INTEGER NOT NULL DEFAULT 0,  -- Last result page whose sales are stored
+    "sales_found" INTEGER NOT NULL DEFAULT 0,
+    "sales_inserted" INTEGER NOT NULL DEFAULT 0,
+    "truncated" BOOLEAN NOT NULL DEFAULT FALSE,  -- Results continued past the last reachable page
+    "attempts" INTEGER NOT NULL DEFAULT 0,
+    "claimed_by" VARCHAR(100),
+    "claimed_at" TIMESTAMP WITH TIME ZONE,
+    "completed_at" TIMESTAMP WITH TIME ZONE,
+    "error" TEXT,
+    "created_at" TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT "backfill_slices_status_check" CHECK (status IN ('pending', 'in_progress', 'completed', 'split', 'failed'))
+);
+
+-- Detail pages a budgeted scraper run deferred (scrapers/crawl_planner.py), served first by the job's next run
+CREATE TABLE "crawl_deferred" (
+    "job" VARCHAR(50) NOT NULL,
+    "url" VARCHAR(255) NOT NULL,
+    "priority" SMALLINT NOT NULL,  -- crawl_planner priority: 0 new, 2 due for a change check
+    "position" INTEGER NOT NULL,  -- Order within the priority when deferred
+    "deferred_at" TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY ("job", "url")
+);
+
+-- Last change check of each stored listing: a detail page refetch or a fast mode result card.
+-- Kept out of listings so checks don't bump listings.updated_at and the Parquet exports.
+CREATE TABLE "listing_checks" (
+    "listing_hemnet_id" BIGINT PRIMARY KEY,
+    "checked_at" TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Version of the scraped data, bumped when a scraper run finishes; read caches key on it
+CREATE TABLE "data_version" (
+    "id" BOOLEAN PRIMARY KEY DEFAULT TRUE,  -- Single row
+    "version" BIGINT NOT NULL DEFAULT 0,
+    "run_id" BIGINT,  -- The run that last bumped it
+    "updated_at" TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT "data_version_single_row" CHECK (id)
+);
+
+INSERT INTO "data_version" DEFAULT VALUES;
+
+-- Comparable recent sales per listing, written by analytics/comps.py after each active scrape
+CREATE TABLE "listing_comps" (
+    "listing_id" BIGINT NOT NULL,
+    "rank" SMALLINT NOT NULL,
+    "sale_id" BIGINT NOT NULL,
+    "sale_date" DATE NOT NULL,
+    "location_id" BIGINT NOT NULL,
+    "score" REAL NOT NULL,
+    "created_at" TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY ("listing_id", "rank"),
+    CONSTRAINT "listing_comps_listing_id_fkey" FOREIGN KEY ("listing_id") 
+        REFERENCES "listings" ("listing_id") ON DELETE CASCADE,
+    CONSTRAINT "listing_comps_sale_fkey" FOREIGN KEY ("sale_id", "sale_date") 
+        REFERENCES "property_sales" ("sale_id", "sale_date") ON DELETE CASCADE,
+    CONSTRAINT "listing_comps_location_id_fkey" FOREIGN KEY ("location_id") 
+        REFERENCES "locations" ("location_id") ON DELETE CASCADE
+);
+
+-- When each listing's comps were last computed, also when none were found;
+-- analytics/comps.py recomputes them once this is older than the refresh interval or a newer comparable sale
+CREATE TABLE "listing_comps_state" (
+    "listing_id" BIGINT PRIMARY KEY,
+    "computed_at" TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "comps" SMALLINT NOT NULL,  -- Comps found, 0 when the listing had no comparable sales
+    CONSTRAINT "listing_comps_state_listing_id_fkey" FOREIGN KEY ("listing_id")
+        REFERENCES "listings" ("listing_id") ON DELETE CASCADE
+);
+
 -- Create indexes for the listings table
 CREATE INDEX "idx_listings_broker_id" ON "listings" ("broker_id");
 CREATE INDEX "idx_listings_housing_form_id" ON "listings" ("housing_form_id");
@@ -244,17 +412,48 @@ CREATE INDEX "idx_listings_postcode" ON "listings" ("postcode");
 CREATE INDEX "idx_listings_published_date" ON "listings" ("published_date");
 CREATE INDEX "idx_listings_status" ON "listings" ("status");
 
+-- Keyword search over descriptions and addresses (utils/read_utils.search_listings)
+CREATE INDEX "idx_listings_search_vector" ON "listings" USING GIN ("search_vector");
+CREATE INDEX "idx_listings_street_address_trgm" ON "listings" USING GIN ("street_address" gin_trgm_ops);
+
 -- Standard indexes for location data
 CREATE INDEX "idx_listings_location" ON "listings" ("longitude", "latitude")
 WHERE latitude IS NOT NULL AND longitude IS NOT NULL;
 
+-- BRIN indexes on insert-ordered time columns
+CREATE INDEX "idx_listings_created_at_brin" ON "listings" USING BRIN ("created_at");
+
 -- Create indexes for the property_sales table
-CREATE INDEX "idx_property_sales_listing_id" ON "property_sales" ("listing_id");
+-- Covers the listing joins in the analytics views without touching the heap
+CREATE INDEX "idx_property_sales_listing_id" ON "property_sales" ("listing_id")
+INCLUDE ("sale_date", "final_price", "price_change_percentage")
+WHERE listing_id IS NOT NULL;
 CREATE INDEX "idx_property_sales_listing_hemnet_id" ON "property_sales" ("listing_hemnet_id");
+-- Unmatched sales, used by unmatched_sales_view and for linking sales to listings
+CREATE INDEX "idx_property_sales_unmatched" ON "property_sales" ("listing_hemnet_id")
+WHERE listing_id IS NULL;
+CREATE INDEX "idx_property_sales_created_at_brin" ON "property_sales" USING BRIN ("created_at");
+CREATE INDEX "idx_property_sales_location" ON "property_sales" ("longitude", "latitude")
+WHERE latitude IS NOT NULL AND longitude IS NOT NULL;
 CREATE INDEX "idx_property_sales_sale_date" ON "property_sales" ("sale_date");
 CREATE INDEX "idx_property_sales_final_price" ON "property_sales" ("final_price");
 CREATE INDEX "idx_property_sales_broker_agency" ON "property_sales" ("broker_agency");
 
+-- Listings by location, used by location_market_performance
+CREATE INDEX "idx_listing_locations_location_id" ON "listing_locations" ("location_id") INCLUDE ("listing_id");
+
+-- Latest runs per job
+CREATE INDEX "idx_scraper_runs_job_started_at" ON "scraper_runs" ("job", "started_at" DESC);
+
+-- Claiming the next pending or stale backfill slice
+CREATE INDEX "idx_backfill_slices_status" ON "backfill_slices" ("status", "claimed_at");
+
+-- Latest rejects per record type
+CREATE INDEX "idx_ingest_rejects_type_rejected_at" ON "ingest_rejects" ("record_type", "rejected_at" DESC);
+
+-- Supports the cascade from property_sales deletes
+CREATE INDEX "idx_listing_comps_sale" ON "listing_comps" ("sale_id", "sale_date");
+
 -- Standard index for locations
 CREATE INDEX "idx_locations_location" ON "locations" ("longitude", "latitude")
 WHERE latitude IS NOT NULL AND longitude IS NOT NULL;
@@ -288,8 +487,12 @@ CREATE TRIGGER update_housing_cooperatives_timestamp BEFORE UPDATE ON "housing_c
 
 -- Create views for easier data analysis
 
+-- Analytics views are materialized so notebook queries don't re-join and
+-- re-aggregate the base tables. Each has a unique index so it can be refreshed
+-- with REFRESH MATERIALIZED VIEW CONCURRENTLY after a scrape run.
+
 -- View to join listings with their sales data
-CREATE VIEW "listing_sales_view" AS
+CREATE MATERIALIZED VIEW "listing_sales_view" AS
 SELECT 
     l.listing_id,
     l.listing_hemnet_id,
@@ -338,6 +541,10 @@ LEFT JOIN
 LEFT JOIN
     "housing_cooperatives" hc ON l.housing_cooperative_id = hc.housing_cooperative_id;
 
+CREATE UNIQUE INDEX "idx_listing_sales_view_sale_id" ON "listing_sales_view" ("sale_id");
+CREATE INDEX "idx_listing_sales_view_listing_id" ON "listing_sales_view" ("listing_id");
+CREATE INDEX "idx_listing_sales_view_sale_date" ON "listing_sales_view" ("sale_date");
+
 -- View for unmatched sales (sold listings we don't have the original listing for)
 CREATE VIEW "unmatched_sales_view" AS
 SELECT 
@@ -365,7 +572,7 @@ WHERE
     ps.listing_id IS NULL;
 
 -- View for market performance by location
-CREATE VIEW "location_market_performance" AS
+CREATE MATERIALIZED VIEW "location_market_performance" AS
 SELECT 
     loc.location_id,
     loc.location_name,
@@ -389,8 +596,10 @@ WHERE
 GROUP BY 
     loc.location_id, loc.location_name, loc.type;
 
+CREATE UNIQUE INDEX "idx_location_market_performance_location_id" ON "location_market_performance" ("location_id");
+
 -- View for housing cooperative performance
-CREATE VIEW "housing_cooperative_performance" AS
+CREATE MATERIALIZED VIEW "housing_cooperative_performance" AS
 SELECT
     hc.housing_cooperative_id,
     hc.name AS housing_cooperative_name,
@@ -410,4 +619,164 @@ JOIN
 LEFT JOIN
     "property_sales" ps ON l.listing_id = ps.listing_id
 GROUP BY
-    hc.housing_cooperative_id, hc.name;
\ No newline at end of file
+    hc.housing_cooperative_id, hc.name;
+
+CREATE UNIQUE INDEX "idx_housing_cooperative_performance_id" ON "housing_cooperative_performance" ("housing_cooperative_id");
+
+-- Store one extracted listing with its dimension rows and child links in a
+-- single atomic call. The argument is the listing dictionary built by the
+-- active listings scraper (save_to_database's input) as JSONB; returns the new
+-- listing_id. Any failure, including an already stored listing, rolls back
+-- the whole call.
+CREATE OR REPLACE FUNCTION ingest_listing(listing JSONB)
+RETURNS BIGINT AS $$
+DECLARE
+    v_housing_form_id INTEGER;
+    v_tenure_id INTEGER;
+    v_energy_classification_id INTEGER;
+    v_housing_cooperative_id INTEGER;
+    v_broker_id BIGINT;
+    v_listing_id BIGINT;
+    v_agency_id BIGINT;
+    v_location_id BIGINT;
+    v_location_type VARCHAR(255);
+    v_amenity_id BIGINT;
+    item JSONB;
+    amenity TEXT;
+BEGIN
+    -- Lookup values: insert if missing, then read the id (also covers a concurrent insert)
+    INSERT INTO housing_form_types (name) VALUES (listing->>'housing_form') ON CONFLICT (name) DO NOTHING;
+    SELECT housing_form_id INTO v_housing_form_id FROM housing_form_types WHERE name = listing->>'housing_form';
+
+    INSERT INTO tenure_types (name) VALUES (listing->>'tenure') ON CONFLICT (name) DO NOTHING;
+    SELECT tenure_id INTO v_tenure_id FROM tenure_types WHERE name = listing->>'tenure';
+
+    IF COALESCE(listing->>'energy_classification', '') <> '' THEN
+        INSERT INTO energy_classifications (classification) VALUES (listing->>'energy_classification')
+        ON CONFLICT (classification) DO NOTHING;
+        SELECT energy_classification_id INTO v_energy_classification_id
+        FROM energy_classifications WHERE classification = listing->>'energy_classification';
+    END IF;
+
+    IF COALESCE(listing#>>'{housing_cooperative,name}', '') <> '' THEN
+        INSERT INTO housing_cooperatives (name) VALUES (listing#>>'{housing_cooperative,name}')
+        ON CONFLICT (name) DO NOTHING;
+        SELECT housing_cooperative_id INTO v_housing_cooperative_id
+        FROM housing_cooperatives WHERE name = listing#>>'{housing_cooperative,name}';
+    END IF;
+
+    IF listing#>>'{broker,hemnetId}' IS NULL OR COALESCE(listing#>>'{broker,name}', '') = '' THEN
+        RAISE EXCEPTION 'Missing required broker data for listing %', listing->>'hemnet_id';
+    END IF;
+    INSERT INTO brokers (broker_hemnet_id, name)
+    VALUES ((listing#>>'{broker,hemnetId}')::BIGINT, listing#>>'{broker,name}')
+    ON CONFLICT (broker_hemnet_id) DO NOTHING;
+    SELECT broker_id INTO v_broker_id FROM brokers WHERE broker_hemnet_id = (listing#>>'{broker,hemnetId}')::BIGINT;
+
+    INSERT INTO listings (
+        listing_hemnet_id, url, street_address, postcode, tenure_id, number_of_rooms,
+        asking_price, squaremeter_price, fee, yearly_arrendee_fee, yearly_leasehold_fee,
+        running_costs, construction_year, living_area, is_foreclosure, is_new_construction,
+        is_project, is_upcoming, supplemental_area, land_area, housing_form_id,
+        housing_cooperative_id, energy_classification_id, floor, published_date, broker_id,
+        closest_water_distance_meters, coastline_distance_meters, description,
+        latitude, longitude
+    ) VALUES (
+        (listing->>'hemnet_id')::BIGINT,
+        'https://www.hemnet.se/bostad/' || (listing->>'hemnet_id'),
+        listing->>'street_address',
+        listing->>'post_code',
+        v_tenure_id,
+        (listing->>'number_of_rooms')::NUMERIC,
+        (listing->>'asking_price')::NUMERIC,
+        (listing->>'square_meter_price')::NUMERIC,
+        (listing->>'fee')::NUMERIC,
+        (listing->>'yearly_arrende_fee')::NUMERIC,
+        (listing->>'yearly_leasehold_fee')::NUMERIC,
+        (listing->>'running_costs')::NUMERIC,
+        (listing->>'construction_year')::INTEGER,
+        (listing->>'living_area')::NUMERIC,
+        (listing->>'is_foreclosure')::BOOLEAN,
+        (listing->>'is_new_construction')::BOOLEAN,
+        (listing->>'is_project')::BOOLEAN,
+        (listing->>'is_upcoming')::BOOLEAN,
+        (listing->>'supplemental_area')::NUMERIC,
+        (listing->>'land_area')::NUMERIC,
+        v_housing_form_id,
+        v_housing_cooperative_id,
+        v_energy_classification_id,
+        (listing->>'floor')::INTEGER,
+        (listing->>'published_date')::DATE,
+        v_broker_id,
+        (listing->>'closest_water_distance_meters')::INTEGER,
+        (listing->>'coastline_distance_meters')::INTEGER,
+        listing->>'description',
+        (listing->>'latitude')::NUMERIC,
+        (listing->>'longitude')::NUMERIC
+    ) RETURNING listing_id INTO v_listing_id;
+
+    FOR item IN SELECT value FROM jsonb_array_elements(COALESCE(listing->'broker_agencies', '[]'::JSONB)) LOOP
+        CONTINUE WHEN item->>'hemnetId' IS NULL OR COALESCE(item->>'name', '') = '';
+        INSERT INTO broker_agencies (agency_hemnet_id, name)
+        VALUES ((item->>'hemnetId')::BIGINT, item->>'name')
+        ON CONFLICT (agency_hemnet_id) DO NOTHING;
+        SELECT agency_id INTO v_agency_id FROM broker_agencies WHERE agency_hemnet_id = (item->>'hemnetId')::BIGINT;
+
+        IF NOT EXISTS (
+            SELECT 1 FROM broker_agency_relationships
+            WHERE broker_id = v_broker_id AND agency_id = v_agency_id AND end_date IS NULL
+        ) THEN
+            INSERT INTO broker_agency_relationships (broker_id, agency_id) VALUES (v_broker_id, v_agency_id)
+            ON CONFLICT DO NOTHING;
+        END IF;
+
+        INSERT INTO listing_agencies (listing_id, agency_id) VALUES (v_listing_id, v_agency_id)
+        ON CONFLICT DO NOTHING;
+    END LOOP;
+
+    FOR item IN SELECT value FROM jsonb_array_elements(COALESCE(listing->'locations', '[]'::JSONB)) LOOP
+        CONTINUE WHEN item->>'hemnetId' IS NULL OR COALESCE(item->>'name', '') = '';
+        SELECT location_id, type INTO v_location_id, v_location_type
+        FROM locations WHERE location_hemnet_id = (item->>'hemnetId')::BIGINT;
+        IF v_location_id IS NULL THEN
+            INSERT INTO locations (location_hemnet_id, location_name, type)
+            VALUES ((item->>'hemnetId')::BIGINT, item->>'name', item->>'type')
+            ON CONFLICT (location_hemnet_id) DO UPDATE SET type = COALESCE(EXCLUDED.type, locations.type)
+            RETURNING location_id INTO v_location_id;
+        ELSIF item->>'type' IS NOT NULL AND v_location_type IS DISTINCT FROM item->>'type' THEN
+            UPDATE locations SET type = item->>'type' WHERE location_id = v_location_id;
+        END IF;
+
+        INSERT INTO listing_locations (listing_id, location_id) VALUES (v_listing_id, v_location_id)
+        ON CONFLICT DO NOTHING;
+    END LOOP;
+
+    FOR amenity IN
+        SELECT key FROM jsonb_each(COALESCE(listing->'relevant_amenities', '{}'::JSONB)) WHERE value = 'true'::JSONB
+    LOOP
+        INSERT INTO amenities (amenity_name) VALUES (amenity) ON CONFLICT (amenity_name) DO NOTHING;
+        SELECT amenity_id INTO v_amenity_id FROM amenities WHERE amenity_name = amenity;
+        INSERT INTO listing_amenities (listing_id, amenity_id) VALUES (v_listing_id, v_amenity_id)
+        ON CONFLICT DO NOTHING;
+    END LOOP;
+
+    RETURN v_listing_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Migrations already reflected in this schema
+INSERT INTO "schema_migrations" ("version") VALUES
+    ('001'),
+    ('002'),
+    ('003'),
+    ('004'),
+    ('005'),
+    ('006'),
+    ('007'),
+    ('008'),
+    ('009'),
+    ('010'),
+    ('011'),
+    ('012'),
+    ('013'),
+    ('014');
@@ -0,0 +1,127 @@
+-- Migration 001: materialize the analytics views
+--
+-- Replaces the plain listing_sales_view, location_market_performance and
+-- housing_cooperative_performance views with materialized views. The unique
+-- indexes are required for REFRESH MATERIALIZED VIEW CONCURRENTLY, which the
+-- scheduler runs after each scrape.
+
+-- Databases created from an init.sql that already materialized the views are
+-- rebuilt too, so the migration is safe to apply to either
+DO $$
+DECLARE
+    view_name TEXT;
+BEGIN
+    FOREACH view_name IN ARRAY ARRAY['listing_sales_view', 'location_market_performance', 'housing_cooperative_performance'] LOOP
+        IF EXISTS (SELECT 1 FROM pg_matviews WHERE matviewname = view_name AND schemaname = current_schema()) THEN
+            EXECUTE format('DROP MATERIALIZED VIEW %I', view_name);
+        ELSE
+            EXECUTE format('DROP VIEW IF EXISTS %I', view_name);
+        END IF;
+    END LOOP;
+END $$;
+
+-- View to join listings with their sales data
+CREATE MATERIALIZED VIEW "listing_sales_view" AS
+SELECT 
+    l.listing_id,
+    l.listing_hemnet_id,
+    l.street_address,
+    l.postcode,
+    l.asking_price AS original_asking_price,
+    l.published_date,
+    ps.sale_id,
+    ps.sale_hemnet_id,
+    ps.final_price,
+    ps.sale_date,
+    ps.price_change,
+    ps.price_change_percentage,
+    (ps.final_price - l.asking_price) AS price_difference,
+    CASE 
+        WHEN l.asking_price > 0 THEN 
+            ((ps.final_price - l.asking_price) / l.asking_price * 100)
+        ELSE NULL
+    END AS price_difference_percentage,
+    l.living_area,
+    CASE 
+        WHEN l.living_area > 0 THEN 
+            (ps.final_price / l.living_area)
+        ELSE NULL
+    END AS final_price_per_sqm,
+    l.broker_id,
+    b.name AS broker_name,
+    ps.broker_agency,
+    l.housing_form_id,
+    hft.name AS housing_form_name,
+    l.tenure_id,
+    tt.name AS tenure_name,
+    l.housing_cooperative_id,
+    hc.name AS housing_cooperative_name,
+    (ps.sale_date - l.published_date) AS days_on_market
+FROM 
+    "listings" l
+JOIN 
+    "property_sales" ps ON l.listing_id = ps.listing_id
+LEFT JOIN 
+    "brokers" b ON l.broker_id = b.broker_id
+LEFT JOIN 
+    "housing_form_types" hft ON l.housing_form_id = hft.housing_form_id
+LEFT JOIN 
+    "tenure_types" tt ON l.tenure_id = tt.tenure_id
+LEFT JOIN
+    "housing_cooperatives" hc ON l.housing_cooperative_id = hc.housing_cooperative_id;
+
+CREATE UNIQUE INDEX "idx_listing_sales_view_sale_id" ON "listing_sales_view" ("sale_id");
+CREATE INDEX "idx_listing_sales_view_listing_id" ON "listing_sales_view" ("listing_id");
+CREATE INDEX "idx_listing_sales_view_sale_date" ON "listing_sales_view" ("sale_date");
+
+-- View for market performance by location
+CREATE MATERIALIZED VIEW "location_market_performance" AS
+SELECT 
+    loc.location_id,
+    loc.location_name,
+    loc.type,
+    COUNT(DISTINCT l.listing_id) AS total_listings,
+    COUNT(DISTINCT ps.sale_id) AS total_sales,
+    ROUND(AVG(ps.final_price), 2) AS avg_final_price,
+    ROUND(AVG(ps.price_change_percentage), 2) AS avg_price_change_percentage,
+    ROUND(AVG(ps.sale_date - l.published_date), 1) AS avg_days_on_market,
+    ROUND(AVG(CASE WHEN l.living_area > 0 THEN ps.final_price / l.living_area ELSE NULL END), 2) AS avg_price_per_sqm
+FROM 
+    "locations" loc
+JOIN 
+    "listing_locations" ll ON loc.location_id = ll.location_id
+JOIN 
+    "listings" l ON ll.listing_id = l.listing_id
+LEFT JOIN 
+    "property_sales" ps ON l.listing_id = ps.listing_id
+WHERE 
+    ps.sale_id IS NOT NULL
+GROUP BY 
+    loc.location_id, loc.location_name, loc.type;
+
+CREATE UNIQUE INDEX "idx_location_market_performance_location_id" ON "location_market_performance" ("location_id");
+
+-- View for housing cooperative performance
+CREATE MATERIALIZED VIEW "housing_cooperative_performance" AS
+SELECT
+    hc.housing_cooperative_id,
+    hc.name AS housing_cooperative_name,
+    COUNT(DISTINCT l.listing_id) AS total_listings,
+    COUNT(DISTINCT ps.sale_id) AS total_sales,
+    ROUND(AVG(l.asking_price), 2) AS avg_asking_price,
+    ROUND(AVG(ps.final_price), 2) AS avg_final_price,
+    ROUND(AVG(l.squaremeter_price), 2) AS avg_sqm_price_asking,
+    ROUND(AVG(CASE WHEN l.living_area > 0 THEN ps.final_price / l.living_area ELSE NULL END), 2) AS avg_sqm_price_final,
+    ROUND(AVG(l.fee), 2) AS avg_monthly_fee,
+    ROUND(AVG(ps.price_change_percentage), 2) AS avg_price_change_percentage,
+    ROUND(AVG(ps.sale_date - l.published_date), 1) AS avg_days_on_market
+FROM
+    "housing_cooperatives" hc
+JOIN
+    "listings" l ON hc.housing_cooperative_id = l.housing_cooperative_id
+LEFT JOIN
+    "property_sales" ps ON l.listing_id = ps.listing_id
+GROUP BY
+    hc.housing_cooperative_id, hc.name;
+
+CREATE UNIQUE INDEX "idx_housing_cooperative_performance_id" ON "housing_cooperative_performance" ("housing_cooperative_id");
@@ -0,0 +1,248 @@
+-- Migration 002: partition property_sales by sale_date and add indexes for the views
+--
+-- property_sales is rebuilt as a table range-partitioned by sale_date with one
+-- partition per year plus a default partition. Existing rows and sale_ids are
+-- kept. The views that depend on property_sales are dropped and recreated.
+--
+-- Also adds:
+--   * a covering partial index on property_sales.listing_id for the view joins
+--   * a partial index on unmatched sales (listing_id IS NULL)
+--   * an index on listing_locations.location_id
+--   * BRIN indexes on listings.created_at and property_sales.created_at
+
+DROP MATERIALIZED VIEW IF EXISTS "listing_sales_view";
+DROP MATERIALIZED VIEW IF EXISTS "location_market_performance";
+DROP MATERIALIZED VIEW IF EXISTS "housing_cooperative_performance";
+DROP VIEW IF EXISTS "unmatched_sales_view";
+
+-- Create the yearly partition of property_sales for the given year if it doesn't exist
+CREATE OR REPLACE FUNCTION create_property_sales_partition(partition_year INTEGER)
+RETURNS VOID AS $$
+BEGIN
+    EXECUTE format(
+        'CREATE TABLE IF NOT EXISTS %I PARTITION OF property_sales FOR VALUES FROM (%L) TO (%L)',
+        'property_sales_y' || partition_year,
+        make_date(partition_year, 1, 1),
+        make_date(partition_year + 1, 1, 1)
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TABLE "property_sales_partitioned" (
+    "sale_id" BIGINT NOT NULL DEFAULT nextval('property_sales_sale_id_seq'),
+    "sale_hemnet_id" BIGINT NOT NULL,
+    "listing_id" BIGINT,  -- Can be NULL if we don't have the original listing
+    "listing_hemnet_id" BIGINT NOT NULL,  -- original_hemnet_id from the scraper
+    "final_price" DECIMAL(15, 2) NOT NULL,
+    "asking_price" DECIMAL(15, 2),  -- Could be different from the original listing
+    "price_change" DECIMAL(15, 2),  -- Difference between asking and final
+    "price_change_percentage" DECIMAL(8, 2),
+    "sale_date" DATE NOT NULL,
+    "sale_date_str" VARCHAR(50),  -- Original string format from scraped data
+    "broker_agency" VARCHAR(255),
+    "living_area" DECIMAL(10, 2),
+    "land_area" DECIMAL(12, 2),
+    "number_of_rooms" DECIMAL(4, 1),
+    "construction_year" INTEGER,
+    "street_address" VARCHAR(255),
+    "area" VARCHAR(255),
+    "municipality" VARCHAR(255),
+    "running_costs" DECIMAL(10, 2),
+    "url" VARCHAR(255) NOT NULL,
+    "created_at" TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    "updated_at" TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT "property_sales_listing_id_fkey" FOREIGN KEY ("listing_id") 
+        REFERENCES "listings" ("listing_id") ON DELETE SET NULL,
+    CONSTRAINT "property_sales_price_check" CHECK (final_price >= 0)
+) PARTITION BY RANGE ("sale_date");
+
+CREATE TABLE "property_sales_default" PARTITION OF "property_sales_partitioned" DEFAULT;
+
+DO $$
+DECLARE
+    first_year INTEGER;
+    partition_year INTEGER;
+BEGIN
+    SELECT LEAST(COALESCE(EXTRACT(YEAR FROM MIN(sale_date))::INTEGER, 2010), 2010)
+    INTO first_year
+    FROM property_sales;
+
+    FOR partition_year IN first_year .. EXTRACT(YEAR FROM CURRENT_DATE)::INTEGER + 1 LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF property_sales_partitioned FOR VALUES FROM (%L) TO (%L)',
+            'property_sales_y' || partition_year,
+            make_date(partition_year, 1, 1),
+            make_date(partition_year + 1, 1, 1)
+        );
+    END LOOP;
+END $$;
+
+INSERT INTO "property_sales_partitioned" (
+    sale_id, sale_hemnet_id, listing_id, listing_hemnet_id, final_price, asking_price,
+    price_change, price_change_percentage, sale_date, sale_date_str, broker_agency,
+    living_area, land_area, number_of_rooms, construction_year, street_address, area,
+    municipality, running_costs, url, created_at, updated_at
+)
+SELECT
+    sale_id, sale_hemnet_id, listing_id, listing_hemnet_id, final_price, asking_price,
+    price_change, price_change_percentage, sale_date, sale_date_str, broker_agency,
+    living_area, land_area, number_of_rooms, construction_year, street_address, area,
+    municipality, running_costs, url, created_at, updated_at
+FROM "property_sales";
+
+ALTER SEQUENCE "property_sales_sale_id_seq" OWNED BY NONE;
+DROP TABLE "property_sales";
+ALTER TABLE "property_sales_partitioned" RENAME TO "property_sales";
+ALTER SEQUENCE "property_sales_sale_id_seq" OWNED BY "property_sales"."sale_id";
+
+ALTER TABLE "property_sales" ADD CONSTRAINT "property_sales_pkey" PRIMARY KEY ("sale_id", "sale_date");
+ALTER TABLE "property_sales" ADD CONSTRAINT "property_sales_sale_hemnet_id_key" UNIQUE ("sale_hemnet_id", "sale_date");
+ALTER TABLE "property_sales" ADD CONSTRAINT "property_sales_url_key" UNIQUE ("url", "sale_date");
+
+CREATE INDEX "idx_property_sales_listing_id" ON "property_sales" ("listing_id")
+INCLUDE ("sale_date", "final_price", "price_change_percentage")
+WHERE listing_id IS NOT NULL;
+CREATE INDEX "idx_property_sales_listing_hemnet_id" ON "property_sales" ("listing_hemnet_id");
+CREATE INDEX "idx_property_sales_unmatched" ON "property_sales" ("listing_hemnet_id")
+WHERE listing_id IS NULL;
+CREATE INDEX "idx_property_sales_sale_date" ON "property_sales" ("sale_date");
+CREATE INDEX "idx_property_sales_final_price" ON "property_sales" ("final_price");
+CREATE INDEX "idx_property_sales_broker_agency" ON "property_sales" ("broker_agency");
+CREATE INDEX "idx_property_sales_created_at_brin" ON "property_sales" USING BRIN ("created_at");
+
+CREATE TRIGGER update_property_sales_timestamp BEFORE UPDATE ON "property_sales" FOR EACH ROW EXECUTE PROCEDURE update_timestamp();
+
+CREATE INDEX IF NOT EXISTS "idx_listings_created_at_brin" ON "listings" USING BRIN ("created_at");
+CREATE INDEX IF NOT EXISTS "idx_listing_locations_location_id" ON "listing_locations" ("location_id") INCLUDE ("listing_id");
+
+-- View to join listings with their sales data
+CREATE MATERIALIZED VIEW "listing_sales_view" AS
+SELECT 
+    l.listing_id,
+    l.listing_hemnet_id,
+    l.street_address,
+    l.postcode,
+    l.asking_price AS original_asking_price,
+    l.published_date,
+    ps.sale_id,
+    ps.sale_hemnet_id,
+    ps.final_price,
+    ps.sale_date,
+    ps.price_change,
+    ps.price_change_percentage,
+    (ps.final_price - l.asking_price) AS price_difference,
+    CASE 
+        WHEN l.asking_price > 0 THEN 
+            ((ps.final_price - l.asking_price) / l.asking_price * 100)
+        ELSE NULL
+    END AS price_difference_percentage,
+    l.living_area,
+    CASE 
+        WHEN l.living_area > 0 THEN 
+            (ps.final_price / l.living_area)
+        ELSE NULL
+    END AS final_price_per_sqm,
+    l.broker_id,
+    b.name AS broker_name,
+    ps.broker_agency,
+    l.housing_form_id,
+    hft.name AS housing_form_name,
+    l.tenure_id,
+    tt.name AS tenure_name,
+    l.housing_cooperative_id,
+    hc.name AS housing_cooperative_name,
+    (ps.sale_date - l.published_date) AS days_on_market
+FROM 
+    "listings" l
+JOIN 
+    "property_sales" ps ON l.listing_id = ps.listing_id
+LEFT JOIN 
+    "brokers" b ON l.broker_id = b.broker_id
+LEFT JOIN 
+    "housing_form_types" hft ON l.housing_form_id = hft.housing_form_id
+LEFT JOIN 
+    "tenure_types" tt ON l.tenure_id = tt.tenure_id
+LEFT JOIN
+    "housing_cooperatives" hc ON l.housing_cooperative_id = hc.housing_cooperative_id;
+
+CREATE UNIQUE INDEX "idx_listing_sales_view_sale_id" ON "listing_sales_view" ("sale_id");
+CREATE INDEX "idx_listing_sales_view_listing_id" ON "listing_sales_view" ("listing_id");
+CREATE INDEX "idx_listing_sales_view_sale_date" ON "listing_sales_view" ("sale_date");
+
+-- View for unmatched sales (sold listings we don't have the original listing for)
+CREATE VIEW "unmatched_sales_view" AS
+SELECT 
+    ps.sale_id,
+    ps.sale_hemnet_id,
+    ps.listing_hemnet_id,
+    ps.final_price,
+    ps.asking_price,
+    ps.price_change,
+    ps.price_change_percentage,
+    ps.sale_date,
+    ps.broker_agency,
+    ps.living_area,
+    ps.land_area,
+    ps.number_of_rooms,
+    ps.construction_year,
+    ps.street_address,
+    ps.area,
+    ps.municipality,
+    ps.running_costs,
+    ps.url
+FROM 
+    "property_sales" ps
+WHERE 
+    ps.listing_id IS NULL;
+
+-- View for market performance by location
+CREATE MATERIALIZED VIEW "location_market_performance" AS
+SELECT 
+    loc.location_id,
+    loc.location_name,
+    loc.type,
+    COUNT(DISTINCT l.listing_id) AS total_listings,
+    COUNT(DISTINCT ps.sale_id) AS total_sales,
+    ROUND(AVG(ps.final_price), 2) AS avg_final_price,
+    ROUND(AVG(ps.price_change_percentage), 2) AS avg_price_change_percentage,
+    ROUND(AVG(ps.sale_date - l.published_date), 1) AS avg_days_on_market,
+    ROUND(AVG(CASE WHEN l.living_area > 0 THEN ps.final_price / l.living_area ELSE NULL END), 2) AS avg_price_per_sqm
+FROM 
+    "locations" loc
+JOIN 
+    "listing_locations" ll ON loc.location_id = ll.location_id
+JOIN 
+    "listings" l ON ll.listing_id = l.listing_id
+LEFT JOIN 
+    "property_sales" ps ON l.listing_id = ps.listing_id
+WHERE 
+    ps.sale_id IS NOT NULL
+GROUP BY 
+    loc.location_id, loc.location_name, loc.type;
+
+CREATE UNIQUE INDEX "idx_location_market_performance_location_id" ON "location_market_performance" ("location_id");
+
+-- View for housing cooperative performance
+CREATE MATERIALIZED VIEW "housing_cooperative_performance" AS
+SELECT
+    hc.housing_cooperative_id,
+    hc.name AS housing_cooperative_name,
+    COUNT(DISTINCT l.listing_id) AS total_listings,
+    COUNT(DISTINCT ps.sale_id) AS total_sales,
+    ROUND(AVG(l.asking_price), 2) AS avg_asking_price,
+    ROUND(AVG(ps.final_price), 2) AS avg_final_price,
+    ROUND(AVG(l.squaremeter_price), 2) AS avg_sqm_price_asking,
+    ROUND(AVG(CASE WHEN l.living_area > 0 THEN ps.final_price / l.living_area ELSE NULL END), 2) AS avg_sqm_price_final,
+    ROUND(AVG(l.fee), 2) AS avg_monthly_fee,
+    ROUND(AVG(ps.price_change_percentage), 2) AS avg_price_change_percentage,
+    ROUND(AVG(ps.sale_date - l.published_date), 1) AS avg_days_on_market
+FROM
+    "housing_cooperatives" hc
+JOIN
+    "listings" l ON hc.housing_cooperative_id = l.housing_cooperative_id
+LEFT JOIN
+    "property_sales" ps ON l.listing_id = ps.listing_id
+GROUP BY
+    hc.housing_cooperative_id, hc.name;
+
+CREATE UNIQUE INDEX "idx_housing_cooperative_performance_id" ON "housing_cooperative_performance" ("housing_cooperative_id");
@@ -0,0 +1,10 @@
+-- Migration 003: store coordinates for sold listings
+--
+-- The sold scraper now extracts coordinates from the Apollo state, like the
+-- active scraper does for listings.
+
+ALTER TABLE "property_sales" ADD COLUMN IF NOT EXISTS "latitude" DECIMAL(10, 8);
+ALTER TABLE "property_sales" ADD COLUMN IF NOT EXISTS "longitude" DECIMAL(11, 8);
+
+CREATE INDEX IF NOT EXISTS "idx_property_sales_location" ON "property_sales" ("longitude", "latitude")
+WHERE latitude IS NOT NULL AND longitude IS NOT NULL;
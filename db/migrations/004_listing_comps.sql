@@ -0,0 +1,24 @@
+-- Migration 004: comparable sales per listing
+--
+-- Filled by analytics/comps.py for newly scraped active listings after each
+-- run. Sales are referenced by (sale_id, sale_date), the partitioned
+-- property_sales primary key.
+
+CREATE TABLE IF NOT EXISTS "listing_comps" (
+    "listing_id" BIGINT NOT NULL,
+    "rank" SMALLINT NOT NULL,
+    "sale_id" BIGINT NOT NULL,
+    "sale_date" DATE NOT NULL,
+    "location_id" BIGINT NOT NULL,
+    "score" REAL NOT NULL,
+    "created_at" TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY ("listing_id", "rank"),
+    CONSTRAINT "listing_comps_listing_id_fkey" FOREIGN KEY ("listing_id") 
+        REFERENCES "listings" ("listing_id") ON DELETE CASCADE,
+    CONSTRAINT "listing_comps_sale_fkey" FOREIGN KEY ("sale_id", "sale_date") 
+        REFERENCES "property_sales" ("sale_id", "sale_date") ON DELETE CASCADE,
+    CONSTRAINT "listing_comps_location_id_fkey" FOREIGN KEY ("location_id") 
+        REFERENCES "locations" ("location_id") ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS "idx_listing_comps_sale" ON "listing_comps" ("sale_id", "sale_date");
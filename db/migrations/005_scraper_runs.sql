@@ -0,0 +1,21 @@
+-- Migration 005: scraper run history
+--
+-- The scheduler records every job run with its outcome, duration and item
+-- counters, including runs skipped because another container held the job's
+-- advisory lock.
+
+CREATE TABLE IF NOT EXISTS "scraper_runs" (
+    "run_id" BIGSERIAL PRIMARY KEY,
+    "job" VARCHAR(50) NOT NULL,
+    "status" VARCHAR(20) NOT NULL DEFAULT 'running',
+    "started_at" TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "finished_at" TIMESTAMP WITH TIME ZONE,
+    "duration_seconds" DECIMAL(10, 2),
+    "time_budget_seconds" INTEGER,
+    "items_processed" INTEGER,
+    "stats" JSONB,
+    "error" TEXT,
+    CONSTRAINT "scraper_runs_status_check" CHECK (status IN ('running', 'completed', 'budget_exhausted', 'failed', 'skipped'))
+);
+
+CREATE INDEX IF NOT EXISTS "idx_scraper_runs_job_started_at" ON "scraper_runs" ("job", "started_at" DESC);
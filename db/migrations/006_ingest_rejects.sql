@@ -0,0 +1,19 @@
+-- Migration 006: quarantine for records that fail validation
+--
+-- Scraped records are validated against the schema's constraints before they
+-- are written; records that would be rejected are stored here with the fields
+-- and reasons they failed on.
+
+CREATE TABLE IF NOT EXISTS "ingest_rejects" (
+    "reject_id" BIGSERIAL PRIMARY KEY,
+    "record_type" VARCHAR(20) NOT NULL,
+    "hemnet_id" BIGINT,
+    "url" TEXT,
+    "fields" TEXT[] NOT NULL,  -- Fields that failed validation
+    "reasons" JSONB NOT NULL,  -- {field: reason}
+    "record" JSONB NOT NULL,  -- The extracted record as it was rejected
+    "rejected_at" TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT "ingest_rejects_record_type_check" CHECK (record_type IN ('listing', 'sale'))
+);
+
+CREATE INDEX IF NOT EXISTS "idx_ingest_rejects_type_rejected_at" ON "ingest_rejects" ("record_type", "rejected_at" DESC);
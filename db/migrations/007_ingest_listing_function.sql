@@ -0,0 +1,147 @@
+-- Migration 007: server-side listing ingest
+--
+-- ingest_listing(jsonb) stores a whole extracted listing, its lookup values,
+-- broker, agencies, locations and amenities in one call instead of a client
+-- round trip (and commit) per row. Used by save_to_database when
+-- USE_SERVER_INGEST is set.
+
+-- Store one extracted listing with its dimension rows and child links in a
+-- single atomic call. The argument is the listing dictionary built by the
+-- active listings scraper (save_to_database's input) as JSONB; returns the new
+-- listing_id. Any failure, including an already stored listing, rolls back
+-- the whole call.
+CREATE OR REPLACE FUNCTION ingest_listing(listing JSONB)
+RETURNS BIGINT AS $$
+DECLARE
+    v_housing_form_id INTEGER;
+    v_tenure_id INTEGER;
+    v_energy_classification_id INTEGER;
+    v_housing_cooperative_id INTEGER;
+    v_broker_id BIGINT;
+    v_listing_id BIGINT;
+    v_agency_id BIGINT;
+    v_location_id BIGINT;
+    v_location_type VARCHAR(255);
+    v_amenity_id BIGINT;
+    item JSONB;
+    amenity TEXT;
+BEGIN
+    -- Lookup values: insert if missing, then read the id (also covers a concurrent insert)
+    INSERT INTO housing_form_types (name) VALUES (listing->>'housing_form') ON CONFLICT (name) DO NOTHING;
+    SELECT housing_form_id INTO v_housing_form_id FROM housing_form_types WHERE name = listing->>'housing_form';
+
+    INSERT INTO tenure_types (name) VALUES (listing->>'tenure') ON CONFLICT (name) DO NOTHING;
+    SELECT tenure_id INTO v_tenure_id FROM tenure_types WHERE name = listing->>'tenure';
+
+    IF COALESCE(listing->>'energy_classification', '') <> '' THEN
+        INSERT INTO energy_classifications (classification) VALUES (listing->>'energy_classification')
+        ON CONFLICT (classification) DO NOTHING;
+        SELECT energy_classification_id INTO v_energy_classification_id
+        FROM energy_classifications WHERE classification = listing->>'energy_classification';
+    END IF;
+
+    IF COALESCE(listing#>>'{housing_cooperative,name}', '') <> '' THEN
+        INSERT INTO housing_cooperatives (name) VALUES (listing#>>'{housing_cooperative,name}')
+        ON CONFLICT (name) DO NOTHING;
+        SELECT housing_cooperative_id INTO v_housing_cooperative_id
+        FROM housing_cooperatives WHERE name = listing#>>'{housing_cooperative,name}';
+    END IF;
+
+    IF listing#>>'{broker,hemnetId}' IS NULL OR COALESCE(listing#>>'{broker,name}', '') = '' THEN
+        RAISE EXCEPTION 'Missing required broker data for listing %', listing->>'hemnet_id';
+    END IF;
+    INSERT INTO brokers (broker_hemnet_id, name)
+    VALUES ((listing#>>'{broker,hemnetId}')::BIGINT, listing#>>'{broker,name}')
+    ON CONFLICT (broker_hemnet_id) DO NOTHING;
+    SELECT broker_id INTO v_broker_id FROM brokers WHERE broker_hemnet_id = (listing#>>'{broker,hemnetId}')::BIGINT;
+
+    INSERT INTO listings (
+        listing_hemnet_id, url, street_address, postcode, tenure_id, number_of_rooms,
+        asking_price, squaremeter_price, fee, yearly_arrendee_fee, yearly_leasehold_fee,
+        running_costs, construction_year, living_area, is_foreclosure, is_new_construction,
+        is_project, is_upcoming, supplemental_area, land_area, housing_form_id,
+        housing_cooperative_id, energy_classification_id, floor, published_date, broker_id,
+        closest_water_distance_meters, coastline_distance_meters, description,
+        latitude, longitude
+    ) VALUES (
+        (listing->>'hemnet_id')::BIGINT,
+        'https://www.hemnet.se/bostad/' || (listing->>'hemnet_id'),
+        listing->>'street_address',
+        listing->>'post_code',
+        v_tenure_id,
+        (listing->>'number_of_rooms')::NUMERIC,
+        (listing->>'asking_price')::NUMERIC,
+        (listing->>'square_meter_price')::NUMERIC,
+        (listing->>'fee')::NUMERIC,
+        (listing->>'yearly_arrende_fee')::NUMERIC,
+        (listing->>'yearly_leasehold_fee')::NUMERIC,
+        (listing->>'running_costs')::NUMERIC,
+        (listing->>'construction_year')::INTEGER,
+        (listing->>'living_area')::NUMERIC,
+        (listing->>'is_foreclosure')::BOOLEAN,
+        (listing->>'is_new_construction')::BOOLEAN,
+        (listing->>'is_project')::BOOLEAN,
+        (listing->>'is_upcoming')::BOOLEAN,
+        (listing->>'supplemental_area')::NUMERIC,
+        (listing->>'land_area')::NUMERIC,
+        v_housing_form_id,
+        v_housing_cooperative_id,
+        v_energy_classification_id,
+        (listing->>'floor')::INTEGER,
+        (listing->>'published_date')::DATE,
+        v_broker_id,
+        (listing->>'closest_water_distance_meters')::INTEGER,
+        (listing->>'coastline_distance_meters')::INTEGER,
+        listing->>'description',
+        (listing->>'latitude')::NUMERIC,
+        (listing->>'longitude')::NUMERIC
+    ) RETURNING listing_id INTO v_listing_id;
+
+    FOR item IN SELECT value FROM jsonb_array_elements(COALESCE(listing->'broker_agencies', '[]'::JSONB)) LOOP
+        CONTINUE WHEN item->>'hemnetId' IS NULL OR COALESCE(item->>'name', '') = '';
+        INSERT INTO broker_agencies (agency_hemnet_id, name)
+        VALUES ((item->>'hemnetId')::BIGINT, item->>'name')
+        ON CONFLICT (agency_hemnet_id) DO NOTHING;
+        SELECT agency_id INTO v_agency_id FROM broker_agencies WHERE agency_hemnet_id = (item->>'hemnetId')::BIGINT;
+
+        IF NOT EXISTS (
+            SELECT 1 FROM broker_agency_relationships
+            WHERE broker_id = v_broker_id AND agency_id = v_agency_id AND end_date IS NULL
+        ) THEN
+            INSERT INTO broker_agency_relationships (broker_id, agency_id) VALUES (v_broker_id, v_agency_id)
+            ON CONFLICT DO NOTHING;
+        END IF;
+
+        INSERT INTO listing_agencies (listing_id, agency_id) VALUES (v_listing_id, v_agency_id)
+        ON CONFLICT DO NOTHING;
+    END LOOP;
+
+    FOR item IN SELECT value FROM jsonb_array_elements(COALESCE(listing->'locations', '[]'::JSONB)) LOOP
+        CONTINUE WHEN item->>'hemnetId' IS NULL OR COALESCE(item->>'name', '') = '';
+        SELECT location_id, type INTO v_location_id, v_location_type
+        FROM locations WHERE location_hemnet_id = (item->>'hemnetId')::BIGINT;
+        IF v_location_id IS NULL THEN
+            INSERT INTO locations (location_hemnet_id, location_name, type)
+            VALUES ((item->>'hemnetId')::BIGINT, item->>'name', item->>'type')
+            ON CONFLICT (location_hemnet_id) DO UPDATE SET type = COALESCE(EXCLUDED.type, locations.type)
+            RETURNING location_id INTO v_location_id;
+        ELSIF item->>'type' IS NOT NULL AND v_location_type IS DISTINCT FROM item->>'type' THEN
+            UPDATE locations SET type = item->>'type' WHERE location_id = v_location_id;
+        END IF;
+
+        INSERT INTO listing_locations (listing_id, location_id) VALUES (v_listing_id, v_location_id)
+        ON CONFLICT DO NOTHING;
+    END LOOP;
+
+    FOR amenity IN
+        SELECT key FROM jsonb_each(COALESCE(listing->'relevant_amenities', '{}'::JSONB)) WHERE value = 'true'::JSONB
+    LOOP
+        INSERT INTO amenities (amenity_name) VALUES (amenity) ON CONFLICT (amenity_name) DO NOTHING;
+        SELECT amenity_id INTO v_amenity_id FROM amenities WHERE amenity_name = amenity;
+        INSERT INTO listing_amenities (listing_id, amenity_id) VALUES (v_listing_id, v_amenity_id)
+        ON CONFLICT DO NOTHING;
+    END LOOP;
+
+    RETURN v_listing_id;
+END;
+$$ LANGUAGE plpgsql;
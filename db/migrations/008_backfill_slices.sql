@@ -0,0 +1,30 @@
+-- Migration 008: sold listings backfill checkpoints
+--
+-- The backfill splits the sold search into region, item type and price band
+-- slices that fit under the 50-page pagination cap. Each slice is a row here
+-- with its status and last stored page, so a stopped backfill resumes without
+-- refetching finished slices.
+
+CREATE TABLE IF NOT EXISTS "backfill_slices" (
+    "slice_key" VARCHAR(255) PRIMARY KEY,  -- The slice's search parameters
+    "location_hemnet_id" BIGINT NOT NULL,
+    "item_type" VARCHAR(50) NOT NULL,
+    "price_min" BIGINT NOT NULL,
+    "price_max" BIGINT,  -- NULL for the open-ended top band
+    "sold_age" VARCHAR(20),
+    "parent_key" VARCHAR(255),  -- The slice this one was split from
+    "status" VARCHAR(20) NOT NULL DEFAULT 'pending',
+    "last_page" INTEGER NOT NULL DEFAULT 0,  -- Last result page whose sales are stored
+    "sales_found" INTEGER NOT NULL DEFAULT 0,
+    "sales_inserted" INTEGER NOT NULL DEFAULT 0,
+    "truncated" BOOLEAN NOT NULL DEFAULT FALSE,  -- Results continued past the last reachable page
+    "attempts" INTEGER NOT NULL DEFAULT 0,
+    "claimed_by" VARCHAR(100),
+    "claimed_at" TIMESTAMP WITH TIME ZONE,
+    "completed_at" TIMESTAMP WITH TIME ZONE,
+    "error" TEXT,
+    "created_at" TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT "backfill_slices_status_check" CHECK (status IN ('pending', 'in_progress', 'completed', 'split', 'failed'))
+);
+
+CREATE INDEX IF NOT EXISTS "idx_backfill_slices_status" ON "backfill_slices" ("status", "claimed_at");
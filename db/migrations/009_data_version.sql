@@ -0,0 +1,15 @@
+-- Migration 009: data version for read caches
+--
+-- A single counter bumped when a scraper run finishes. The read service keys
+-- its cached responses and ETags on it, so cached aggregates are dropped as
+-- soon as a run may have changed them.
+
+CREATE TABLE IF NOT EXISTS "data_version" (
+    "id" BOOLEAN PRIMARY KEY DEFAULT TRUE,  -- Single row
+    "version" BIGINT NOT NULL DEFAULT 0,
+    "run_id" BIGINT,  -- The run that last bumped it
+    "updated_at" TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT "data_version_single_row" CHECK (id)
+);
+
+INSERT INTO "data_version" DEFAULT VALUES ON CONFLICT DO NOTHING;
@@ -0,0 +1,17 @@
+-- Migration 010: full-text and trigram search over listings
+--
+-- Keyword queries over descriptions and street addresses were sequential
+-- scans with ILIKE. listings gets a generated Swedish tsvector of the address
+-- (weight A) and description (weight B) with a GIN index, and street_address
+-- a trigram GIN index for partial and misspelled street names. Adding the
+-- stored column rewrites the listings table once.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE "listings" ADD COLUMN IF NOT EXISTS "search_vector" TSVECTOR GENERATED ALWAYS AS (
+    setweight(to_tsvector('swedish', coalesce(street_address, '')), 'A') ||
+    setweight(to_tsvector('swedish', coalesce(description, '')), 'B')
+) STORED;
+
+CREATE INDEX IF NOT EXISTS "idx_listings_search_vector" ON "listings" USING GIN ("search_vector");
+CREATE INDEX IF NOT EXISTS "idx_listings_street_address_trgm" ON "listings" USING GIN ("street_address" gin_trgm_ops);
@@ -0,0 +1,21 @@
+-- Migration 011: crawl planner state
+--
+-- Budgeted scraper runs serve their work from a priority queue: new listings
+-- and sales first, then known listings due for a change check, then other
+-- refetches. crawl_deferred keeps the new and due detail pages a run had no
+-- budget left for, so the next run starts with them. listing_checks records
+-- when each listing was last checked, which decides whether it is due.
+
+CREATE TABLE IF NOT EXISTS "crawl_deferred" (
+    "job" VARCHAR(50) NOT NULL,
+    "url" VARCHAR(255) NOT NULL,
+    "priority" SMALLINT NOT NULL,  -- crawl_planner priority: 0 new, 2 due for a change check
+    "position" INTEGER NOT NULL,  -- Order within the priority when deferred
+    "deferred_at" TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY ("job", "url")
+);
+
+CREATE TABLE IF NOT EXISTS "listing_checks" (
+    "listing_hemnet_id" BIGINT PRIMARY KEY,
+    "checked_at" TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
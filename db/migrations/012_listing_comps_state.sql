@@ -0,0 +1,23 @@
+-- Migration 012: when each listing's comps were computed
+--
+-- analytics/comps.py used to treat a listing as pending while it had no rows
+-- in listing_comps, so listings without comps were recomputed on every run
+-- and listings with comps never picked up later sales. listing_comps_state
+-- records every computation, including those that found no comps; a listing
+-- is recomputed once its row is older than the refresh interval or than the
+-- newest comparable sale stored or linked since. Listings that already have
+-- comps start from when those were written.
+
+CREATE TABLE IF NOT EXISTS "listing_comps_state" (
+    "listing_id" BIGINT PRIMARY KEY,
+    "computed_at" TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    "comps" SMALLINT NOT NULL,  -- Comps found, 0 when the listing had no comparable sales
+    CONSTRAINT "listing_comps_state_listing_id_fkey" FOREIGN KEY ("listing_id")
+        REFERENCES "listings" ("listing_id") ON DELETE CASCADE
+);
+
+INSERT INTO "listing_comps_state" ("listing_id", "computed_at", "comps")
+SELECT listing_id, COALESCE(MIN(created_at), CURRENT_TIMESTAMP), COUNT(*)
+FROM listing_comps
+GROUP BY listing_id
+ON CONFLICT ("listing_id") DO NOTHING;
@@ -0,0 +1,33 @@
+-- Migration 013: sale ids and URLs unique across property_sales partitions
+--
+-- A partitioned table's unique constraints must include the partition key, so
+-- since migration 002 property_sales only keeps sale_hemnet_id and url unique
+-- per sale_date. sale_keys is a plain table holding both globally:
+-- store_sold_listing claims a sale's key in the same transaction as its insert,
+-- so concurrent writers that parsed different sale dates for the same sale
+-- (backfill workers, the scheduled sold job, fast mode cards) store it once.
+-- Keys are removed together with their sale.
+
+CREATE TABLE IF NOT EXISTS "sale_keys" (
+    "sale_hemnet_id" BIGINT PRIMARY KEY,
+    "url" VARCHAR(255) NOT NULL UNIQUE
+);
+
+-- Existing sales, keeping the first stored one where a key appears twice
+INSERT INTO "sale_keys" ("sale_hemnet_id", "url")
+SELECT sale_hemnet_id, url
+FROM "property_sales"
+ORDER BY sale_id
+ON CONFLICT DO NOTHING;
+
+CREATE OR REPLACE FUNCTION delete_sale_key()
+RETURNS TRIGGER AS $$
+BEGIN
+    DELETE FROM sale_keys WHERE sale_hemnet_id = OLD.sale_hemnet_id AND url = OLD.url;
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS delete_property_sales_key ON "property_sales";
+CREATE TRIGGER delete_property_sales_key AFTER DELETE ON "property_sales"
+FOR EACH ROW EXECUTE PROCEDURE delete_sale_key();
@@ -0,0 +1,31 @@
+-- Migration 014: disjoint backfill price bands
+--
+-- Backfill slices used to share their price bounds with the next slice, e.g.
+-- selling_price_max=1000000 and selling_price_min=1000000, and Hemnet includes
+-- both bounds, so sales at a boundary price were listed by two slices. Upper
+-- bounds are now one below the next slice's lower bound. Existing slices are
+-- moved to the new bounds and keys, which are the ones sold_backfill.py now
+-- plans and splits into, so finished slices aren't fetched again. Slices not
+-- finished yet start over from their first page, since their page offsets
+-- change.
+
+CREATE TEMPORARY TABLE "backfill_slice_keys" AS
+SELECT
+    slice_key AS old_key,
+    replace(slice_key, 'selling_price_max=' || price_max, 'selling_price_max=' || (price_max - 1)) AS new_key
+FROM "backfill_slices"
+WHERE price_max IS NOT NULL AND price_max % 50000 = 0;
+
+UPDATE "backfill_slices" bs
+SET slice_key = k.new_key,
+    price_max = bs.price_max - 1,
+    last_page = CASE WHEN bs.status IN ('completed', 'split') THEN bs.last_page ELSE 0 END
+FROM "backfill_slice_keys" k
+WHERE bs.slice_key = k.old_key;
+
+UPDATE "backfill_slices" bs
+SET parent_key = k.new_key
+FROM "backfill_slice_keys" k
+WHERE bs.parent_key = k.old_key;
+
+DROP TABLE "backfill_slice_keys";
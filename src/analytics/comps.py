@@ -0,0 +1,361 @@
+"""
+Comparable-sales (comps) engine.
+
+CompsIndex holds recent matched sales as flat arrays sorted by
+(bucket, living_area), where a bucket is one (location_id, housing_form)
+pair. A listing's candidates in a bucket are the contiguous slice whose
+living area is within the tolerance, found with two searchsorted calls.
+Candidates are scored on living area, rooms, sale age and distance, and the
+k best are kept with argpartition.
+
+A listing belongs to several nested locations (area, municipality, county).
+It is matched against its most specific location, the smallest bucket, that
+has at least k candidates, and falls back to the location with the most
+candidates otherwise.
+
+update_listing_comps runs this in bulk for every active listing whose comps
+are missing or stale and writes the results to listing_comps, recording each
+computation in listing_comps_state.
+"""
+import logging
+from datetime import date, timedelta
+
+import numpy as np
+from psycopg2.extras import execute_values
+
+from analytics.market_stats import factorize
+from analytics.spatial_index import haversine_m
+from utils.database_utils import get_db_connection
+from utils.read_utils import load_arrays, rows_to_arrays
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_K = 10
+DEFAULT_MAX_AGE_DAYS = 365
+DEFAULT_AREA_TOLERANCE = 0.25   # candidates are within ±25% of the listing's living area
+DEFAULT_REFRESH_DAYS = 30       # comps are recomputed at least this often, as sales age
+
+# Score terms are scaled so that each costs about 1 at its limit; lower is better
+ROOMS_SCALE = 2.0               # a two-room difference costs as much as the full area tolerance
+DISTANCE_SCALE_M = 5000.0
+MISSING_TERM = 0.5              # cost of an unknown room count or distance
+
+_COMPS_COLUMNS = ("listing_id", "rank", "sale_id", "sale_date", "location_id", "score")
+
+
+class CompsIndex:
+    """
+    Recent sales bucketed by (location_id, housing_form) and sorted by living area.
+
+    Args:
+        sales: {column: array} with sale_id, sale_date, location_id, housing_form,
+            living_area, number_of_rooms, latitude and longitude, as returned by
+            load_arrays("comparable_sales")
+        as_of: Date sale ages are measured from (default: today)
+        max_age_days: Sales older than this are left out
+        area_tolerance: Relative living area difference allowed for a candidate
+    """
+
+    def __init__(self, sales, as_of=None, max_age_days=DEFAULT_MAX_AGE_DAYS,
+                 area_tolerance=DEFAULT_AREA_TOLERANCE):
+        self.as_of = np.datetime64(as_of or date.today(), "D")
+        self.max_age_days = max_age_days
+        self.area_tolerance = area_tolerance
+
+        n = len(sales["sale_id"])
+        living_area = np.asarray(sales["living_area"], dtype=np.float64) if n else np.empty(0)
+        sale_date = np.asarray(sales["sale_date"], dtype="datetime64[D]") if n else np.empty(0, "datetime64[D]")
+        age_days = (self.as_of - sale_date).astype(np.int64)
+        valid = (
+            (living_area > 0)
+            & ~np.isnat(sale_date)
+            & (age_days >= 0)
+            & (age_days <= max_age_days)
+        )
+        sales = {column: np.asarray(values)[valid] for column, values in sales.items()}
+        living_area, age_days = living_area[valid], age_days[valid]
+
+        self.buckets = {}
+        if not len(living_area):
+            self.starts = self.counts = np.empty(0, dtype=np.int64)
+            self.columns = {column: values for column, values in sales.items()}
+            self.living_area = living_area
+            self.age_days = age_days
+            return
+
+        group_ids, keys = factorize(sales, ("location_id", "housing_form"))
+        n_buckets = len(keys["location_id"])
+        # Same two stable sorts as market_stats: by area, then by bucket
+        order = np.argsort(living_area, kind="stable")
+        order = order[np.argsort(group_ids[order], kind="stable")]
+
+        self.counts = np.bincount(group_ids, minlength=n_buckets)
+        self.starts = np.concatenate(([0], np.cumsum(self.counts)[:-1]))
+        self.buckets = {
+            (int(location_id), housing_form): bucket
+            for bucket, (location_id, housing_form) in enumerate(zip(keys["location_id"], keys["housing_form"]))
+        }
+        self.columns = {column: values[order] for column, values in sales.items()}
+        self.living_area = living_area[order]
+        self.age_days = age_days[order]
+        self.number_of_rooms = self.columns["number_of_rooms"].astype(np.float64)
+        self.latitude = self.columns["latitude"].astype(np.float64)
+        self.longitude = self.columns["longitude"].astype(np.float64)
+
+    def __len__(self):
+        return len(self.living_area)
+
+    def bucket_size(self, location_id, housing_form):
+        bucket = self.buckets.get((location_id, housing_form))
+        return 0 if bucket is None else int(self.counts[bucket])
+
+    def _window(self, bucket, living_area):
+        # Positions of the bucket's sales within the area tolerance of living_area
+        start = self.starts[bucket]
+        areas = self.living_area[start:start + self.counts[bucket]]
+        low = np.searchsorted(areas, living_area * (1 - self.area_tolerance), side="left")
+        high = np.searchsorted(areas, living_area * (1 + self.area_tolerance), side="right")
+        return start + low, start + high
+
+    def query(self, housing_form, living_area, location_ids, number_of_rooms=np.nan,
+              latitude=np.nan, longitude=np.nan, k=DEFAULT_K):
+        """
+        Top-k comparable sales for one listing.
+
+        Returns:
+            tuple: (positions into self.columns, scores, location_id used),
+            best first, or None if no location of the listing has candidates
+        """
+        windows = []
+        for location_id in location_ids:
+            bucket = self.buckets.get((location_id, housing_form))
+            if bucket is not None:
+                windows.append((self.counts[bucket], location_id, self._window(bucket, living_area)))
+        if not windows:
+            return None
+
+        # Most specific location (smallest bucket) with enough candidates, else the one with the most
+        windows.sort(key=lambda window: window[0])
+        chosen = next(
+            (window for window in windows if window[2][1] - window[2][0] >= k),
+            max(windows, key=lambda window: window[2][1] - window[2][0]),
+        )
+        _, location_id, (low, high) = chosen
+        if low == high:
+            return None
+
+        positions = np.arange(low, high)
+        score = np.abs(self.living_area[positions] - living_area) / (self.area_tolerance * living_area)
+        score += self.age_days[positions] / self.max_age_days
+
+        rooms = np.abs(self.number_of_rooms[positions] - number_of_rooms) / ROOMS_SCALE
+        score += np.where(np.isnan(rooms), MISSING_TERM, rooms)
+
+        if np.isfinite(latitude) and np.isfinite(longitude):
+            distance = haversine_m(latitude, longitude, self.latitude[positions], self.longitude[positions])
+            score += np.where(np.isnan(distance), MISSING_TERM, distance / DISTANCE_SCALE_M)
+        else:
+            score += MISSING_TERM
+
+        if len(score) > k:
+            best = np.argpartition(score, k - 1)[:k]
+            positions, score = positions[best], score[best]
+        order = np.argsort(score, kind="stable")
+        return positions[order], score[order], location_id
+
+def find_comps(index, listings, k=DEFAULT_K):
+    """
+    Top-k comparable sales for a batch of listings.
+
+    Args:
+        index: CompsIndex
+        listings: {column: array} with listing_id, housing_form, living_area,
+            number_of_rooms, latitude, longitude and location_ids (a list per listing)
+        k: Comps per listing
+
+    Returns:
+        dict: Arrays listing_id, rank (1 = best), sale_id, sale_date, location_id
+        and score, one row per comp
+    """
+    parts = {column: [] for column in _COMPS_COLUMNS}
+    for i, listing_id in enumerate(listings["listing_id"]):
+        result = index.query(
+            listings["housing_form"][i],
+            float(listings["living_area"][i]),
+            listings["location_ids"][i] or [],
+            number_of_rooms=float(listings["number_of_rooms"][i]),
+            latitude=float(listings["latitude"][i]),
+            longitude=float(listings["longitude"][i]),
+            k=k,
+        )
+        if result is None:
+            continue
+        positions, scores, location_id = result
+        parts["listing_id"].append(np.full(len(positions), listing_id, dtype=np.int64))
+        parts["rank"].append(np.arange(1, len(positions) + 1, dtype=np.int64))
+        parts["sale_id"].append(index.columns["sale_id"][positions])
+        parts["sale_date"].append(index.columns["sale_date"][positions])
+        parts["location_id"].append(np.full(len(positions), location_id, dtype=np.int64))
+        parts["score"].append(scores)
+
+    if not parts["listing_id"]:
+        return {
+            "listing_id": np.empty(0, dtype=np.int64),
+            "rank": np.empty(0, dtype=np.int64),
+            "sale_id": np.empty(0, dtype=np.int64),
+            "sale_date": np.empty(0, dtype="datetime64[D]"),
+            "location_id": np.empty(0, dtype=np.int64),
+            "score": np.empty(0, dtype=np.float64),
+        }
+    return {column: np.concatenate(values) for column, values in parts.items()}
+
+def load_pending_listings(conn, listing_ids=None, max_age_days=DEFAULT_MAX_AGE_DAYS,
+                          refresh_days=DEFAULT_REFRESH_DAYS):
+    """
+    Active listings to compute comps for, with their location ids.
+
+    By default these are the listings whose comps were never computed, were
+    computed more than refresh_days ago, or were computed before a sale in one
+    of the listing's (location, housing form) buckets was stored or linked to
+    its listing, going by property_sales.updated_at.
+
+    Args:
+        conn: Database connection
+        listing_ids: Recompute these listings instead
+        max_age_days: Sales older than this aren't comps and don't make comps stale
+        refresh_days: Recompute comps older than this
+
+    Returns:
+        dict: {column: array}, location_ids is an object array of lists
+    """
+    if listing_ids is not None:
+        condition, newest_sales, having = "AND l.listing_id = ANY(%(listing_ids)s)", "", ""
+        params = {"listing_ids": list(listing_ids)}
+    else:
+        condition = ""
+        # Latest change of a comparable sale per bucket
+        newest_sales = """
+            LEFT JOIN (
+                SELECT ll.location_id, l.housing_form_id, MAX(ps.updated_at) AS updated_at
+                FROM property_sales ps
+                JOIN listings l ON ps.listing_id = l.listing_id
+                JOIN listing_locations ll ON l.listing_id = ll.listing_id
+                WHERE ps.sale_date >= %(start_date)s
+                GROUP BY ll.location_id, l.housing_form_id
+            ) ns ON ns.location_id = ll.location_id AND ns.housing_form_id = l.housing_form_id
+        """
+        having = """
+            HAVING cs.computed_at IS NULL
+            OR cs.computed_at < CURRENT_TIMESTAMP - make_interval(days => %(refresh_days)s)
+            OR MAX(ns.updated_at) > cs.computed_at
+        """
+        params = {"start_date": date.today() - timedelta(days=max_age_days), "refresh_days": refresh_days}
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            SELECT l.listing_id, hft.name AS housing_form, l.living_area::float8 AS living_area,
+                   l.number_of_rooms::float8 AS number_of_rooms, l.latitude::float8 AS latitude,
+                   l.longitude::float8 AS longitude, array_agg(ll.location_id) AS location_ids
+            FROM listings l
+            JOIN housing_form_types hft ON l.housing_form_id = hft.housing_form_id
+            JOIN listing_locations ll ON l.listing_id = ll.listing_id
+            LEFT JOIN listing_comps_state cs ON l.listing_id = cs.listing_id
+            {newest_sales}
+            WHERE l.status = 'active' AND l.living_area > 0 {condition}
+            GROUP BY l.listing_id, hft.name, cs.computed_at
+            {having}
+        """, params)
+        rows = cursor.fetchall()
+        return rows_to_arrays(cursor.description, rows) if rows else None
+    finally:
+        cursor.close()
+
+def load_comps_index(as_of=None, max_age_days=DEFAULT_MAX_AGE_DAYS, conn=None, **filters):
+    """
+    Build a CompsIndex over sales from the last max_age_days days.
+
+    Filters are the keyword arguments of utils.read_utils.build_query
+    (location_ids, housing_forms).
+    """
+    as_of = as_of or date.today()
+    sales = load_arrays(
+        "comparable_sales", start_date=as_of - timedelta(days=max_age_days), conn=conn, **filters
+    )
+    if not sales:
+        sales = {"sale_id": np.empty(0, dtype=np.int64)}
+    return CompsIndex(sales, as_of=as_of, max_age_days=max_age_days)
+
+def store_comps(conn, comps, listing_ids):
+    """
+    Replace the stored comps of listing_ids with comps and record when they
+    were computed, including for listings without comps, in one transaction
+    """
+    ids, counts = np.unique(comps["listing_id"], return_counts=True)
+    found = dict(zip(ids.tolist(), counts.tolist()))
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM listing_comps WHERE listing_id = ANY(%s)", (list(listing_ids),))
+        execute_values(
+            cursor,
+            "INSERT INTO listing_comps (listing_id, rank, sale_id, sale_date, location_id, score) VALUES %s",
+            list(zip(*(comps[column].tolist() for column in _COMPS_COLUMNS))),
+            page_size=1000,
+        )
+        execute_values(
+            cursor,
+            """
+            INSERT INTO listing_comps_state (listing_id, comps) VALUES %s
+            ON CONFLICT (listing_id) DO UPDATE
+            SET computed_at = CURRENT_TIMESTAMP, comps = EXCLUDED.comps
+            """,
+            [(listing_id, found.get(listing_id, 0)) for listing_id in listing_ids],
+            page_size=1000,
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def update_listing_comps(listing_ids=None, k=DEFAULT_K, max_age_days=DEFAULT_MAX_AGE_DAYS,
+                         refresh_days=DEFAULT_REFRESH_DAYS):
+    """
+    Compute and store comps for active listings whose comps are missing or
+    stale (or for listing_ids), see load_pending_listings.
+
+    Only sales in the batch's locations and housing forms are loaded into the index.
+
+    Returns:
+        Number of listings comps were stored for
+    """
+    try:
+        conn = get_db_connection()
+        try:
+            listings = load_pending_listings(conn, listing_ids, max_age_days, refresh_days)
+            if listings is None:
+                logger.info("No listings need comps")
+                return 0
+
+            location_ids = sorted({int(location_id) for ids in listings["location_ids"] for location_id in ids})
+            housing_forms = sorted(set(listings["housing_form"]))
+            index = load_comps_index(
+                max_age_days=max_age_days, conn=conn,
+                location_ids=location_ids, housing_forms=housing_forms,
+            )
+            comps = find_comps(index, listings, k=k)
+            store_comps(conn, comps, listings["listing_id"].tolist())
+
+            with_comps = len(np.unique(comps["listing_id"]))
+            logger.info(
+                f"Stored {len(comps['listing_id'])} comps for {with_comps} of "
+                f"{len(listings['listing_id'])} listings from {len(index)} indexed sales"
+            )
+            return with_comps
+        finally:
+            conn.rollback()
+            conn.close()
+    except Exception as e:
+        logger.error(f"Error updating listing comps: {e}")
+        return 0
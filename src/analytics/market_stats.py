@@ -0,0 +1,235 @@
+"""
+Vectorized market statistics over sales arrays.
+
+All grouping is sort-and-segment: group keys are factorized into dense ids
+with np.unique, rows are sorted by (group, value), segment boundaries come
+from the per-group counts, and each statistic is computed per segment with
+index arithmetic instead of Python loops.
+
+Inputs are dictionaries of equal-length NumPy arrays, as returned by
+utils.read_utils.load_arrays. Results use the same format.
+"""
+import numpy as np
+
+from utils.read_utils import load_arrays
+
+DEFAULT_GROUP_BY = ("location_id", "housing_form")
+DEFAULT_QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+
+
+def load_sales(**filters):
+    """
+    Load matched sales per location as arrays, one row per (sale, location).
+
+    Filters are the keyword arguments of utils.read_utils.build_query
+    (start_date, end_date, location_ids, housing_forms).
+    """
+    return load_arrays("listing_sales_by_location", **filters)
+
+def _key_codes(key):
+    # Dense integer codes for one key column, numbered in key order
+    if key.dtype != object:
+        uniques, codes = np.unique(key, return_inverse=True)
+        return uniques, codes.astype(np.int64)
+
+    # Sorting a large object array is slow, so hash the (few) labels first and sort only those
+    mapping = {}
+    codes = np.fromiter(
+        (mapping.setdefault("" if value is None else value, len(mapping)) for value in key),
+        dtype=np.int64,
+        count=len(key),
+    )
+    labels = np.array(list(mapping), dtype=object)
+    order = np.argsort(labels)
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    return labels[order], rank[codes]
+
+def factorize(data, by):
+    """
+    Assign every row a dense group id for the combination of the `by` columns.
+
+    Returns:
+        tuple: (group_ids, {column: key value per group}), with groups ordered by key
+    """
+    combined = np.zeros(len(data[by[0]]), dtype=np.int64)
+    key_uniques = []
+    for column in by:
+        uniques, codes = _key_codes(data[column])
+        combined = combined * len(uniques) + codes
+        key_uniques.append((column, uniques))
+
+    group_codes, group_ids = np.unique(combined, return_inverse=True)
+
+    # Decode the mixed-radix group codes back into per-column key values
+    keys = {}
+    remainder = group_codes
+    for column, uniques in reversed(key_uniques):
+        keys[column] = uniques[remainder % len(uniques)]
+        remainder = remainder // len(uniques)
+    return group_ids, {column: keys[column] for column in by}
+
+def _sorted_segments(values, group_ids, n_groups):
+    # Drop NaNs, sort by (group, value) and return the sorted values with each group's start and size
+    valid = ~np.isnan(values)
+    values = values[valid]
+    group_ids = group_ids[valid]
+    # Two stable sorts (values, then the integer group ids) beat a lexsort on both keys
+    order = np.argsort(values, kind="stable")
+    order = order[np.argsort(group_ids[order], kind="stable")]
+    sorted_values = values[order]
+    counts = np.bincount(group_ids, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    return sorted_values, starts, counts
+
+def grouped_quantiles(values, group_ids, n_groups, quantiles=(0.5,)):
+    """
+    Per-group quantiles with linear interpolation (the same as numpy.quantile and
+    PostgreSQL's percentile_cont). NaN values are ignored.
+
+    Returns:
+        tuple: ({quantile: array of n_groups}, counts), NaN for groups without values
+    """
+    sorted_values, starts, counts = _sorted_segments(values.astype(np.float64), group_ids, n_groups)
+    has_values = counts > 0
+    results = {}
+    for q in quantiles:
+        position = starts + q * np.maximum(counts - 1, 0)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.ceil(position).astype(np.int64)
+        fraction = position - lower
+        result = np.full(n_groups, np.nan)
+        lower, upper, fraction = lower[has_values], upper[has_values], fraction[has_values]
+        result[has_values] = sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * fraction
+        results[q] = result
+    return results, counts
+
+def grouped_mean(values, group_ids, n_groups):
+    """Per-group mean ignoring NaN, NaN for groups without values"""
+    values = values.astype(np.float64)
+    valid = ~np.isnan(values)
+    sums = np.bincount(group_ids[valid], weights=values[valid], minlength=n_groups)
+    counts = np.bincount(group_ids[valid], minlength=n_groups)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+def _price_per_sqm(sales):
+    if "final_price_per_sqm" in sales:
+        return sales["final_price_per_sqm"].astype(np.float64)
+    area = sales["living_area"].astype(np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(area > 0, sales["final_price"] / area, np.nan)
+
+def median_price_per_sqm(sales, by=DEFAULT_GROUP_BY):
+    """
+    Median final price per square meter per group.
+
+    Returns:
+        Arrays for the group keys plus "sales" and "median_price_per_sqm"
+    """
+    group_ids, keys = factorize(sales, by)
+    n_groups = len(next(iter(keys.values())))
+    medians, counts = grouped_quantiles(_price_per_sqm(sales), group_ids, n_groups)
+    return {**keys, "sales": counts, "median_price_per_sqm": medians[0.5]}
+
+def bid_premium_stats(sales, by=DEFAULT_GROUP_BY):
+    """
+    Bid premium (price_change_percentage, final vs. asking price) per group.
+
+    Returns:
+        Arrays for the group keys plus "sales", "mean_premium", "median_premium",
+        "p25_premium", "p75_premium" and "share_above_asking"
+    """
+    group_ids, keys = factorize(sales, by)
+    n_groups = len(next(iter(keys.values())))
+    premium = sales["price_change_percentage"].astype(np.float64)
+    quantiles, counts = grouped_quantiles(premium, group_ids, n_groups, (0.25, 0.5, 0.75))
+
+    valid = ~np.isnan(premium)
+    above = np.bincount(group_ids[valid], weights=(premium[valid] > 0), minlength=n_groups)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        share_above = np.where(counts > 0, above / counts, np.nan)
+
+    return {
+        **keys,
+        "sales": counts,
+        "mean_premium": grouped_mean(premium, group_ids, n_groups),
+        "median_premium": quantiles[0.5],
+        "p25_premium": quantiles[0.25],
+        "p75_premium": quantiles[0.75],
+        "share_above_asking": share_above,
+    }
+
+def days_on_market_distribution(sales, by=DEFAULT_GROUP_BY, quantiles=DEFAULT_QUANTILES):
+    """
+    Days-on-market quantiles per group.
+
+    Returns:
+        Arrays for the group keys plus "sales", "mean_days" and "p<percent>_days" per quantile
+    """
+    group_ids, keys = factorize(sales, by)
+    n_groups = len(next(iter(keys.values())))
+    days = sales["days_on_market"].astype(np.float64)
+    results, counts = grouped_quantiles(days, group_ids, n_groups, quantiles)
+    distribution = {**keys, "sales": counts, "mean_days": grouped_mean(days, group_ids, n_groups)}
+    for q in quantiles:
+        distribution[f"p{int(round(q * 100))}_days"] = results[q]
+    return distribution
+
+def _month_index(sale_dates):
+    # Months since 1970-01 as int64
+    return sale_dates.astype("datetime64[M]").astype(np.int64)
+
+def rolling_monthly_index(sales, by=DEFAULT_GROUP_BY, window=3, min_sales=5):
+    """
+    Rolling monthly price index per group.
+
+    For every month, the median price per square meter over the sales of that
+    month and the previous window - 1 months. Each sale is repeated once per
+    month it contributes to, so the whole index is a single grouped median.
+    The index is 100 at each group's first month with at least min_sales sales.
+
+    Returns:
+        Arrays for the group keys plus "month" (datetime64[M]), "sales",
+        "median_price_per_sqm" and "index"
+    """
+    price = _price_per_sqm(sales)
+    months = _month_index(sales["sale_date"])
+    valid = ~np.isnan(price) & (months != np.iinfo(np.int64).min)
+
+    # Every sale contributes to its own month and the following window - 1 months
+    offsets = np.tile(np.arange(window, dtype=np.int64), int(valid.sum()))
+    expanded = {column: np.repeat(sales[column][valid], window) for column in by}
+    expanded["month"] = np.repeat(months[valid], window) + offsets
+    expanded_price = np.repeat(price[valid], window)
+
+    # Don't extend the index past the latest month with sales
+    if len(expanded_price):
+        current = expanded["month"] <= months[valid].max()
+        expanded = {column: values[current] for column, values in expanded.items()}
+        expanded_price = expanded_price[current]
+
+    group_ids, keys = factorize(expanded, tuple(by) + ("month",))
+    n_groups = len(keys["month"])
+    medians, counts = grouped_quantiles(expanded_price, group_ids, n_groups)
+    median = np.where(counts >= min_sales, medians[0.5], np.nan)
+
+    # Groups are sorted by (by..., month), so each series is a contiguous run;
+    # find each series' first month with a median and divide by it
+    series_ids, _ = factorize(keys, tuple(by))
+    has_median = ~np.isnan(median)
+    base = np.full(series_ids.max() + 1 if len(series_ids) else 0, np.nan)
+    first_rows = np.flatnonzero(has_median)
+    first_series, first_positions = np.unique(series_ids[first_rows], return_index=True)
+    base[first_series] = median[first_rows[first_positions]]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        index = 100 * median / base[series_ids]
+
+    result = {column: keys[column] for column in by}
+    result.update({
+        "month": keys["month"].astype("datetime64[M]"),
+        "sales": counts,
+        "median_price_per_sqm": median,
+        "index": index,
+    })
+    return result
@@ -0,0 +1,182 @@
+"""
+Grid index over sale coordinates for "sales within R meters" queries.
+
+Points are bucketed into a regular latitude/longitude grid whose cells are
+roughly cell_size_m on each side, and stored sorted by cell key
+(row * columns + column). The cells in one grid row are contiguous in that
+order, so the candidates for a query are one searchsorted slice per grid row
+the query circle touches. Candidates are then filtered by exact haversine
+distance.
+
+Inputs and results are dictionaries of equal-length NumPy arrays, as returned
+by utils.read_utils.load_arrays.
+"""
+import numpy as np
+
+from utils.database_utils import get_db_connection
+from utils.read_utils import load_arrays
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEGREE_LAT = np.pi * EARTH_RADIUS_M / 180
+DEFAULT_CELL_SIZE_M = 500
+
+
+def haversine_m(latitude, longitude, latitudes, longitudes):
+    """Great-circle distance in meters from one point to arrays of points"""
+    lat1, lon1 = np.radians(latitude), np.radians(longitude)
+    lat2, lon2 = np.radians(latitudes), np.radians(longitudes)
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+class SpatialIndex:
+    """
+    Grid index over the rows of a {column: array} dictionary with latitude and longitude columns.
+
+    Rows without coordinates are left out. Building is one sort; queries touch
+    only the grid rows and columns overlapping the query circle's bounding box.
+    """
+
+    def __init__(self, data, cell_size_m=DEFAULT_CELL_SIZE_M, latitude="latitude", longitude="longitude"):
+        latitudes = np.asarray(data[latitude], dtype=np.float64)
+        longitudes = np.asarray(data[longitude], dtype=np.float64)
+        valid = np.isfinite(latitudes) & np.isfinite(longitudes)
+        self.latitude_column = latitude
+        self.longitude_column = longitude
+
+        latitudes, longitudes = latitudes[valid], longitudes[valid]
+        if len(latitudes):
+            self.origin = (latitudes.min(), longitudes.min())
+            reference_latitude = np.radians(latitudes.mean())
+        else:
+            self.origin = (0.0, 0.0)
+            reference_latitude = 0.0
+
+        # Cells are square at the data's mean latitude; queries stay exact elsewhere,
+        # cells are just a little wider or narrower than cell_size_m there
+        self.cell_lat = cell_size_m / METERS_PER_DEGREE_LAT
+        self.cell_lon = cell_size_m / (METERS_PER_DEGREE_LAT * np.cos(reference_latitude))
+
+        rows, columns = self._cell(latitudes, longitudes)
+        self.n_rows = int(rows.max()) + 1 if len(rows) else 0
+        self.n_columns = int(columns.max()) + 1 if len(columns) else 0
+        keys = rows * self.n_columns + columns
+
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.latitudes = latitudes[order]
+        self.longitudes = longitudes[order]
+        self.data = {column: np.asarray(values)[valid][order] for column, values in data.items()}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _cell(self, latitudes, longitudes):
+        rows = np.floor((latitudes - self.origin[0]) / self.cell_lat).astype(np.int64)
+        columns = np.floor((longitudes - self.origin[1]) / self.cell_lon).astype(np.int64)
+        return rows, columns
+
+    def candidates(self, latitude, longitude, radius_m):
+        """Positions of all points in grid cells overlapping the query circle's bounding box"""
+        if not len(self.keys):
+            return np.empty(0, dtype=np.int64)
+
+        delta_lat = radius_m / METERS_PER_DEGREE_LAT
+        # Widest longitude span of the circle, at the bounding box edge closest to a pole
+        widest = min(abs(latitude) + delta_lat, 89.9)
+        delta_lon = radius_m / (METERS_PER_DEGREE_LAT * np.cos(np.radians(widest)))
+
+        (row_low, row_high), (column_low, column_high) = self._cell(
+            np.array([latitude - delta_lat, latitude + delta_lat]),
+            np.array([longitude - delta_lon, longitude + delta_lon]),
+        )
+        row_low, row_high = max(row_low, 0), min(row_high, self.n_rows - 1)
+        column_low, column_high = max(column_low, 0), min(column_high, self.n_columns - 1)
+        if row_low > row_high or column_low > column_high:
+            return np.empty(0, dtype=np.int64)
+
+        rows = np.arange(row_low, row_high + 1, dtype=np.int64)
+        lower = np.searchsorted(self.keys, rows * self.n_columns + column_low, side="left")
+        upper = np.searchsorted(self.keys, rows * self.n_columns + column_high, side="right")
+        return np.concatenate([np.arange(start, stop) for start, stop in zip(lower, upper)])
+
+    def within(self, latitude, longitude, radius_m, limit=None):
+        """
+        Rows within radius_m meters of a point, closest first.
+
+        Args:
+            latitude: Latitude of the point
+            longitude: Longitude of the point
+            radius_m: Search radius in meters
+            limit: Optional maximum number of rows to return
+
+        Returns:
+            dict: The indexed columns for the matching rows plus "distance_m"
+        """
+        positions = self.candidates(latitude, longitude, radius_m)
+        distances = haversine_m(latitude, longitude, self.latitudes[positions], self.longitudes[positions])
+        inside = distances <= radius_m
+        positions, distances = positions[inside], distances[inside]
+
+        order = np.argsort(distances, kind="stable")
+        if limit is not None:
+            order = order[:limit]
+        positions, distances = positions[order], distances[order]
+
+        result = {column: values[positions] for column, values in self.data.items()}
+        result["distance_m"] = distances
+        return result
+
+def load_sales_index(cell_size_m=DEFAULT_CELL_SIZE_M, **filters):
+    """
+    Build a SpatialIndex over sales with coordinates.
+
+    Filters are the keyword arguments of utils.read_utils.build_query
+    (start_date, end_date, location_ids, housing_forms).
+    """
+    return SpatialIndex(load_arrays("sales", **filters), cell_size_m=cell_size_m)
+
+def get_listing_coordinates(listing_hemnet_id, conn=None):
+    """
+    Coordinates of a listing, or of its sale if the listing itself has none.
+
+    Returns:
+        tuple: (latitude, longitude) as floats
+
+    Raises:
+        ValueError: If neither the listing nor a sale of it has coordinates
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT latitude::float8, longitude::float8 FROM listings
+            WHERE listing_hemnet_id = %s AND latitude IS NOT NULL AND longitude IS NOT NULL
+            UNION ALL
+            SELECT latitude::float8, longitude::float8 FROM property_sales
+            WHERE listing_hemnet_id = %s AND latitude IS NOT NULL AND longitude IS NOT NULL
+            LIMIT 1
+        """, (listing_hemnet_id, listing_hemnet_id))
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+        if own_conn:
+            conn.rollback()
+            conn.close()
+
+    if row is None:
+        raise ValueError(f"No coordinates stored for listing {listing_hemnet_id}")
+    return row
+
+def sales_near_listing(index, listing_hemnet_id, radius_m, limit=None, conn=None):
+    """
+    Sales within radius_m meters of a listing, closest first.
+
+    The listing's own sale, if any, is included at distance 0.
+    """
+    latitude, longitude = get_listing_coordinates(listing_hemnet_id, conn=conn)
+    return index.within(latitude, longitude, radius_m, limit=limit)
@@ -0,0 +1,102 @@
+"""
+Listing ingest benchmark: save_to_database row by row vs the ingest_listing function.
+
+Run from the src directory against a scratch database:
+
+    python -m benchmarks.ingest_benchmark --listings 2000
+
+Loads db/init.sql into a scratch schema, saves the same synthetic listings
+once through the client-side path (a SELECT/INSERT/COMMIT per lookup value,
+agency, location and amenity) and once through the server-side
+ingest_listing(jsonb) function, recreating the schema in between, and prints
+throughput for both along with the row counts each produced. The scratch
+schema is dropped afterwards unless --keep is given. Connection settings come
+from the same DB_* environment variables as the scraper.
+"""
+import argparse
+import os
+import random
+import time
+
+from benchmarks.synthetic_data import synthetic_listing
+from utils.database_utils import get_db_connection, save_to_database
+from utils.migration_utils import get_migrations_dir
+
+SCHEMA = "bench_ingest"
+
+# Tables compared after each run
+COUNTED_TABLES = (
+    "listings", "brokers", "broker_agencies", "broker_agency_relationships", "locations",
+    "listing_locations", "listing_agencies", "amenities", "listing_amenities", "housing_cooperatives",
+)
+
+
+def create_schema(cursor):
+    cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    cursor.execute(f"CREATE SCHEMA {SCHEMA}")
+    # Extensions live in public, once per database; the scratch schema only needs their operators
+    cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm SCHEMA public")
+    cursor.execute(f"SET search_path TO {SCHEMA}, public")
+    init_sql = os.path.join(os.path.dirname(get_migrations_dir()), "init.sql")
+    with open(init_sql, encoding="utf-8") as f:
+        # The real_estate schema already exists in the target database
+        cursor.execute(f.read().replace("CREATE SCHEMA real_estate;", ""))
+
+def count_rows(cursor):
+    counts = {}
+    for table in COUNTED_TABLES:
+        cursor.execute(f"SELECT count(*) FROM {table}")
+        counts[table] = cursor.fetchone()[0]
+    return counts
+
+def run(cursor, listings, server_side):
+    create_schema(cursor)
+    failures = 0
+    start = time.perf_counter()
+    for listing in listings:
+        if not save_to_database(listing, server_side=server_side):
+            failures += 1
+    elapsed = time.perf_counter() - start
+    return elapsed, failures, count_rows(cursor)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark client-side vs server-side listing ingest")
+    parser.add_argument("--listings", type=int, default=2000, help="Number of synthetic listings")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the synthetic listings")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch schema afterwards")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    listings = [synthetic_listing(i, rng) for i in range(args.listings)]
+
+    # Every connection save_to_database opens should use the scratch schema
+    os.environ["PGOPTIONS"] = f"-c search_path={SCHEMA}"
+
+    conn = get_db_connection()
+    conn.autocommit = True
+    cursor = conn.cursor()
+    try:
+        results = {}
+        for label, server_side in (("client-side", False), ("ingest_listing", True)):
+            elapsed, failures, counts = run(cursor, listings, server_side)
+            results[label] = counts
+            print(
+                f"{label:<16}{args.listings / elapsed:>10.1f} listings/s"
+                f"{elapsed * 1000 / args.listings:>10.2f} ms/listing{failures:>8} failed"
+            )
+
+        print(f"\n{'table':<30}{'client-side':>14}{'ingest_listing':>16}")
+        for table in COUNTED_TABLES:
+            client, server = results["client-side"][table], results["ingest_listing"][table]
+            marker = "" if client == server else "  <- differs"
+            print(f"{table:<30}{client:>14}{server:>16}{marker}")
+    finally:
+        if not args.keep:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
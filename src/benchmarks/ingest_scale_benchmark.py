@@ -0,0 +1,212 @@
+"""
+Ingest and analytics view benchmark at growing table sizes.
+
+Run from the src directory against a scratch database:
+
+    python -m benchmarks.ingest_scale_benchmark --scales 10000,100000,1000000
+
+Loads db/init.sql into a scratch schema and replays synthetic listings and
+sales (benchmarks.synthetic_data) through save_to_database and
+store_sold_listing, growing the tables to each scale in turn: at a scale of
+100000, the schema holds 100000 listings and 100000 sales. For each step it
+prints rows/sec and the round trips (statements, commits and rollbacks),
+commits and connections per record, then refreshes the analytics views and
+prints the refresh time and the latency of typical queries against them.
+
+Round trips are counted by connecting through a counting connection class, so
+the ingest code runs unchanged. The client-side path opens several connections
+and issues a statement per dimension value, so the 1M step takes hours; use
+--server-side for the ingest_listing path or smaller scales for a quick run.
+The scratch schema is dropped afterwards unless --keep is given. Connection
+settings come from the same DB_* environment variables as the scraper.
+"""
+import argparse
+import functools
+import os
+import statistics
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+from benchmarks.ingest_benchmark import SCHEMA, create_schema
+from benchmarks.synthetic_data import DEFAULT_CARDINALITIES, generate
+from utils.database_utils import (
+    ANALYTICS_VIEW_DEPENDENCIES,
+    get_db_connection,
+    save_to_database,
+    store_sold_listing,
+)
+
+DEFAULT_SCALES = "10000,100000,1000000"
+
+# Queries of the kind the notebooks run against the analytics views
+VIEW_QUERIES = {
+    "monthly_price_per_sqm": """
+        SELECT date_trunc('month', sale_date), count(*), avg(final_price_per_sqm)
+        FROM listing_sales_view
+        WHERE sale_date >= CURRENT_DATE - 365
+        GROUP BY 1
+    """,
+    "listing_sale": """
+        SELECT * FROM listing_sales_view WHERE listing_id = (SELECT max(listing_id) / 2 FROM listings)
+    """,
+    "top_municipalities": """
+        SELECT * FROM location_market_performance
+        WHERE type = 'municipality'
+        ORDER BY total_sales DESC
+        LIMIT 20
+    """,
+    "top_cooperatives": """
+        SELECT * FROM housing_cooperative_performance
+        ORDER BY avg_sqm_price_final DESC NULLS LAST
+        LIMIT 20
+    """,
+}
+
+COUNTERS = {"statements": 0, "commits": 0, "rollbacks": 0, "connections": 0}
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    def execute(self, query, vars=None):
+        COUNTERS["statements"] += 1
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        # executemany sends one statement per parameter set
+        vars_list = list(vars_list)
+        COUNTERS["statements"] += len(vars_list)
+        return super().executemany(query, vars_list)
+
+
+class CountingConnection(psycopg2.extensions.connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        COUNTERS["connections"] += 1
+
+    def cursor(self, *args, **kwargs):
+        kwargs.setdefault("cursor_factory", CountingCursor)
+        return super().cursor(*args, **kwargs)
+
+    def commit(self):
+        COUNTERS["commits"] += 1
+        return super().commit()
+
+    def rollback(self):
+        COUNTERS["rollbacks"] += 1
+        return super().rollback()
+
+
+def parse_scales(value):
+    scales = sorted(int(scale) for scale in value.split(",") if scale.strip())
+    if not scales or scales[0] <= 0:
+        raise argparse.ArgumentTypeError(f"Invalid scales: {value}")
+    return scales
+
+def ingest(records, server_side):
+    """Replay records through the ingest functions; returns per-type counts, failures and seconds"""
+    counts = {"listing": 0, "sale": 0}
+    failures = 0
+    start = time.perf_counter()
+    for record_type, record in records:
+        counts[record_type] += 1
+        if record_type == "listing":
+            stored = save_to_database(record, server_side=server_side)
+        else:
+            stored, _ = store_sold_listing(record)
+        if not stored:
+            failures += 1
+    return counts, failures, time.perf_counter() - start
+
+def refresh_views(cursor):
+    """Refresh each analytics view; returns {view: seconds}"""
+    timings = {}
+    cursor.execute("ANALYZE")
+    for view in ANALYTICS_VIEW_DEPENDENCIES:
+        start = time.perf_counter()
+        cursor.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {view}")
+        timings[view] = time.perf_counter() - start
+    cursor.execute("ANALYZE")
+    return timings
+
+def time_queries(cursor, repeats):
+    """Run each VIEW_QUERIES query `repeats` times; returns {name: (median ms, max ms)}"""
+    timings = {}
+    for name, sql in VIEW_QUERIES.items():
+        samples = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            cursor.execute(sql)
+            cursor.fetchall()
+            samples.append((time.perf_counter() - start) * 1000)
+        timings[name] = (statistics.median(samples), max(samples))
+    return timings
+
+def report(scale, counts, failures, elapsed, counters, refresh, queries):
+    records = counts["listing"] + counts["sale"]
+    print(f"\n=== {scale:,} listings and sales ===")
+    print(
+        f"ingested {counts['listing']:,} listings and {counts['sale']:,} sales in {elapsed:.1f}s: "
+        f"{records / elapsed:,.0f} rows/s, {failures} failed"
+    )
+    round_trips = counters["statements"] + counters["commits"] + counters["rollbacks"]
+    print(
+        f"per record: {round_trips / records:.1f} round trips ({counters['statements'] / records:.1f} statements), "
+        f"{counters['commits'] / records:.2f} commits, {counters['connections'] / records:.2f} connections"
+    )
+    print(f"\n{'view refresh':<36}{'seconds':>10}")
+    for view, seconds in refresh.items():
+        print(f"{view:<36}{seconds:>10.2f}")
+    print(f"\n{'view query':<36}{'median ms':>10}{'max ms':>10}")
+    for name, (median, worst) in queries.items():
+        print(f"{name:<36}{median:>10.2f}{worst:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark listing and sale ingest and analytics views at growing sizes")
+    parser.add_argument("--scales", type=parse_scales, default=parse_scales(DEFAULT_SCALES),
+                        help=f"Comma-separated listing/sale counts to grow the tables to (default: {DEFAULT_SCALES})")
+    parser.add_argument("--sales-ratio", type=float, default=1.0, help="Sales per listing")
+    parser.add_argument("--server-side", action="store_true", help="Store listings with the ingest_listing function")
+    parser.add_argument("--repeats", type=int, default=20, help="Runs of each view query")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the synthetic records")
+    for name, default in DEFAULT_CARDINALITIES.items():
+        parser.add_argument(f"--{name}", type=int, default=default, help=f"Distinct {name} (default: {default})")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch schema afterwards")
+    args = parser.parse_args()
+    cardinalities = {name: getattr(args, name) for name in DEFAULT_CARDINALITIES}
+
+    # Every connection the ingest functions open should use the scratch schema and be counted
+    os.environ["PGOPTIONS"] = f"-c search_path={SCHEMA}"
+    psycopg2.connect = functools.partial(psycopg2.connect, connection_factory=CountingConnection)
+
+    conn = get_db_connection()
+    conn.autocommit = True
+    cursor = conn.cursor()
+    try:
+        create_schema(cursor)
+        loaded = 0
+        for scale in args.scales:
+            records = generate(
+                scale - loaded, int((scale - loaded) * args.sales_ratio),
+                seed=args.seed, cardinalities=cardinalities, start=loaded,
+            )
+            for counter in COUNTERS:
+                COUNTERS[counter] = 0
+            counts, failures, elapsed = ingest(records, args.server_side)
+            # Copied before the view refresh and queries, which run on this script's own connection
+            counters = dict(COUNTERS)
+            loaded = scale
+
+            refresh = refresh_views(cursor)
+            queries = time_queries(cursor, args.repeats)
+            report(scale, counts, failures, elapsed, counters, refresh, queries)
+    finally:
+        if not args.keep:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
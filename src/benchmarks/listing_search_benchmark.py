@@ -0,0 +1,197 @@
+"""
+Listing search benchmark for migration 010 (full-text and trigram indexes).
+
+Run from the src directory against a scratch database:
+
+    python -m benchmarks.listing_search_benchmark --listings 1000000
+
+Loads db/init.sql into a scratch schema, fills listings with synthetic Swedish
+descriptions and street addresses, and prints the median and worst latency of
+keyword and address searches written the way they were before migration 010
+(ILIKE, a sequential scan) next to the indexed versions, and of
+read_utils.search_listings with and without filters. The scratch schema is
+dropped afterwards unless --keep is given. Connection settings come from the
+same DB_* environment variables as the scraper.
+"""
+import argparse
+import re
+import statistics
+import time
+
+from benchmarks.ingest_benchmark import SCHEMA, create_schema
+from utils.database_utils import get_db_connection
+from utils.read_utils import search_listings
+
+# Description vocabulary: DESCRIPTION_WORDS drawn from the common words per listing, and each
+# rare word appended to one listing in `step`
+COMMON_WORDS = (
+    "ljus", "rymlig", "lägenhet", "välplanerad", "trea", "kök", "vardagsrum", "sovrum", "badrum",
+    "renoverat", "parkett", "fönster", "läge", "centralt", "nära", "skola", "förskola", "buss",
+    "pendeltåg", "natur", "park", "grönområde", "lugnt", "område", "förening", "ekonomi", "avgift",
+    "förråd", "tvättstuga", "cykelrum", "hiss", "trapphus", "gård", "fasad", "tak", "stambyte",
+    "garderober", "klinker", "diskmaskin", "tvättmaskin",
+)
+RARE_WORDS = (("balkong", 5), ("eldstad", 20), ("kakelugn", 50), ("sjöutsikt", 100), ("bastu", 200))
+DESCRIPTION_WORDS = 20
+STREET_PREFIXES = ("", "Norra ", "Södra ", "Lilla ", "Stora ")
+STREETS = (
+    "Storgatan", "Kungsgatan", "Drottninggatan", "Vasagatan", "Sveavägen", "Hornsgatan", "Götgatan",
+    "Ringvägen", "Skolgatan", "Kyrkogatan", "Järnvägsgatan", "Strandvägen", "Björkvägen", "Ekvägen",
+    "Tallvägen", "Granvägen", "Lindvägen", "Parkvägen", "Sjövägen", "Ängsvägen",
+)
+
+# Listings spread over 100 street names with 150 numbers each
+LOAD_SQL = """
+INSERT INTO housing_form_types (name) SELECT 'Form ' || g FROM generate_series(1, 8) g;
+INSERT INTO tenure_types (name) SELECT 'Tenure ' || g FROM generate_series(1, 4) g;
+INSERT INTO brokers (broker_hemnet_id, name) SELECT g, 'Broker ' || g FROM generate_series(1, 2000) g;
+INSERT INTO locations (location_hemnet_id, location_name, type)
+SELECT g, 'Location ' || g, CASE WHEN g <= 21 THEN 'county' WHEN g <= 311 THEN 'municipality' ELSE 'area' END
+FROM generate_series(1, 5311) g;
+
+INSERT INTO listings (
+    listing_hemnet_id, url, street_address, tenure_id, asking_price, living_area,
+    housing_form_id, published_date, status, broker_id, description
+)
+SELECT
+    20000000 + g,
+    'https://www.hemnet.se/bostad/' || g,
+    (%(prefixes)s::text[])[1 + g %% 5] || (%(streets)s::text[])[1 + g / 5 %% 20] || ' ' || (1 + g %% 150),
+    1 + g %% 4,
+    500000 + (g * 7919) %% 9500000,
+    20 + g %% 180,
+    1 + g %% 8,
+    CURRENT_DATE - g %% 365,
+    CASE WHEN g %% 10 < 3 THEN 'active' WHEN g %% 10 < 9 THEN 'sold' ELSE 'removed' END,
+    1 + g %% 2000,
+    (
+        -- Multiplicative hash of (listing, position) picks each word
+        SELECT string_agg((%(words)s::text[])[1 + ((((g::bigint * 64 + n) * 2654435761) %% 4294967296) >> 16) %% 40], ' ')
+        FROM generate_series(1, %(description_words)s) n
+    ) || (
+        SELECT coalesce(string_agg(' ' || word, ''), '')
+        FROM unnest(%(rare_words)s::text[], %(rare_steps)s::int[]) AS rare(word, step)
+        WHERE g %% step = 0
+    )
+FROM generate_series(1, %(listings)s) g;
+
+INSERT INTO listing_locations (listing_id, location_id)
+SELECT listing_id, loc
+FROM listings,
+LATERAL (VALUES (1 + listing_id %% 21), (22 + listing_id %% 290), (312 + listing_id %% 5000)) AS l(loc);
+
+ANALYZE;
+"""
+
+# (query as written before migration 010, indexed query, search term) per case
+COMPARISONS = {
+    "common_word": (
+        "SELECT listing_id FROM listings WHERE description ILIKE '%%' || %s || '%%' LIMIT 50",
+        "SELECT listing_id FROM listings WHERE search_vector @@ websearch_to_tsquery('swedish', %s) LIMIT 50",
+        "balkong",
+    ),
+    "rare_word": (
+        "SELECT listing_id FROM listings WHERE description ILIKE '%%' || %s || '%%' LIMIT 50",
+        "SELECT listing_id FROM listings WHERE search_vector @@ websearch_to_tsquery('swedish', %s) LIMIT 50",
+        "bastu",
+    ),
+    "rare_word_count": (
+        "SELECT count(*) FROM listings WHERE description ILIKE '%%' || %s || '%%'",
+        "SELECT count(*) FROM listings WHERE search_vector @@ websearch_to_tsquery('swedish', %s)",
+        "sjöutsikt",
+    ),
+    "street_prefix": (
+        "SELECT listing_id FROM listings WHERE street_address ILIKE %s || '%%' LIMIT 50",
+        "SELECT listing_id FROM listings WHERE %s <%% street_address LIMIT 50",
+        "Lilla Sjövägen",
+    ),
+    "street_misspelled": (
+        "SELECT listing_id FROM listings WHERE street_address ILIKE '%%' || %s || '%%' LIMIT 50",
+        "SELECT listing_id FROM listings WHERE %s <%% street_address LIMIT 50",
+        "Drotninggatan 3",
+    ),
+}
+
+# search_listings calls: (query, keyword arguments)
+SEARCHES = {
+    "keywords": ("sjöutsikt balkong", {}),
+    "keywords_active": ("sjöutsikt balkong", {"statuses": ["active"]}),
+    "keywords_price": ("eldstad -hiss", {"statuses": ["active"], "min_price": 2000000, "max_price": 4000000}),
+    "keywords_location": ("kakelugn", {"location_ids": [400]}),
+    "street": ("Norra Storgatan 12", {}),
+    "phrase": ('"nära skola"', {"statuses": ["active"]}),
+}
+
+_EXECUTION_TIME_RE = re.compile(r"Execution Time: ([\d.]+) ms")
+
+
+def time_query(cursor, sql, params, repeats):
+    """Median and worst execution time in ms, from EXPLAIN ANALYZE"""
+    samples = []
+    for _ in range(repeats):
+        cursor.execute("EXPLAIN (ANALYZE) " + sql, params)
+        plan = "\n".join(row[0] for row in cursor.fetchall())
+        samples.append(float(_EXECUTION_TIME_RE.search(plan).group(1)))
+    return statistics.median(samples), max(samples), plan
+
+def time_search(conn, query, filters, repeats):
+    """Median and worst wall-clock time in ms of a search_listings call, and its result count"""
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        results = search_listings(query, conn=conn, **filters)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), max(samples), len(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark listing keyword and address search before and after migration 010")
+    parser.add_argument("--listings", type=int, default=1000000, help="Number of synthetic listings")
+    parser.add_argument("--repeats", type=int, default=10, help="Runs of each query")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch schema afterwards")
+    parser.add_argument("--verbose", action="store_true", help="Print the plan of each query")
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    conn.autocommit = True
+    cursor = conn.cursor()
+    try:
+        create_schema(cursor)
+        start = time.perf_counter()
+        cursor.execute(LOAD_SQL, {
+            "listings": args.listings,
+            "description_words": DESCRIPTION_WORDS,
+            "prefixes": list(STREET_PREFIXES),
+            "streets": list(STREETS),
+            "words": list(COMMON_WORDS),
+            "rare_words": [word for word, _ in RARE_WORDS],
+            "rare_steps": [step for _, step in RARE_WORDS],
+        })
+        print(f"Loaded {args.listings:,} listings in {time.perf_counter() - start:.1f}s")
+        cursor.execute("SELECT pg_size_pretty(pg_relation_size('idx_listings_search_vector')), "
+                       "pg_size_pretty(pg_relation_size('idx_listings_street_address_trgm'))")
+        vector_size, trigram_size = cursor.fetchone()
+        print(f"Index sizes: search_vector {vector_size}, street_address trigrams {trigram_size}")
+
+        print(f"\n{'query':<22}{'term':<18}{'ILIKE ms':>10}{'max':>9}{'indexed ms':>12}{'max':>9}{'speedup':>9}")
+        for name, (before_sql, after_sql, term) in COMPARISONS.items():
+            before, before_max, before_plan = time_query(cursor, before_sql, (term,), args.repeats)
+            after, after_max, after_plan = time_query(cursor, after_sql, (term,), args.repeats)
+            speedup = before / after if after else float("inf")
+            print(f"{name:<22}{term:<18}{before:>10.2f}{before_max:>9.2f}{after:>12.2f}{after_max:>9.2f}{speedup:>8.1f}x")
+            if args.verbose:
+                print(f"\n--- {name}, ILIKE ---\n{before_plan}\n--- {name}, indexed ---\n{after_plan}\n")
+
+        print(f"\n{'search_listings':<22}{'query':<22}{'median ms':>10}{'max ms':>9}{'results':>9}")
+        for name, (query, filters) in SEARCHES.items():
+            median, worst, count = time_search(conn, query, filters, args.repeats)
+            print(f"{name:<22}{query:<22}{median:>10.2f}{worst:>9.2f}{count:>9}")
+    finally:
+        if not args.keep:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Benchmark for analytics.market_stats against the equivalent SQL aggregates.
+
+Run from the src directory:
+
+    python -m benchmarks.market_stats_benchmark --sales 1000000 [--sql]
+
+Generates a synthetic sales history as NumPy arrays and times each grouped
+statistic. With --sql the same rows are copied into a temporary table and the
+equivalent GROUP BY queries (percentile_cont medians, as the analytics views
+would need) are timed against the database configured by the DB_* variables.
+"""
+import argparse
+import io
+import time
+
+import numpy as np
+
+from analytics.market_stats import (
+    bid_premium_stats,
+    days_on_market_distribution,
+    median_price_per_sqm,
+    rolling_monthly_index,
+)
+
+HOUSING_FORMS = np.array(["Lägenhet", "Villa", "Radhus", "Fritidshus", "Tomt", "Parhus"], dtype=object)
+
+SQL_QUERIES = {
+    "median_price_per_sqm": """
+        SELECT location_id, housing_form, COUNT(*),
+               percentile_cont(0.5) WITHIN GROUP (ORDER BY final_price / NULLIF(living_area, 0))
+        FROM bench_sales GROUP BY location_id, housing_form
+    """,
+    "bid_premium_stats": """
+        SELECT location_id, housing_form, COUNT(price_change_percentage), AVG(price_change_percentage),
+               percentile_cont(ARRAY[0.25, 0.5, 0.75]) WITHIN GROUP (ORDER BY price_change_percentage),
+               AVG((price_change_percentage > 0)::int)
+        FROM bench_sales GROUP BY location_id, housing_form
+    """,
+    "days_on_market_distribution": """
+        SELECT location_id, housing_form, COUNT(*), AVG(days_on_market),
+               percentile_cont(ARRAY[0.1, 0.25, 0.5, 0.75, 0.9]) WITHIN GROUP (ORDER BY days_on_market)
+        FROM bench_sales GROUP BY location_id, housing_form
+    """,
+    "rolling_monthly_index": """
+        SELECT s.location_id, s.housing_form, m.month, COUNT(*),
+               percentile_cont(0.5) WITHIN GROUP (ORDER BY s.final_price / NULLIF(s.living_area, 0))
+        FROM bench_sales s
+        CROSS JOIN LATERAL (
+            SELECT date_trunc('month', s.sale_date) + offset_months * INTERVAL '1 month' AS month
+            FROM generate_series(0, 2) AS offset_months
+        ) m
+        GROUP BY s.location_id, s.housing_form, m.month
+    """,
+}
+
+
+def generate_sales(n, n_locations, seed=42):
+    rng = np.random.default_rng(seed)
+    living_area = rng.uniform(20, 250, n).round(1)
+    price_per_sqm = rng.lognormal(np.log(45000), 0.4, n)
+    return {
+        "location_id": rng.integers(1, n_locations + 1, n),
+        "housing_form": HOUSING_FORMS[rng.integers(0, len(HOUSING_FORMS), n)],
+        "living_area": living_area,
+        "final_price": (living_area * price_per_sqm).round(-3),
+        "price_change_percentage": rng.normal(2, 6, n).round(2),
+        "days_on_market": rng.gamma(2, 12, n).round().astype(np.int64),
+        "sale_date": np.datetime64("2016-01-01") + rng.integers(0, 3650, n).astype("timedelta64[D]"),
+    }
+
+
+def time_numpy(sales, repeat):
+    functions = {
+        "median_price_per_sqm": median_price_per_sqm,
+        "bid_premium_stats": bid_premium_stats,
+        "days_on_market_distribution": days_on_market_distribution,
+        "rolling_monthly_index": rolling_monthly_index,
+    }
+    timings = {}
+    for name, function in functions.items():
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function(sales)
+            best = min(best, time.perf_counter() - start)
+        timings[name] = best
+    return timings
+
+
+def time_sql(sales, repeat):
+    from utils.database_utils import get_db_connection
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            CREATE TEMP TABLE bench_sales (
+                location_id BIGINT, housing_form TEXT, living_area DECIMAL(10, 2),
+                final_price DECIMAL(15, 2), price_change_percentage DECIMAL(8, 2),
+                days_on_market INTEGER, sale_date DATE
+            )
+        """)
+        buffer = io.StringIO()
+        columns = ["location_id", "housing_form", "living_area", "final_price",
+                   "price_change_percentage", "days_on_market", "sale_date"]
+        for row in zip(*(sales[column] for column in columns)):
+            buffer.write("\t".join(str(value) for value in row) + "\n")
+        buffer.seek(0)
+        cursor.copy_from(buffer, "bench_sales", columns=columns)
+        cursor.execute("ANALYZE bench_sales")
+
+        timings = {}
+        for name, sql in SQL_QUERIES.items():
+            best = float("inf")
+            for _ in range(repeat):
+                start = time.perf_counter()
+                cursor.execute(sql)
+                cursor.fetchall()
+                best = min(best, time.perf_counter() - start)
+            timings[name] = best
+        return timings
+    finally:
+        cursor.close()
+        conn.rollback()
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark vectorized market statistics")
+    parser.add_argument("--sales", type=int, default=1000000, help="Number of synthetic sales")
+    parser.add_argument("--locations", type=int, default=2000, help="Number of distinct locations")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per statistic; the best is reported")
+    parser.add_argument("--sql", action="store_true", help="Also time the equivalent SQL aggregates")
+    args = parser.parse_args()
+
+    sales = generate_sales(args.sales, args.locations)
+    print(f"Generated {args.sales:,} sales over {args.locations:,} locations")
+
+    numpy_timings = time_numpy(sales, args.repeat)
+    sql_timings = time_sql(sales, args.repeat) if args.sql else {}
+
+    print(f"\n{'statistic':<30}{'numpy s':>10}{'sql s':>10}{'speedup':>10}")
+    for name, seconds in numpy_timings.items():
+        if name in sql_timings:
+            print(f"{name:<30}{seconds:>10.3f}{sql_timings[name]:>10.3f}{sql_timings[name] / seconds:>9.1f}x")
+        else:
+            print(f"{name:<30}{seconds:>10.3f}{'-':>10}{'-':>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Correctness corpus and throughput benchmark for utils.parsing_utils.
+
+Run from the src directory:
+
+    python -m benchmarks.parsing_benchmark [--iterations 200000]
+
+The corpus is checked first (the run aborts on any mismatch), then each parser
+is timed single-threaded, from a thread pool and from a process pool.
+"""
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+
+from utils.parsing_utils import (
+    parse_area,
+    parse_currency,
+    parse_floor,
+    parse_listing_id,
+    parse_sold_date,
+    parse_swedish_date,
+)
+
+# (parser, input, expected) triples taken from formatted fields seen on Hemnet
+CORPUS = [
+    (parse_swedish_date, "12 mars 2024", datetime(2024, 3, 12)),
+    (parse_swedish_date, "1 januari 2023", datetime(2023, 1, 1)),
+    (parse_swedish_date, "28 feb 2022", datetime(2022, 2, 28)),
+    (parse_swedish_date, "3 okt. 2023", datetime(2023, 10, 3)),
+    (parse_swedish_date, "15 Maj 2021", datetime(2021, 5, 15)),
+    (parse_swedish_date, "9 sept. 2020", datetime(2020, 9, 9)),
+    (parse_swedish_date, "31 februari 2024", None),
+    (parse_swedish_date, "12 march 2024", None),
+    (parse_swedish_date, "", None),
+    (parse_swedish_date, None, None),
+    (parse_sold_date, "Såld 12 mars 2024", datetime(2024, 3, 12)),
+    (parse_sold_date, "Såld 1 augusti 2019", datetime(2019, 8, 1)),
+    (parse_sold_date, "såld 24 dec. 2023", datetime(2023, 12, 24)),
+    (parse_sold_date, "Såld  7 juni 2022", datetime(2022, 6, 7)),
+    (parse_sold_date, "7 juni 2022", datetime(2022, 6, 7)),
+    (parse_sold_date, "Såld", None),
+    (parse_sold_date, None, None),
+    (parse_currency, "4 195 000 kr", 4195000),
+    (parse_currency, "4\u00a0195\u00a0000 kr", 4195000),
+    (parse_currency, "4\u202f195\u202f000\u00a0kr", 4195000),
+    (parse_currency, "3 250 kr/mån", 3250),
+    (parse_currency, "12 000 kr/år", 12000),
+    (parse_currency, "\u2212150 000 kr", -150000),
+    (parse_currency, "-5 000 kr", -5000),
+    (parse_currency, "850 kr", 850),
+    (parse_currency, "Pris saknas", None),
+    (parse_currency, "kr", None),
+    (parse_currency, None, None),
+    (parse_area, "75 m²", 75.0),
+    (parse_area, "75,5 m²", 75.5),
+    (parse_area, "1 203 m²", 1203.0),
+    (parse_area, "1\u00a0203,5 m²", 1203.5),
+    (parse_area, "m²", None),
+    (parse_area, None, None),
+    (parse_floor, "3 av 5, hiss finns", 3),
+    (parse_floor, "12 av 14", 12),
+    (parse_floor, "1, hiss finns ej", 1),
+    (parse_floor, "-1 av 4", -1),
+    (parse_floor, "\u22121 av 4", -1),
+    (parse_floor, "1,5 av 3", 1),
+    (parse_floor, "Bottenvåning", None),
+    (parse_floor, "", None),
+    (parse_floor, None, None),
+    (parse_listing_id, "/bostad/lagenhet-2rum-vasastan-stockholms-kommun-dalagatan-1-21345678", 21345678),
+    (parse_listing_id, "/bostad/villa-5rum-lerum-kommun-storgatan-12b-21000123?utm_source=x", 21000123),
+    (parse_listing_id, "/bostad/21345678", 21345678),
+    (parse_listing_id, "/bostad/lagenhet-2rum-vasastan", None),
+    (parse_listing_id, "/salda/lagenhet-2rum-vasastan-1234", None),
+    (parse_listing_id, None, None),
+]
+
+
+def check_corpus():
+    failures = []
+    for parser, value, expected in CORPUS:
+        result = parser(value)
+        if result != expected:
+            failures.append(f"{parser.__name__}({value!r}) = {result!r}, expected {expected!r}")
+    return failures
+
+
+def _run_parser(args):
+    parser_name, values, iterations = args
+    parser = globals()[parser_name]
+    for i in range(iterations):
+        parser(values[i % len(values)])
+    return iterations
+
+
+def _inputs_by_parser():
+    inputs = {}
+    for parser, value, _ in CORPUS:
+        inputs.setdefault(parser.__name__, []).append(value)
+    return inputs
+
+
+def benchmark(iterations, workers):
+    results = []
+    for parser_name, values in _inputs_by_parser().items():
+        start = time.perf_counter()
+        _run_parser((parser_name, values, iterations))
+        single = iterations / (time.perf_counter() - start)
+
+        chunks = [(parser_name, values, iterations // workers)] * workers
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            done = sum(executor.map(_run_parser, chunks))
+        threaded = done / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            done = sum(executor.map(_run_parser, chunks))
+        processes = done / (time.perf_counter() - start)
+
+        results.append((parser_name, single, threaded, processes))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Hemnet formatted-value parsers")
+    parser.add_argument("--iterations", type=int, default=200000, help="Calls per parser")
+    parser.add_argument("--workers", type=int, default=4, help="Thread and process pool size")
+    args = parser.parse_args()
+
+    failures = check_corpus()
+    if failures:
+        for failure in failures:
+            print(f"FAIL {failure}")
+        raise SystemExit(1)
+    print(f"Corpus OK ({len(CORPUS)} cases)")
+
+    print(f"{'parser':<22}{'1 thread/s':>14}{'threads/s':>14}{'processes/s':>14}")
+    for name, single, threaded, processes in benchmark(args.iterations, args.workers):
+        print(f"{name:<22}{single:>14,.0f}{threaded:>14,.0f}{processes:>14,.0f}")
+
+
+if __name__ == "__main__":
+    main()
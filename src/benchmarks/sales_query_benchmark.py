@@ -0,0 +1,246 @@
+"""
+Query benchmark for migration 002 (property_sales partitioning and view indexes).
+
+Run from the src directory against a scratch database:
+
+    python -m benchmarks.sales_query_benchmark --sales 3000000
+
+Loads a synthetic sales history into a scratch schema using the layout from
+before migration 002, prints EXPLAIN ANALYZE plans for the queries the views
+and scrapers run, applies db/migrations/002 to the same schema and prints the
+plans again. The scratch schema is dropped afterwards unless --keep is given.
+Connection settings come from the same DB_* environment variables as the scraper.
+"""
+import argparse
+import os
+import re
+import time
+
+from utils.database_utils import get_db_connection
+from utils.migration_utils import get_migrations_dir
+
+SCHEMA = "bench_sales"
+
+# The parts of the schema migration 002 touches, as they were before it
+BEFORE_DDL = """
+CREATE OR REPLACE FUNCTION update_timestamp()
+RETURNS TRIGGER AS $$
+BEGIN
+   NEW.updated_at = CURRENT_TIMESTAMP;
+   RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TABLE housing_form_types (housing_form_id SERIAL PRIMARY KEY, name VARCHAR(100) NOT NULL UNIQUE);
+CREATE TABLE tenure_types (tenure_id SERIAL PRIMARY KEY, name VARCHAR(100) NOT NULL UNIQUE);
+CREATE TABLE brokers (broker_id BIGSERIAL PRIMARY KEY, broker_hemnet_id BIGINT NOT NULL UNIQUE, name VARCHAR(255) NOT NULL);
+CREATE TABLE housing_cooperatives (housing_cooperative_id SERIAL PRIMARY KEY, name VARCHAR(255) NOT NULL UNIQUE);
+
+CREATE TABLE locations (
+    location_id BIGSERIAL PRIMARY KEY,
+    location_hemnet_id BIGINT NOT NULL UNIQUE,
+    location_name VARCHAR(255) NOT NULL,
+    type VARCHAR(255)
+);
+
+CREATE TABLE listings (
+    listing_id BIGSERIAL PRIMARY KEY,
+    listing_hemnet_id BIGINT NOT NULL UNIQUE,
+    street_address VARCHAR(255) NOT NULL,
+    postcode VARCHAR(20),
+    tenure_id INTEGER NOT NULL REFERENCES tenure_types,
+    asking_price DECIMAL(15, 2) NOT NULL,
+    squaremeter_price DECIMAL(15, 2),
+    fee DECIMAL(10, 2),
+    living_area DECIMAL(10, 2),
+    housing_form_id INTEGER NOT NULL REFERENCES housing_form_types,
+    housing_cooperative_id INTEGER REFERENCES housing_cooperatives,
+    published_date DATE NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'active',
+    broker_id BIGINT NOT NULL REFERENCES brokers,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE property_sales (
+    sale_id BIGSERIAL PRIMARY KEY,
+    sale_hemnet_id BIGINT NOT NULL UNIQUE,
+    listing_id BIGINT REFERENCES listings ON DELETE SET NULL,
+    listing_hemnet_id BIGINT NOT NULL,
+    final_price DECIMAL(15, 2) NOT NULL,
+    asking_price DECIMAL(15, 2),
+    price_change DECIMAL(15, 2),
+    price_change_percentage DECIMAL(8, 2),
+    sale_date DATE NOT NULL,
+    sale_date_str VARCHAR(50),
+    broker_agency VARCHAR(255),
+    living_area DECIMAL(10, 2),
+    land_area DECIMAL(12, 2),
+    number_of_rooms DECIMAL(4, 1),
+    construction_year INTEGER,
+    street_address VARCHAR(255),
+    area VARCHAR(255),
+    municipality VARCHAR(255),
+    running_costs DECIMAL(10, 2),
+    url VARCHAR(255) NOT NULL UNIQUE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT property_sales_price_check CHECK (final_price >= 0)
+);
+
+CREATE TABLE listing_locations (
+    listing_id BIGINT NOT NULL REFERENCES listings ON DELETE CASCADE,
+    location_id BIGINT NOT NULL REFERENCES locations ON DELETE CASCADE,
+    PRIMARY KEY (listing_id, location_id)
+);
+
+CREATE INDEX idx_property_sales_listing_id ON property_sales (listing_id);
+CREATE INDEX idx_property_sales_listing_hemnet_id ON property_sales (listing_hemnet_id);
+CREATE INDEX idx_property_sales_sale_date ON property_sales (sale_date);
+CREATE INDEX idx_property_sales_final_price ON property_sales (final_price);
+CREATE INDEX idx_property_sales_broker_agency ON property_sales (broker_agency);
+"""
+
+# Synthetic data: sales spread evenly over the last ~12 years in insert order,
+# 80% of them matched to a listing, each listing in three nested locations
+LOAD_SQL = """
+INSERT INTO housing_form_types (name) SELECT 'Form ' || g FROM generate_series(1, 8) g;
+INSERT INTO tenure_types (name) SELECT 'Tenure ' || g FROM generate_series(1, 4) g;
+INSERT INTO brokers (broker_hemnet_id, name) SELECT g, 'Broker ' || g FROM generate_series(1, 5000) g;
+INSERT INTO housing_cooperatives (name) SELECT 'Brf ' || g FROM generate_series(1, 20000) g;
+INSERT INTO locations (location_hemnet_id, location_name, type)
+SELECT g, 'Location ' || g, CASE WHEN g <= 50 THEN 'county' WHEN g <= 550 THEN 'municipality' ELSE 'area' END
+FROM generate_series(1, 5550) g;
+
+INSERT INTO listings (
+    listing_hemnet_id, street_address, postcode, tenure_id, asking_price, squaremeter_price,
+    fee, living_area, housing_form_id, housing_cooperative_id, published_date, broker_id, created_at
+)
+SELECT
+    10000000 + g,
+    'Gatan ' || g,
+    lpad((g % 99999)::text, 5, '0'),
+    1 + g % 4,
+    500000 + (g * 7919) % 9500000,
+    20000 + (g * 104729) % 100000,
+    1000 + g % 8000,
+    20 + g % 180,
+    1 + g % 8,
+    CASE WHEN g % 3 = 0 THEN 1 + g % 20000 END,
+    DATE '2014-01-01' + (g::bigint * 4380 / {listings})::int,
+    1 + g % 5000,
+    TIMESTAMP '2014-01-01' + (g::bigint * 4380 / {listings}) * INTERVAL '1 day'
+FROM generate_series(1, {listings}) g;
+
+INSERT INTO listing_locations (listing_id, location_id)
+SELECT listing_id, loc
+FROM listings,
+LATERAL (VALUES (1 + listing_id % 50), (51 + listing_id % 500), (551 + listing_id % 5000)) AS l(loc);
+
+INSERT INTO property_sales (
+    sale_hemnet_id, listing_id, listing_hemnet_id, final_price, asking_price,
+    price_change_percentage, sale_date, broker_agency, living_area, url, created_at
+)
+SELECT
+    g,
+    CASE WHEN g % 5 <> 0 THEN 1 + g % {listings} END,
+    10000000 + 1 + g % {listings},
+    500000 + (g * 7919) % 9500000,
+    500000 + (g * 6091) % 9500000,
+    ((g % 400) - 200) / 10.0,
+    DATE '2014-01-01' + (g::bigint * 4380 / {sales})::int,
+    'Agency ' || g % 300,
+    20 + g % 180,
+    'https://www.hemnet.se/salda/' || g,
+    TIMESTAMP '2014-01-01' + (g::bigint * 4380 / {sales}) * INTERVAL '1 day'
+FROM generate_series(1, {sales}) g;
+
+ANALYZE;
+"""
+
+QUERIES = {
+    "sales_in_quarter": """
+        SELECT count(*), avg(final_price) FROM property_sales
+        WHERE sale_date >= DATE '2023-01-01' AND sale_date < DATE '2023-04-01'
+    """,
+    "unmatched_sales": """
+        SELECT count(*) FROM property_sales WHERE listing_id IS NULL
+    """,
+    "unmatched_sales_linkable": """
+        SELECT count(*) FROM property_sales ps
+        JOIN listings l ON l.listing_hemnet_id = ps.listing_hemnet_id
+        WHERE ps.listing_id IS NULL
+    """,
+    "location_performance": """
+        SELECT count(DISTINCT l.listing_id), avg(ps.final_price), avg(ps.sale_date - l.published_date)
+        FROM listing_locations ll
+        JOIN listings l ON ll.listing_id = l.listing_id
+        JOIN property_sales ps ON l.listing_id = ps.listing_id
+        WHERE ll.location_id = 1234
+    """,
+    "sales_added_last_week": """
+        SELECT count(*) FROM property_sales
+        WHERE created_at >= TIMESTAMP '2025-12-01' - INTERVAL '7 days'
+    """,
+}
+
+_EXECUTION_TIME_RE = re.compile(r"Execution Time: ([\d.]+) ms")
+
+
+def explain_queries(cursor, label, verbose):
+    timings = {}
+    for name, sql in QUERIES.items():
+        cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql)
+        plan = "\n".join(row[0] for row in cursor.fetchall())
+        timings[name] = float(_EXECUTION_TIME_RE.search(plan).group(1))
+        if verbose:
+            print(f"\n--- {label}: {name} ---\n{plan}")
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sales queries before and after migration 002")
+    parser.add_argument("--sales", type=int, default=3000000, help="Number of synthetic sales")
+    parser.add_argument("--listings", type=int, default=None, help="Number of synthetic listings (default: 60%% of sales)")
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch schema afterwards")
+    parser.add_argument("--quiet", action="store_true", help="Only print the timing summary, not the plans")
+    args = parser.parse_args()
+    listings = args.listings or int(args.sales * 0.6)
+
+    conn = get_db_connection()
+    conn.autocommit = True
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        cursor.execute(f"CREATE SCHEMA {SCHEMA}")
+        cursor.execute(f"SET search_path TO {SCHEMA}")
+        cursor.execute(BEFORE_DDL)
+
+        start = time.perf_counter()
+        cursor.execute(LOAD_SQL.format(sales=args.sales, listings=listings))
+        print(f"Loaded {args.sales:,} sales and {listings:,} listings in {time.perf_counter() - start:.1f}s")
+
+        before = explain_queries(cursor, "before", not args.quiet)
+
+        migration = os.path.join(get_migrations_dir(), "002_partition_property_sales.sql")
+        start = time.perf_counter()
+        with open(migration, encoding="utf-8") as f:
+            cursor.execute(f.read())
+        cursor.execute("ANALYZE")
+        print(f"\nApplied migration 002 in {time.perf_counter() - start:.1f}s")
+
+        after = explain_queries(cursor, "after", not args.quiet)
+
+        print(f"\n{'query':<28}{'before ms':>12}{'after ms':>12}{'speedup':>10}")
+        for name in QUERIES:
+            speedup = before[name] / after[name] if after[name] else float("inf")
+            print(f"{name:<28}{before[name]:>12.1f}{after[name]:>12.1f}{speedup:>9.1f}x")
+    finally:
+        if not args.keep:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        cursor.close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Synthetic listings and sales for benchmarks.
+
+synthetic_listing() builds a dictionary shaped like the active scraper's
+extract_data output (save_to_database's input) and synthetic_sale() one shaped
+like the sold scraper's records (store_sold_listing's input). Records are
+deterministic for a given index and seed. Brokers, agencies, locations,
+amenities and housing cooperatives are drawn from pools whose sizes are set
+with a cardinalities dictionary, so the dimension tables grow the way they
+would in a long crawl rather than one row per listing.
+"""
+import random
+from datetime import date, timedelta
+
+# Pool sizes of the dimension values records are drawn from
+DEFAULT_CARDINALITIES = {
+    "brokers": 2000,
+    "agencies": 300,
+    "locations": 5000,
+    "amenities": 8,
+    "cooperatives": 20000,
+}
+
+LISTING_ID_BASE = 20000000
+SALE_ID_BASE = 50000000
+COUNTIES = 21
+MUNICIPALITIES = 290
+
+HOUSING_FORMS = ("Lägenhet", "Villa", "Radhus", "Fritidshus", "Tomt", "Parhus", "Kedjehus", "Gård")
+TENURES = ("Bostadsrätt", "Äganderätt", "Tomträtt", "Hyresrätt")
+AMENITIES = ("Balkong", "Hiss", "Uteplats", "Eldstad", "Bredband", "Garage", "Förråd", "Tvättstuga")
+ENERGY_CLASSES = ("A", "B", "C", "D", "E", "F", "G", None)
+MONTHS = (
+    "januari", "februari", "mars", "april", "maj", "juni",
+    "juli", "augusti", "september", "oktober", "november", "december",
+)
+
+
+def _cardinalities(cardinalities):
+    return {**DEFAULT_CARDINALITIES, **(cardinalities or {})}
+
+def amenity_names(count):
+    """The first `count` amenity names, numbered past the real ones"""
+    return [AMENITIES[n] if n < len(AMENITIES) else f"Bekvämlighet {n + 1}" for n in range(count)]
+
+def listing_hemnet_id(i):
+    return LISTING_ID_BASE + i
+
+def synthetic_listing(i, rng, cardinalities=None):
+    """
+    A listing dictionary shaped like extract_data's output.
+
+    Args:
+        i: Index of the listing; its hemnet_id is LISTING_ID_BASE + i
+        rng: random.Random to draw from
+        cardinalities: Overrides of DEFAULT_CARDINALITIES
+    """
+    sizes = _cardinalities(cardinalities)
+    broker = rng.randrange(1, sizes["brokers"] + 1)
+    agency = 1 + broker % sizes["agencies"]
+    # Areas nest in municipalities and counties, as Hemnet's location hierarchy does
+    area = rng.randrange(sizes["locations"])
+    municipality = area % MUNICIPALITIES
+    county = municipality % COUNTIES
+    living_area = rng.randrange(20, 220)
+    asking_price = rng.randrange(500, 15000) * 1000
+    return {
+        "hemnet_id": listing_hemnet_id(i),
+        "street_address": f"Gatan {i % 500 + 1}",
+        "post_code": f"{rng.randrange(10000, 99999)}",
+        "tenure": rng.choice(TENURES),
+        "number_of_rooms": rng.randrange(1, 8),
+        "asking_price": asking_price,
+        "square_meter_price": round(asking_price / living_area, 2),
+        "fee": rng.randrange(1000, 9000),
+        "yearly_arrende_fee": None,
+        "yearly_leasehold_fee": None,
+        "running_costs": rng.randrange(10000, 60000),
+        "construction_year": rng.randrange(1900, date.today().year),
+        "living_area": living_area,
+        "is_foreclosure": False,
+        "is_new_construction": rng.random() < 0.1,
+        "is_project": False,
+        "is_upcoming": False,
+        "supplemental_area": None,
+        "land_area": rng.randrange(200, 2000) if rng.random() < 0.3 else None,
+        "housing_form": rng.choice(HOUSING_FORMS),
+        "relevant_amenities": {
+            amenity: rng.random() < 0.5 for amenity in amenity_names(sizes["amenities"])
+        },
+        "energy_classification": rng.choice(ENERGY_CLASSES),
+        "housing_cooperative": (
+            {"name": f"Brf {rng.randrange(1, sizes['cooperatives'] + 1)}"} if rng.random() < 0.6 else None
+        ),
+        "floor": rng.randrange(0, 10),
+        "published_date": (date.today() - timedelta(days=rng.randrange(0, 60))).isoformat(),
+        "locations": [
+            {"hemnetId": 1 + county, "name": f"Län {1 + county}", "type": "county"},
+            {"hemnetId": 100 + municipality, "name": f"Kommun {1 + municipality}", "type": "municipality"},
+            {"hemnetId": 1000 + area, "name": f"Område {1 + area}", "type": "area"},
+        ],
+        "broker_agencies": [{"hemnetId": agency, "name": f"Mäklarbyrå {agency}"}],
+        "broker": {"hemnetId": broker, "name": f"Mäklare {broker}"},
+        "description": "Ljus och rymlig lägenhet " * 20,
+        "closest_water_distance_meters": rng.randrange(50, 5000),
+        "coastline_distance_meters": rng.randrange(50, 50000),
+        "latitude": round(55.3 + rng.random() * 14, 8),
+        "longitude": round(11.1 + rng.random() * 12, 8),
+    }
+
+def synthetic_sale(i, rng, listing=None, cardinalities=None, history_days=3650):
+    """
+    A sale dictionary shaped like the sold scraper's records (store_sold_listing's input).
+
+    Args:
+        i: Index of the sale; its sale_hemnet_id is SALE_ID_BASE + i
+        rng: random.Random to draw from
+        listing: synthetic_listing the sale is of, so it links to a stored
+            listing; an unmatched sale with its own listing id when None
+        cardinalities: Overrides of DEFAULT_CARDINALITIES
+        history_days: Sale dates are spread over this many days before today
+    """
+    sizes = _cardinalities(cardinalities)
+    sale_id = SALE_ID_BASE + i
+    if listing is not None:
+        original_id = listing["hemnet_id"]
+        asking_price = listing["asking_price"]
+        living_area = listing["living_area"]
+        street_address = listing["street_address"]
+        area = listing["locations"][-1]["name"]
+        municipality = listing["locations"][1]["name"]
+        agency = listing["broker_agencies"][0]["name"]
+        sale_date = date.fromisoformat(listing["published_date"]) + timedelta(days=rng.randrange(5, 90))
+        sale_date = min(sale_date, date.today())
+    else:
+        original_id = LISTING_ID_BASE - 1 - i
+        asking_price = rng.randrange(500, 15000) * 1000
+        living_area = rng.randrange(20, 220)
+        street_address = f"Vägen {i % 500 + 1}"
+        area = f"Område {1 + rng.randrange(sizes['locations'])}"
+        municipality = f"Kommun {1 + rng.randrange(MUNICIPALITIES)}"
+        agency = f"Mäklarbyrå {1 + rng.randrange(sizes['agencies'])}"
+        sale_date = date.today() - timedelta(days=rng.randrange(0, history_days))
+
+    final_price = int(asking_price * rng.uniform(0.85, 1.25)) // 1000 * 1000
+    price_change = final_price - asking_price
+    return {
+        "sale_hemnet_id": sale_id,
+        "original_hemnet_id": original_id,
+        "final_price": final_price,
+        "asking_price": asking_price,
+        "price_change": price_change,
+        "price_change_percentage": round(price_change * 100 / asking_price, 2),
+        "sale_date": sale_date,
+        "sale_date_str": f"Såld {sale_date.day} {MONTHS[sale_date.month - 1]} {sale_date.year}",
+        "broker_agency": agency,
+        "living_area": living_area,
+        "land_area": rng.randrange(200, 2000) if rng.random() < 0.3 else None,
+        "rooms": rng.randrange(1, 8),
+        "construction_year": rng.randrange(1900, date.today().year),
+        "street_address": street_address,
+        "area": area,
+        "municipality": municipality,
+        "running_costs": rng.randrange(10000, 60000),
+        "url": f"https://www.hemnet.se/salda/lagenhet-{sale_id}",
+        "latitude": round(55.3 + rng.random() * 14, 8),
+        "longitude": round(11.1 + rng.random() * 12, 8),
+    }
+
+def generate(listings, sales, seed=0, cardinalities=None, matched_share=0.8, start=0):
+    """
+    Yield ("listing", record) and ("sale", record) pairs, interleaved the way a
+    crawl would store them: each sale comes after the listing it is of.
+
+    Args:
+        listings: Number of listings
+        sales: Number of sales; matched_share of them are of generated listings
+        seed: Random seed; the same seed and start give the same records
+        cardinalities: Overrides of DEFAULT_CARDINALITIES
+        start: Index of the first listing, to extend an earlier run made with
+            the same sales-to-listings ratio
+    """
+    rng = random.Random(f"{seed}:{start}")
+    recent = []
+    sale_index = start * sales // listings if listings else start
+    for i in range(start, start + listings):
+        listing = synthetic_listing(i, rng, cardinalities)
+        yield "listing", listing
+        recent.append(listing)
+        # Sales are emitted at the rate sales/listings, matched to a recent listing
+        while listings and sale_index < (i + 1) * sales // listings:
+            listing = rng.choice(recent) if rng.random() < matched_share else None
+            yield "sale", synthetic_sale(sale_index, rng, listing, cardinalities)
+            sale_index += 1
+        if len(recent) > 1000:
+            recent = recent[-500:]
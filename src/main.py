@@ -2,97 +2,342 @@ import schedule
 import time
 import logging
 import argparse
+import os
 from datetime import datetime
 import traceback
 
 # Import your scraper functions
 from scrapers.active_listings_scraper import main as scrape_active_listings
 from scrapers.sold_listings_scraper import main as scrape_sold_listings
+from scrapers.sold_backfill import DEFAULT_WORKERS as DEFAULT_BACKFILL_WORKERS, run_backfill
+from scrapers.worker_pool import DEFAULT_PROCESS_WORKERS
 # Import the logging setup function
 from utils.logging_setup import setup_logging
+from utils.playwright_utils import BrowserManager
+from utils.database_utils import (
+    finish_scraper_run,
+    link_unmatched_sales,
+    refresh_analytics_views,
+    scraper_job_lock,
+    start_scraper_run,
+)
+from utils.profiling import PROFILE_MODES, profile_run
+from utils.migration_utils import apply_migrations, ensure_property_sales_partitions
+from utils.export_utils import export_to_parquet
+from analytics.comps import update_listing_comps
 
 # Use the centralized logging setup
 logger = setup_logging()
 # Rename the logger to be scheduler-specific while still using the central config
 logger = logging.getLogger('hemnet_scraper.scheduler')
 
-def run_active_listings_scraper():
+def run_active_listings_scraper(deadline=None, browser=None, fast=False, workers=None, max_requests=None):
     """
-    Wrapper function to run the active listings scraper with error handling
+    Wrapper function to run the active listings scraper with error handling,
+    followed by linking previously stored sales to the newly scraped listings
+    and computing comparable sales for them
+    
+    Args:
+        deadline: Optional time.monotonic() value at which the crawl stops
+        browser: Running browser to reuse in daemon mode
+        fast: Update known listings from search result cards (fast mode)
+        workers: Number of browser processes fetching detail pages (single-process when None)
+        max_requests: Optional number of result and detail pages the crawl may fetch
+    
+    Returns:
+        The scraper's run counters, with an "error" entry if it failed
     """
     logger.info("Starting active listings scraper")
     try:
-        scrape_active_listings()
+        stats = scrape_active_listings(
+            deadline=deadline, browser=browser, fast=fast, workers=workers, max_requests=max_requests
+        ) or {}
         logger.info("Active listings scraper completed successfully")
     except Exception as e:
         logger.error(f"Error running active listings scraper: {e}")
         logger.error(traceback.format_exc())
+        return {"error": str(e)}
+    
+    stats["sales_linked"], stats["listings_marked_sold"] = link_unmatched_sales()
+    stats["listings_with_comps"] = update_listing_comps()
+    return stats
         
-def run_sold_listings_scraper():
+def run_sold_listings_scraper(deadline=None, browser=None, fast=False, workers=None, max_requests=None):
     """
     Wrapper function to run the sold listings scraper with error handling
+    
+    Args:
+        deadline: Optional time.monotonic() value at which the crawl stops
+        browser: Running browser to reuse in daemon mode
+        fast: Store sales from search result cards where possible (fast mode)
+        workers: Number of browser processes fetching detail pages (single-process when None)
+        max_requests: Optional number of result and detail pages the crawl may fetch
+    
+    Returns:
+        The scraper's run counters, with an "error" entry if it failed
     """
     logger.info("Starting sold listings scraper")
     try:
-        scrape_sold_listings()
+        stats = scrape_sold_listings(
+            deadline=deadline, browser=browser, fast=fast, workers=workers, max_requests=max_requests
+        ) or {}
         logger.info("Sold listings scraper completed successfully")
+        return stats
     except Exception as e:
         logger.error(f"Error running sold listings scraper: {e}")
         logger.error(traceback.format_exc())
+        return {"error": str(e)}
+
+# Scheduled jobs: the wrapper that runs each and the counter recorded as its items processed
+JOBS = {
+    "active": {"run": run_active_listings_scraper, "items": "listings_processed"},
+    "sold": {"run": run_sold_listings_scraper, "items": "sales_processed"},
+}
 
-def run_both_scrapers():
+def run_job(job, time_budget_minutes=None, browser_manager=None, fast=False, profile=None, workers=None,
+            request_budget=None):
     """
-    Run both scrapers in sequence
+    Run one scraper job under its advisory lock, then refresh the analytics views
+    it affected and update the Parquet export. The run is recorded in scraper_runs.
+    
+    Args:
+        job: Key of JOBS
+        time_budget_minutes: Optional limit after which the crawl stops cleanly
+        browser_manager: BrowserManager to take the browser from in daemon mode;
+            the scraper launches its own browser otherwise
+        fast: Run the scraper in search-results-only fast mode
+        profile: Profile the run ("sample" or "cprofile") and write its profile to LOG_DIR/profiles
+        workers: Number of browser processes fetching detail pages (single-process when None)
+        request_budget: Optional number of result and detail pages the crawl may fetch;
+            work it doesn't reach is deferred to the next run
+    
+    Returns:
+        The job's run counters
     """
-    logger.info("===== Starting scheduled scraping job =====")
+    logger.info(f"===== Starting {job} job =====")
     start_time = datetime.now()
-    logger.info(f"Job started at: {start_time.strftime('%Y-%m-%d %H:%M:%S')}")
+    changes = {}
+    try:
+        with scraper_job_lock(job) as acquired:
+            if not acquired:
+                logger.warning(f"Another {job} run is still in progress, skipping this run")
+                finish_scraper_run(start_scraper_run(job, status="skipped"), "skipped")
+                return changes
+            
+            budget_seconds = int(time_budget_minutes * 60) if time_budget_minutes else None
+            run_id = start_scraper_run(job, budget_seconds)
+            deadline = time.monotonic() + budget_seconds if budget_seconds else None
+            
+            with profile_run(job, profile) as profile_summary:
+                if browser_manager is None:
+                    changes = JOBS[job]["run"](deadline, fast=fast, workers=workers, max_requests=request_budget)
+                else:
+                    try:
+                        browser_summary = browser_manager.ensure_healthy()
+                    except Exception as e:
+                        logger.error(f"Error restarting browser: {e}")
+                        browser_summary = {"error": f"Browser restart failed: {e}"}
+                    if "error" in browser_summary:
+                        changes = browser_summary
+                    else:
+                        changes = JOBS[job]["run"](
+                            deadline, browser_manager.browser, fast=fast, workers=workers, max_requests=request_budget
+                        )
+                        changes.update(browser_summary)
+            changes.update(profile_summary)
+            
+            # Refresh only the analytics views this run could have changed
+            logger.info(f"Run changes: {changes}")
+            refreshed = refresh_analytics_views(changes)
+            logger.info(f"Refreshed analytics views: {refreshed or 'none'}")
+            
+            # Keep the notebooks' Parquet copy current when an export directory is configured
+            if os.environ.get("EXPORT_DIR"):
+                run_parquet_export()
+            
+            if "error" in changes:
+                status = "failed"
+            elif changes.get("budget_exhausted"):
+                status = "budget_exhausted"
+            else:
+                status = "completed"
+            finish_scraper_run(
+                run_id, status, changes, changes.get(JOBS[job]["items"]), changes.get("error")
+            )
+    except Exception as e:
+        logger.error(f"Error running {job} job: {e}")
+        logger.error(traceback.format_exc())
     
-    # Run active listings first
-    run_active_listings_scraper()
+    logger.info(f"Total duration: {datetime.now() - start_time}")
+    logger.info(f"===== {job} job completed =====")
+    return changes
+
+def run_parquet_export(full=False):
+    """
+    Run the incremental Parquet export with error handling
+    """
+    logger.info("Starting Parquet export")
+    try:
+        summary = export_to_parquet(full=full)
+        logger.info(f"Parquet export completed, partitions rewritten: {summary}")
+    except Exception as e:
+        logger.error(f"Error running Parquet export: {e}")
+        logger.error(traceback.format_exc())
+
+def run_sold_backfill(workers=DEFAULT_BACKFILL_WORKERS, location_ids=None, sold_age=None, time_budget_minutes=None,
+                      profile=None):
+    """
+    Run the sold listings backfill with error handling, recorded in scraper_runs
+    as a "backfill" job, then refresh the analytics views it affected
     
-    # Then run sold listings
-    run_sold_listings_scraper()
+    Args:
+        workers: Number of parallel backfill workers
+        location_ids: Hemnet location ids of the regions to backfill (default: every stored county)
+        sold_age: Optional sold_age search filter
+        time_budget_minutes: Optional limit after which workers stop at the next
+            page; unfinished slices resume on the next run
+        profile: Profile the run ("sample" or "cprofile") and write its profile to LOG_DIR/profiles
+    """
+    logger.info(f"===== Starting sold listings backfill with {workers} workers =====")
+    budget_seconds = int(time_budget_minutes * 60) if time_budget_minutes else None
+    run_id = start_scraper_run("backfill", budget_seconds)
+    deadline = time.monotonic() + budget_seconds if budget_seconds else None
+    try:
+        with profile_run("backfill", profile) as profile_summary:
+            changes = run_backfill(
+                location_ids=location_ids, sold_age=sold_age, workers=workers, deadline=deadline
+            )
+        changes.update(profile_summary)
+        status = "budget_exhausted" if deadline is not None and time.monotonic() >= deadline else "completed"
+    except Exception as e:
+        logger.error(f"Error running sold listings backfill: {e}")
+        logger.error(traceback.format_exc())
+        changes, status = {"error": str(e)}, "failed"
     
-    end_time = datetime.now()
-    duration = end_time - start_time
-    logger.info(f"Job completed at: {end_time.strftime('%Y-%m-%d %H:%M:%S')}")
-    logger.info(f"Total duration: {duration}")
-    logger.info("===== Scheduled scraping job completed =====")
+    logger.info(f"Backfill changes: {changes}")
+    refreshed = refresh_analytics_views(changes)
+    logger.info(f"Refreshed analytics views: {refreshed or 'none'}")
+    finish_scraper_run(run_id, status, changes, changes.get("sales_processed"), changes.get("error"))
+    return changes
+
+def parse_location_ids(value):
+    """Parse a comma-separated list of Hemnet location ids"""
+    try:
+        return [int(location_id) for location_id in value.split(",") if location_id.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid location ids: {value}")
 
-def setup_schedule(time_str="02:00", run_now=False):
+def parse_cadence(value):
     """
-    Set up the scheduling for both scrapers
+    Parse a job cadence: "HH:MM" runs daily at that time, "<n>m" or "<n>h" every n minutes or hours
     
-    Args:
-        time_str: Time to run in 24-hour format (default: "02:00")
-        run_now: Whether to also run the scrapers immediately
+    Returns:
+        tuple: ("daily", "HH:MM") or ("minutes", n)
+    """
+    value = value.strip().lower()
+    if ":" in value:
+        try:
+            return "daily", datetime.strptime(value, "%H:%M").strftime("%H:%M")
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Invalid time of day: {value}")
+    if value[-1:] in ("m", "h") and value[:-1].isdigit() and int(value[:-1]) > 0:
+        return "minutes", int(value[:-1]) * (60 if value[-1] == "h" else 1)
+    raise argparse.ArgumentTypeError(f"Invalid cadence: {value} (use HH:MM, <n>m or <n>h)")
+
+def setup_schedule(cadences, time_budgets=None, run_now=False, browser_manager=None, fast=False, profile=None,
+                   workers=None, request_budgets=None):
     """
-    logger.info(f"Setting up scheduler to run daily at {time_str}")
+    Set up a schedule per scraper job and run it until the process exits
     
-    # Schedule the job to run at the specified time every day
-    schedule.every().day.at(time_str).do(run_both_scrapers)
+    Args:
+        cadences: Dictionary of job name to parsed cadence, e.g. {"active": ("minutes", 60)}
+        time_budgets: Dictionary of job name to time budget in minutes
+        run_now: Whether to also run every job immediately
+        browser_manager: BrowserManager shared by all jobs in daemon mode
+        fast: Run the jobs in search-results-only fast mode
+        profile: Profile every run ("sample" or "cprofile")
+        workers: Number of browser processes fetching detail pages (single-process when None)
+        request_budgets: Dictionary of job name to request budget per run
+    """
+    time_budgets = time_budgets or {}
+    request_budgets = request_budgets or {}
+    for job, (kind, value) in cadences.items():
+        budget = time_budgets.get(job)
+        requests = request_budgets.get(job)
+        budgets = f"time budget: {budget or 'none'} min, request budget: {requests or 'none'}"
+        if kind == "daily":
+            logger.info(f"Scheduling {job} job daily at {value}, {budgets}")
+            schedule.every().day.at(value).do(
+                run_job, job, budget, browser_manager, fast, profile, workers, requests
+            ).tag(job)
+        else:
+            logger.info(f"Scheduling {job} job every {value} min, {budgets}")
+            schedule.every(value).minutes.do(
+                run_job, job, budget, browser_manager, fast, profile, workers, requests
+            ).tag(job)
     
     # Run immediately if requested
     if run_now:
-        logger.info("Running scrapers immediately")
-        run_both_scrapers()
+        logger.info("Running all jobs immediately")
+        schedule.run_all()
     
-    # Keep the script running
+    # Sleep until the next job is due instead of polling
     while True:
+        idle_seconds = schedule.idle_seconds()
+        if idle_seconds is None:
+            logger.warning("No jobs scheduled, exiting")
+            return
+        if idle_seconds > 0:
+            time.sleep(idle_seconds)
         schedule.run_pending()
-        time.sleep(60)  # Check every minute
 
 def main():
     """
     Main function to parse arguments and start the scheduler
     """
-    parser = argparse.ArgumentParser(description="Schedule Hemnet scrapers to run daily")
+    parser = argparse.ArgumentParser(description="Schedule Hemnet scrapers")
     parser.add_argument(
         "--time", 
         type=str, 
         default="02:00", 
-        help="Time to run the scrapers daily (24-hour format, e.g., '02:00')"
+        help="Time to run the scrapers daily (24-hour format, e.g., '02:00') when no cadence is given"
+    )
+    parser.add_argument(
+        "--active-cadence", 
+        type=parse_cadence, 
+        default=None, 
+        help="When to run the active listings scraper: 'HH:MM' daily, or '<n>m'/'<n>h' for every n minutes/hours"
+    )
+    parser.add_argument(
+        "--sold-cadence", 
+        type=parse_cadence, 
+        default=None, 
+        help="When to run the sold listings scraper, in the same format as --active-cadence"
+    )
+    parser.add_argument(
+        "--active-budget", 
+        type=float, 
+        default=None, 
+        help="Time budget in minutes per active listings run; the crawl stops cleanly when it runs out"
+    )
+    parser.add_argument(
+        "--sold-budget", 
+        type=float, 
+        default=None, 
+        help="Time budget in minutes per sold listings run"
+    )
+    parser.add_argument(
+        "--active-requests", 
+        type=int, 
+        default=None, 
+        help="Request budget per active listings run (result and detail pages); new listings come first, "
+             "then change checks, and what is left is deferred to the next run"
+    )
+    parser.add_argument(
+        "--sold-requests", 
+        type=int, 
+        default=None, 
+        help="Request budget per sold listings run"
     )
     parser.add_argument(
         "--run-now", 
@@ -109,22 +354,140 @@ def main():
         action="store_true", 
         help="Run only the sold listings scraper immediately"
     )
+    parser.add_argument(
+        "--daemon", 
+        action="store_true", 
+        help="Start the browser once and reuse it across scheduled jobs, restarting it when a health check fails"
+    )
+    parser.add_argument(
+        "--fast", 
+        action="store_true", 
+        help="Work from search result pages: refresh known listings' asking prices and store complete sale cards without opening their detail pages"
+    )
+    parser.add_argument(
+        "--workers", 
+        type=int, 
+        nargs="?", 
+        const=DEFAULT_PROCESS_WORKERS, 
+        default=None, 
+        help=f"Fetch detail pages in this many browser processes, with this process saving the records (default when given: CPU count, {DEFAULT_PROCESS_WORKERS})"
+    )
+    parser.add_argument(
+        "--profile", 
+        nargs="?", 
+        const="sample", 
+        choices=PROFILE_MODES, 
+        default=None, 
+        help="Profile each run and write collapsed stacks and per-stage timings to LOG_DIR/profiles; "
+             "'cprofile' also writes cProfile stats (default when given: sample)"
+    )
+    parser.add_argument(
+        "--backfill", 
+        action="store_true", 
+        help="Backfill the sold listings history in region, item type and price slices, then exit; resumes from its checkpoints"
+    )
+    parser.add_argument(
+        "--backfill-workers", 
+        type=int, 
+        default=DEFAULT_BACKFILL_WORKERS, 
+        help="Parallel backfill workers, each with its own browser"
+    )
+    parser.add_argument(
+        "--backfill-regions", 
+        type=parse_location_ids, 
+        default=None, 
+        help="Comma-separated Hemnet location ids to backfill (default: every stored county)"
+    )
+    parser.add_argument(
+        "--backfill-sold-age", 
+        type=str, 
+        default=None, 
+        help="Hemnet sold_age filter for the backfill searches, e.g. '12m'"
+    )
+    parser.add_argument(
+        "--backfill-budget", 
+        type=float, 
+        default=None, 
+        help="Time budget in minutes for the backfill; unfinished slices resume on the next run"
+    )
+    parser.add_argument(
+        "--export", 
+        action="store_true", 
+        help="Export listings and sales to partitioned Parquet files in EXPORT_DIR and exit"
+    )
+    parser.add_argument(
+        "--full-export", 
+        action="store_true", 
+        help="With --export, rewrite every partition instead of only the changed ones"
+    )
+    parser.add_argument(
+        "--migrate", 
+        action="store_true", 
+        help="Apply pending database migrations and exit"
+    )
     
     args = parser.parse_args()
     
+    # Bring the database schema up to date before any scraper touches it
+    try:
+        apply_migrations()
+        ensure_property_sales_partitions()
+    except Exception as e:
+        logger.error(f"Error preparing database schema: {e}")
+    
+    if args.migrate:
+        return
+    
+    if args.export:
+        run_parquet_export(full=args.full_export)
+        return
+    
+    if args.backfill:
+        run_sold_backfill(
+            args.backfill_workers, args.backfill_regions, args.backfill_sold_age, args.backfill_budget,
+            args.profile
+        )
+        return
+    
+    time_budgets = {"active": args.active_budget, "sold": args.sold_budget}
+    request_budgets = {"active": args.active_requests, "sold": args.sold_requests}
+    
     # Handle one-time runs without scheduling
     if args.active_only:
         logger.info("Running active listings scraper once")
-        run_active_listings_scraper()
+        run_job(
+            "active", time_budgets["active"], fast=args.fast, profile=args.profile, workers=args.workers,
+            request_budget=request_budgets["active"],
+        )
         return
     
     if args.sold_only:
         logger.info("Running sold listings scraper once")
-        run_sold_listings_scraper()
+        run_job(
+            "sold", time_budgets["sold"], fast=args.fast, profile=args.profile, workers=args.workers,
+            request_budget=request_budgets["sold"],
+        )
         return
     
     # Otherwise, set up the scheduler
-    setup_schedule(args.time, args.run_now)
+    daily = parse_cadence(args.time)
+    cadences = {"active": args.active_cadence or daily, "sold": args.sold_cadence or daily}
+    if not args.daemon:
+        setup_schedule(
+            cadences, time_budgets, args.run_now, fast=args.fast, profile=args.profile, workers=args.workers,
+            request_budgets=request_budgets,
+        )
+        return
+    
+    browser_manager = BrowserManager()
+    browser_manager.start()
+    try:
+        setup_schedule(
+            cadences, time_budgets, args.run_now, browser_manager, args.fast, args.profile, args.workers,
+            request_budgets,
+        )
+    finally:
+        browser_manager.stop()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,291 @@
+"""
+Cached read-only HTTP API for dashboards and notebooks.
+
+Run from the repository root:
+
+    python src/read_service.py --port 8080
+
+Serves JSON aggregates built with utils.read_utils:
+
+    /locations              location_market_performance (?type=municipality&limit=50)
+    /cooperatives           housing_cooperative_performance (?limit=50)
+    /brokers                listing and sale aggregates per broker (?limit=50)
+    /listings/latest        latest active listings (?limit=50&housing_form=Villa&location_id=123)
+    /listings/search        keyword search, best matches first
+                            (?q=balkong+sjöutsikt&status=active&min_price=1000000&max_price=4000000&location_id=123)
+    /version                current data version and cache counters
+
+Responses are cached in memory, evicted by TTL and least recent use, and keyed
+on data_version, which finish_scraper_run bumps when a scraper run finishes:
+when the version changes the whole cache is dropped. Every response carries an
+ETag derived from the version and payload, and a request whose If-None-Match
+matches gets an empty 304 instead of the payload.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from utils.database_utils import get_data_version
+from utils.logging_setup import setup_logging
+from utils.read_utils import load_records, search_listings
+
+setup_logging("hemnet_read_api.log")
+logger = logging.getLogger('hemnet_scraper.read_service')
+
+DEFAULT_TTL_SECONDS = 300
+DEFAULT_MAX_ENTRIES = 256
+VERSION_CHECK_SECONDS = 5       # how stale the known data version may get
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 1000
+
+# Endpoints: the read_utils query source, its ordering and any fixed filters
+ENDPOINTS = {
+    "/locations": {
+        "source": "location_market_performance",
+        "order_by": "lmp.total_sales DESC, lmp.location_id",
+    },
+    "/cooperatives": {
+        "source": "housing_cooperative_performance",
+        "order_by": "hcp.total_sales DESC, hcp.housing_cooperative_id",
+    },
+    "/brokers": {
+        "source": "broker_performance",
+        "order_by": "bp.total_listings DESC, bp.broker_id",
+    },
+    "/listings/latest": {
+        "source": "listings",
+        "order_by": "l.published_date DESC, l.listing_id DESC",
+        "statuses": ["active"],
+    },
+    # Served by search_listings rather than a query source
+    "/listings/search": {},
+}
+
+
+class ResponseCache:
+    """
+    Thread-safe LRU cache of encoded responses with a TTL, valid for one data version.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.version = None
+        self._entries = OrderedDict()   # key -> (expires_at, etag, body)
+        self._lock = threading.Lock()
+        self._version_checked_at = 0.0
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evicted": 0, "invalidations": 0}
+
+    def check_version(self):
+        """
+        Return the current data version, reading it at most every
+        VERSION_CHECK_SECONDS and dropping every entry when it changed.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now - self._version_checked_at < VERSION_CHECK_SECONDS and self.version is not None:
+                return self.version
+            self._version_checked_at = now
+        version = get_data_version()
+        with self._lock:
+            if version is None:
+                # Keep serving the known version while the database is unreachable
+                return self.version
+            if version != self.version:
+                if self.version is not None:
+                    logger.info(f"Data version {self.version} -> {version}, dropping {len(self._entries)} cached responses")
+                    self.stats["invalidations"] += 1
+                self._entries.clear()
+                self.version = version
+            return version
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[1], entry[2]
+
+    def put(self, key, version, etag, body):
+        with self._lock:
+            if version != self.version:
+                # Computed against a version that has since been replaced
+                return
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, etag, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evicted"] += 1
+
+    def summary(self):
+        with self._lock:
+            return {"version": self.version, "entries": len(self._entries), **self.stats}
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"Can't encode {type(value).__name__}")
+
+def _int_param(query, name, default=None, maximum=None):
+    values = query.get(name)
+    if not values:
+        return default
+    value = int(values[0])
+    if value < 1:
+        raise ValueError(f"{name} must be positive")
+    return min(value, maximum) if maximum else value
+
+def _search_params(query):
+    """search_listings keyword arguments for a /listings/search query string"""
+    text = (query.get("q") or [""])[0].strip()
+    if not text:
+        raise ValueError("q is required")
+    params = {"limit": _int_param(query, "limit", DEFAULT_LIMIT, MAX_LIMIT)}
+    if query.get("status"):
+        params["statuses"] = query["status"]
+    if query.get("min_price"):
+        params["min_price"] = int(query["min_price"][0])
+    if query.get("max_price"):
+        params["max_price"] = int(query["max_price"][0])
+    if query.get("location_id"):
+        params["location_ids"] = [int(value) for value in query["location_id"]]
+    return text, params
+
+def build_filters(path, query):
+    """
+    build_query keyword arguments for an endpoint and its query string.
+
+    Raises:
+        ValueError: If a parameter is invalid
+    """
+    endpoint = ENDPOINTS[path]
+    filters = {
+        "order_by": endpoint["order_by"],
+        "limit": _int_param(query, "limit", DEFAULT_LIMIT, MAX_LIMIT),
+    }
+    if endpoint.get("statuses"):
+        filters["statuses"] = endpoint["statuses"]
+    if path == "/locations" and query.get("type"):
+        filters["location_types"] = query["type"]
+    if path == "/listings/latest":
+        if query.get("housing_form"):
+            filters["housing_forms"] = query["housing_form"]
+        if query.get("location_id"):
+            filters["location_ids"] = [int(value) for value in query["location_id"]]
+    return filters
+
+def load_payload(path, query):
+    """The records an endpoint returns for a query string"""
+    if path == "/listings/search":
+        text, params = _search_params(query)
+        return search_listings(text, **params)
+    return load_records(ENDPOINTS[path]["source"], **build_filters(path, query))
+
+
+class ReadRequestHandler(BaseHTTPRequestHandler):
+    cache = None    # set by serve()
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    def _send(self, status, body=b"", etag=None, version=None):
+        self.send_response(status)
+        if etag:
+            self.send_header("ETag", etag)
+            # Clients may keep the payload but must revalidate it, which costs a 304
+            self.send_header("Cache-Control", "no-cache")
+        if version is not None:
+            self.send_header("X-Data-Version", str(version))
+        if body:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def _send_error(self, status, message):
+        self._send(status, json.dumps({"error": message}).encode())
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        path = url.path.rstrip("/") or "/"
+        query = parse_qs(url.query)
+        start_time = time.monotonic()
+
+        version = self.cache.check_version()
+        if path == "/version":
+            self._send(200, json.dumps(self.cache.summary()).encode(), version=version)
+            return
+        if path not in ENDPOINTS:
+            self._send_error(404, f"Unknown endpoint: {path}")
+            return
+
+        key = (path, tuple(sorted((name, tuple(values)) for name, values in query.items())))
+        cached = self.cache.get(key)
+        if cached is None:
+            try:
+                records = load_payload(path, query)
+            except ValueError as e:
+                self._send_error(400, str(e))
+                return
+            except Exception as e:
+                logger.error(f"Error loading {self.path}: {e}")
+                self._send_error(500, "Query failed")
+                return
+            body = json.dumps(
+                {"version": version, "count": len(records), "records": records}, default=_json_default
+            ).encode()
+            etag = f'"{version}-{hashlib.sha1(body).hexdigest()[:16]}"'
+            self.cache.put(key, version, etag, body)
+        else:
+            etag, body = cached
+
+        if etag in (self.headers.get("If-None-Match") or ""):
+            self._send(304, etag=etag, version=version)
+        else:
+            self._send(200, body, etag=etag, version=version)
+        logger.debug(
+            "%s served in %.1f ms (%s)", self.path, (time.monotonic() - start_time) * 1000,
+            "cached" if cached else "computed",
+        )
+
+
+def serve(host, port, max_entries=DEFAULT_MAX_ENTRIES, ttl_seconds=DEFAULT_TTL_SECONDS):
+    ReadRequestHandler.cache = ResponseCache(max_entries, ttl_seconds)
+    server = ThreadingHTTPServer((host, port), ReadRequestHandler)
+    logger.info(f"Read service listening on {host}:{port}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Cached read-only HTTP API over the analytics views")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8080, help="Port to listen on")
+    parser.add_argument("--ttl", type=int, default=DEFAULT_TTL_SECONDS, help="Seconds a cached response is served")
+    parser.add_argument("--max-entries", type=int, default=DEFAULT_MAX_ENTRIES, help="Cached responses kept")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.max_entries, args.ttl)
+
+if __name__ == "__main__":
+    main()
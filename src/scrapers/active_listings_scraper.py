@@ -1,17 +1,39 @@
 import gc
-from bs4 import BeautifulSoup, SoupStrainer
-import json
+import time
 from datetime import datetime, timedelta
 from utils.logging_setup import setup_logging
-from utils.playwright_utils import browser_context, page_context
-from utils.database_utils import listing_exists_in_database, save_to_database
+from utils.profiling import stage
+from utils.playwright_utils import browser_context, fetch_page_payload, page_context
+from utils.database_utils import (
+    load_deferred_urls,
+    mark_listings_checked,
+    save_deferred_urls,
+    save_to_database,
+    update_asking_prices,
+)
+from utils.validation import quarantine_rejects, validate_batch
+from scrapers.search_results import LISTING_CARD_PREFIXES, parse_listing_cards
+from utils.known_ids import load_due_listing_ids, load_known_listing_ids
+from scrapers.crawl_planner import DUE, NEW, PAGE, PRIORITY_NAMES, REFETCH, CrawlPlanner
+from scrapers.worker_pool import WorkerPool
+from utils.parsing_utils import parse_coordinates, parse_currency, parse_floor, parse_listing_id
 
 logger = setup_logging()
 
+# Apollo state entries a listing page is parsed from
+LISTING_STATE_PREFIXES = (
+    "Location:", "BrokerAgency:", "Broker:",
+    "ActivePropertyListing:", "ProjectUnit:", "DeactivatedBeforeOpenHousePropertyListing:",
+)
+
+MAX_PAGES = 50
+CHECK_INTERVAL_DAYS = 7     # known active listings not checked for this long are refetched
+
 # Track exceptions and null fields
 exceptions = list()
 nulls = set()
 
+@stage("extract_data")
 def extract_data(listingData, locations, brokerAgencies, broker):
     try:
         data = dict()
@@ -30,8 +52,8 @@ def extract_data(listingData, locations, brokerAgencies, broker):
         else:
             data["square_meter_price"] = None
         data["fee"] = int(listingData["fee"]["amount"]) if listingData["fee"] else None
-        data["yearly_arrende_fee"] = int("".join(listingData["yearlyArrendeFee"]["formatted"].strip("kr").split())) if listingData["yearlyArrendeFee"] else None
-        data["yearly_leasehold_fee"] = int("".join(listingData["yearlyLeaseholdFee"]["formatted"].strip("kr").split())) if listingData["yearlyLeaseholdFee"] else None
+        data["yearly_arrende_fee"] = parse_currency(listingData["yearlyArrendeFee"]["formatted"]) if listingData["yearlyArrendeFee"] else None
+        data["yearly_leasehold_fee"] = parse_currency(listingData["yearlyLeaseholdFee"]["formatted"]) if listingData["yearlyLeaseholdFee"] else None
         data["running_costs"] = int(listingData["runningCosts"]["amount"]) if listingData["runningCosts"] else None
         data["construction_year"] = int(listingData["legacyConstructionYear"]) if listingData["legacyConstructionYear"] else None
         data["living_area"] = int(listingData["livingArea"]) if listingData["livingArea"] else None
@@ -45,7 +67,7 @@ def extract_data(listingData, locations, brokerAgencies, broker):
         data["relevant_amenities"] = dict()
         data["energy_classification"] = listingData["energyClassification"]["classification"] if listingData["energyClassification"] else None
         data["housing_cooperative"] = listingData["housingCooperative"] if listingData["housingCooperative"] else None
-        data["floor"] = int(listingData["formattedFloor"][:2].strip().strip(",")) if listingData["formattedFloor"] else None
+        data["floor"] = parse_floor(listingData["formattedFloor"])
         data["published_date"] = (datetime.now() - timedelta(days=int(listingData["daysOnHemnet"]))).strftime('%Y-%m-%d')
         data["locations"] = locations
         data["broker_agencies"] = brokerAgencies
@@ -53,6 +75,7 @@ def extract_data(listingData, locations, brokerAgencies, broker):
         data["description"] = listingData["description"]
         data["closest_water_distance_meters"] = int(listingData["closestWaterDistanceMeters"]) if listingData["closestWaterDistanceMeters"] else None
         data["coastline_distance_meters"] = int(listingData["coastlineDistanceMeters"]) if listingData["coastlineDistanceMeters"] else None
+        data["latitude"], data["longitude"] = parse_coordinates(listingData.get("coordinates"))
 
         for amenity in listingData["relevantAmenities"]:
             data["relevant_amenities"][amenity["title"]] = amenity["isAvailable"]
@@ -65,48 +88,58 @@ def extract_data(listingData, locations, brokerAgencies, broker):
         return data
     except KeyError as e:
         logger.error(f"KeyError in extract_data: {e}")
-        logger.debug(f"Local variables: {e.__traceback__.tb_frame.f_locals}")
+        logger.debug("Local variables: %s", e.__traceback__.tb_frame.f_locals)
         exceptions.append(e)
         return False
     except Exception as e:
         logger.error(f"Exception in extract_data: {e}")
-        logger.debug(f"Local variables: {e.__traceback__.tb_frame.f_locals}")
+        logger.debug("Local variables: %s", e.__traceback__.tb_frame.f_locals)
         exceptions.append(e)
         return False
 
+@stage("get_listing_urls")
 def get_listing_urls(page_number, browser, base_url):
     webpage = f"/bostader{'?page=' + str(page_number) if page_number > 1 else ''}"
-    logger.info(f"Fetching listings from page {page_number}: {webpage}")        
+    logger.info("Fetching listings from page %d: %s", page_number, webpage)
     
     with page_context(browser) as page:
-        page.goto(base_url + webpage, wait_until="domcontentloaded")
-        content = page.content()
-        # Parse only the needed elements instead of the entire page
-        soup = BeautifulSoup(content, 'html.parser', parse_only=SoupStrainer('div', attrs={'data-testid': 'result-list'}))
-        
-        if not soup:
-            logger.warning(f"Result list not found on page {page_number}")
-            return
+        payload = fetch_page_payload(page, base_url + webpage, link_prefix='/bostad')
+    
+    if not payload or not payload["links"]:
+        logger.warning(f"Result list not found on page {page_number}")
+        return []
+    return payload["links"]
 
-        for link in soup.find_all('a', href=True):
-            if link['href'].startswith('/bostad'):
-                yield link['href']
+@stage("get_listing_urls")
+def get_listing_search_page(page_number, browser, base_url):
+    """
+    Fetch one result page for fast mode.
+    
+    Returns:
+        tuple: (listing hrefs in page order, {hemnet_id: card} from the page's Apollo state)
+    """
+    webpage = f"/bostader{'?page=' + str(page_number) if page_number > 1 else ''}"
+    logger.info("Fetching listing cards from page %d: %s", page_number, webpage)
+    
+    with page_context(browser) as page:
+        payload = fetch_page_payload(page, base_url + webpage, LISTING_CARD_PREFIXES, link_prefix='/bostad')
+    
+    if not payload or not payload["links"]:
+        logger.warning(f"Result list not found on page {page_number}")
+        return [], {}
+    return payload["links"], parse_listing_cards(payload["apolloState"])
 
+@stage("get_listing_data")
 def get_listing_data(url, browser):
     with page_context(browser) as page:
         try:
-            page.goto(url, wait_until="domcontentloaded")
-            # Parse only the needed element
-            soup = BeautifulSoup(page.content(), 'html.parser', 
-                               parse_only=SoupStrainer('script', id='__NEXT_DATA__'))
-            
-            next_data = soup.find()
-            if not next_data:
+            # Only the Apollo entries extract_data reads are brought over from the page
+            payload = fetch_page_payload(page, url, LISTING_STATE_PREFIXES)
+            if not payload:
                 logger.warning(f"__NEXT_DATA__ not found for listing: {url}")
                 return False
-
-            data = json.loads(next_data.string)
-            apollo_state = data["props"]["pageProps"]["__APOLLO_STATE__"]
+            
+            apollo_state = payload["apolloState"]
             
             # Process data in smaller chunks
             locations = [
@@ -139,9 +172,8 @@ def get_listing_data(url, browser):
                 return False
 
             # Clear variables explicitly
-            del data
+            del payload
             del apollo_state
-            del soup
             
             return extract_data(listingData, locations, brokerAgencies, broker)
             
@@ -150,43 +182,235 @@ def get_listing_data(url, browser):
             exceptions.append(e)
             return False
 
-def main():
-    with browser_context() as (playwright, browser):
-        base_url = "https://www.hemnet.se"
+def save_listing_batch(batch, known_ids, stats, page_stats):
+    """
+    Validate one page of new listings and save the valid ones.
+    
+    Listings that would violate a schema constraint are quarantined in
+    ingest_rejects instead of being sent to the database.
+    """
+    valid, rejects = validate_batch(batch, "listing")
+    quarantine_rejects("listing", rejects, stats)
+    page_stats["rejected"] += len(rejects)
+    
+    for listingData in valid:
+        hemnet_id = listingData["hemnet_id"]
+        save_start = time.monotonic()
+        saved = save_to_database(listingData)
+        save_seconds = time.monotonic() - save_start
+        page_stats["save_seconds"] += save_seconds
+        if saved:
+            known_ids.add(hemnet_id)
+            logger.info(
+                "Saved listing %s", hemnet_id,
+                extra={"sample": True, "listing_id": hemnet_id, "save_seconds": round(save_seconds, 3)},
+            )
+            stats["listings_inserted"] += 1
+            page_stats["inserted"] += 1
+            if listingData["housing_cooperative"]:
+                stats["cooperative_listings_inserted"] += 1
+        else:
+            logger.warning("Failed to save listing %s", hemnet_id, extra={"listing_id": hemnet_id})
+
+def main(deadline=None, browser=None, fast=False, workers=None, max_requests=None):
+    """
+    Scrape active listings, serving the run's work from a crawl planner.
+    
+    Result pages are walked until 50 consecutive known listings are found.
+    Each page's new listings are fetched and saved before the next page is
+    walked; known listings due for a change check (CHECK_INTERVAL_DAYS) are
+    refetched after that, and with a budget other known listings after those.
+    New and due listings the budget didn't reach are stored for the next run,
+    which serves them first.
+    
+    In fast mode all result pages are walked instead: asking prices of known
+    listings are updated from the result cards in one statement per page,
+    which counts as their change check, and detail pages are only fetched for
+    new listings.
+    
+    Args:
+        deadline: Optional time.monotonic() value after which the crawl stops
+            before the next batch or detail page
+        browser: Already running browser to reuse (daemon mode); one is
+            launched and closed for this run otherwise
+        fast: Use the result cards for known listings (see above)
+        workers: Fetch detail pages in this many browser processes
+            (scrapers.worker_pool) instead of one at a time here
+        max_requests: Optional number of result and detail pages the run may fetch
+    
+    Returns:
+        Dictionary of run counters used to decide which analytics views to refresh
+    """
+    stats = {
+        "listings_processed": 0,
+        "asking_prices_updated": 0,
+        "listings_skipped_known": 0,
+        "listings_checked": 0,
+        "duplicate_hrefs": 0,
+        "listings_inserted": 0,
+        "cooperative_listings_inserted": 0,
+        "records_rejected": 0,
+        "rejected_fields": {},
+        "budget_exhausted": False,
+        "ramp_up_seconds": None,
+        "fetch_seconds": 0.0,
+        "save_seconds": 0.0,
+    }
+    
+    start_time = time.monotonic()
+    base_url = "https://www.hemnet.se"
+    # Existence checks go against this set instead of the database
+    known_ids = load_known_listing_ids()
+    due_ids = load_due_listing_ids(CHECK_INTERVAL_DAYS)
+    # Listings shift between result pages during a crawl, so the same link can show up twice
+    seen_listings = set()
+    
+    planner = CrawlPlanner(deadline, max_requests)
+    for url, priority in load_deferred_urls("active"):
+        href = url[len(base_url):]
+        href_id = parse_listing_id(href)
+        if priority == NEW and href_id in known_ids:
+            continue
+        seen_listings.add(href_id or href)
+        planner.add(priority, url)
+    stats["deferred_from_last_run"] = len(planner.deferred())
+    planner.add(PAGE, 1)
+    
+    pool = WorkerPool("listing", workers) if workers else None
+    with browser_context(browser) as (playwright, browser):
+        if playwright is not None:
+            stats["browser_startup_seconds"] = round(time.monotonic() - start_time, 3)
+        if pool is not None:
+            pool.start()
         consecutive_existing_count = 0
         
         try:
-            for x in range(1, 51):
-                for href in get_listing_urls(x, browser, base_url):
-                    try:
-                        listingData = get_listing_data(base_url + href, browser)
-                        if listingData:
-                            hemnet_id = listingData["hemnet_id"]
-                            if not listing_exists_in_database(hemnet_id):
-                                if save_to_database(listingData):
-                                    logger.info(f"Successfully saved listing {hemnet_id}")
-                                    consecutive_existing_count = 0
-                                else:
-                                    logger.warning(f"Failed to save listing {hemnet_id}")
-                            else:
-                                consecutive_existing_count += 1
-                                if consecutive_existing_count >= 50:
-                                    return
-                        del listingData
-                    except Exception as e:
-                        logger.error(f"Error processing listing {href}: {e}")
-                        consecutive_existing_count = 0
-                        continue
+            for priority, items in planner.batches():
+                if priority == PAGE:
+                    page_number = items[0]
+                    page_stats = {"listings": 0, "new": 0, "known": 0, "due": 0, "fetch_seconds": 0.0}
+                    fetch_start = time.monotonic()
+                    if fast:
+                        hrefs, cards = get_listing_search_page(page_number, browser, base_url)
+                    else:
+                        hrefs, cards = get_listing_urls(page_number, browser, base_url), {}
+                    page_stats["fetch_seconds"] += time.monotonic() - fetch_start
+                    planner.charge(PAGE)
+                    price_updates = []
+                    
+                    for href in hrefs:
+                        href_id = parse_listing_id(href)
+                        if (href_id or href) in seen_listings:
+                            stats["duplicate_hrefs"] += 1
+                            continue
+                        seen_listings.add(href_id or href)
+                        stats["listings_processed"] += 1
+                        page_stats["listings"] += 1
+                        
+                        # Known listings are recognised from the link alone, without fetching the page
+                        if href_id is None or href_id not in known_ids:
+                            planner.add(NEW, base_url + href)
+                            page_stats["new"] += 1
+                            consecutive_existing_count = 0
+                            continue
+                        stats["listings_skipped_known"] += 1
+                        page_stats["known"] += 1
+                        consecutive_existing_count += 1
+                        card = cards.get(href_id)
+                        if card and card["asking_price"]:
+                            price_updates.append((href_id, card["asking_price"]))
+                        elif href_id in due_ids:
+                            planner.add(DUE, base_url + href)
+                            page_stats["due"] += 1
+                        elif planner.budgeted:
+                            planner.add(REFETCH, base_url + href)
+                    
+                    if price_updates:
+                        stats["asking_prices_updated"] += update_asking_prices(price_updates)
+                        stats["listings_checked"] += mark_listings_checked(hemnet_id for hemnet_id, _ in price_updates)
+                    
+                    if page_number < MAX_PAGES and (hrefs or not fast):
+                        if not fast and consecutive_existing_count >= 50:
+                            logger.info("Found 50 consecutive known listings, not walking past page %d", page_number)
+                        else:
+                            planner.add(PAGE, page_number + 1)
+                    
+                    # One aggregated line per result page instead of one per listing
+                    stats["fetch_seconds"] += page_stats["fetch_seconds"]
+                    logger.info(
+                        "Page %d: %d listings, %d new, %d already known, %d due for a check",
+                        page_number, page_stats["listings"], page_stats["new"], page_stats["known"], page_stats["due"],
+                        extra={"page": page_number, **{key: round(value, 3) for key, value in page_stats.items()}},
+                    )
+                    # Force garbage collection after each page
+                    gc.collect()
+                    continue
                 
-                # Force garbage collection after each page
-                gc.collect()
+                batch_stats = {
+                    "fetched": 0, "inserted": 0, "known": 0, "rejected": 0,
+                    "fetch_seconds": 0.0, "save_seconds": 0.0,
+                }
+                fetch_start = time.monotonic()
+                fetched = planner.fetch_batch(priority, items, get_listing_data, browser, pool)
+                batch_stats["fetch_seconds"] += time.monotonic() - fetch_start
+                if stats["ramp_up_seconds"] is None:
+                    # Time from the start of the run to the first detail pages, the latency a warm browser saves
+                    stats["ramp_up_seconds"] = round(time.monotonic() - start_time, 3)
+                records = [record for record in fetched.values() if record]
+                batch_stats["fetched"] = len(records)
+                
+                if priority == NEW:
+                    # New listings of this batch, validated and saved together
+                    batch = {}
+                    for listingData in records:
+                        hemnet_id = listingData["hemnet_id"]
+                        if hemnet_id not in known_ids and hemnet_id not in batch:
+                            batch[hemnet_id] = listingData
+                        else:
+                            batch_stats["known"] += 1
+                    save_listing_batch(list(batch.values()), known_ids, stats, batch_stats)
+                    del batch
+                else:
+                    # Change checks: the detail page's asking price replaces the stored one
+                    stats["asking_prices_updated"] += update_asking_prices(
+                        (record["hemnet_id"], record["asking_price"]) for record in records if record["asking_price"]
+                    )
+                    # Pages that failed to load count as checked too, so they aren't due again every run
+                    checked_ids = (parse_listing_id(url[len(base_url):]) for url in fetched)
+                    stats["listings_checked"] += mark_listings_checked(
+                        hemnet_id for hemnet_id in checked_ids if hemnet_id is not None
+                    )
+                
+                stats["fetch_seconds"] += batch_stats["fetch_seconds"]
+                stats["save_seconds"] += batch_stats["save_seconds"]
+                logger.info(
+                    "Batch of %d %s listings: %d fetched, %d inserted, %d rejected",
+                    len(items), PRIORITY_NAMES[priority], batch_stats["fetched"], batch_stats["inserted"],
+                    batch_stats["rejected"],
+                    extra={"batch": PRIORITY_NAMES[priority], **{key: round(value, 3) for key, value in batch_stats.items()}},
+                )
+                del fetched, records
                 
         except Exception as e:
             logger.error(f"Fatal error in main: {e}")
             raise
         finally:
-            logger.info(f"Script completed. Encountered {len(exceptions)} exceptions")
-            logger.info(f"Fields with null values: {nulls}")
+            if pool is not None:
+                pool.close()
+                stats.update(pool.stats())
+            save_deferred_urls("active", planner.carry_over())
+            stats.update(planner.summary())
+            if stats["budget_exhausted"]:
+                logger.info(
+                    "Budget reached, deferred %d new listings, %d checks, %d refetches and %d result pages",
+                    stats["deferred_new"], stats["deferred_due"], stats["deferred_refetch"], stats["deferred_page"],
+                )
+            stats["fetch_seconds"] = round(stats["fetch_seconds"], 3)
+            stats["save_seconds"] = round(stats["save_seconds"], 3)
+            logger.info("Script completed. Encountered %d exceptions", len(exceptions))
+            logger.info("Fields with null values: %s", nulls)
+    
+    return stats
         
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,170 @@
+"""
+Priority-ordered crawl planning under a time or request budget.
+
+Walking result pages 1..50 and handling each link where it appears means a
+run that is cut short may have spent its budget on known listings near the
+top while new ones further down were never reached. CrawlPlanner keeps a
+run's work in one priority queue instead:
+
+    NEW       detail pages of listings or sales that aren't stored yet
+    PAGE      the next result page to find links on
+    DUE       known listings due for a change check
+    REFETCH   other known listings, only queued when the run has a budget
+
+The scrapers take batches in that order until the queue is empty or the
+budget is spent, so each page's new items are fetched before the next page is
+walked and change checks wait until discovery is done. Whatever is left is
+reported as deferred, and the NEW and DUE URLs are stored in crawl_deferred
+for the job's next run to start with.
+"""
+import heapq
+import itertools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+NEW, PAGE, DUE, REFETCH = 0, 1, 2, 3
+PRIORITY_NAMES = {NEW: "new", PAGE: "page", DUE: "due", REFETCH: "refetch"}
+
+CARRIED_OVER = (NEW, DUE)   # deferred priorities kept for the next run
+BATCH_SIZE = 50             # detail pages per batch, about one result page
+
+
+class CrawlPlanner:
+    """
+    Priority queue of result pages and detail URLs with a time and request budget.
+
+        planner = CrawlPlanner(deadline, max_requests=500)
+        planner.add(PAGE, 1)
+        for priority, items in planner.batches():
+            ...  # fetch the items, planner.charge() per request, planner.add() what they lead to
+        planner.summary()
+    """
+
+    def __init__(self, deadline=None, max_requests=None):
+        """
+        Args:
+            deadline: Optional time.monotonic() value after which no more batches are served
+            max_requests: Optional number of page requests (result and detail pages) the run may make
+        """
+        self.deadline = deadline
+        self.max_requests = max_requests
+        self.requests = {name: 0 for name in PRIORITY_NAMES.values()}
+        self._heap = []
+        self._queued = set()
+        self._order = itertools.count()
+
+    @property
+    def budgeted(self):
+        """Whether the run has a time or request budget"""
+        return self.deadline is not None or self.max_requests is not None
+
+    def requests_left(self):
+        if self.max_requests is None:
+            return None
+        return max(0, self.max_requests - sum(self.requests.values()))
+
+    def exhausted(self):
+        """Whether the time or request budget is spent"""
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return True
+        return self.requests_left() == 0
+
+    def add(self, priority, item):
+        """
+        Queue a result page number or detail URL.
+
+        Returns:
+            False if the item is already queued
+        """
+        if item in self._queued:
+            return False
+        self._queued.add(item)
+        heapq.heappush(self._heap, (priority, next(self._order), item))
+        return True
+
+    def cancel(self, priority):
+        """Drop every queued item of a priority, e.g. the next PAGE once a crawl should stop; returns how many"""
+        kept = [entry for entry in self._heap if entry[0] != priority]
+        dropped = len(self._heap) - len(kept)
+        self._queued = {item for _, _, item in kept}
+        self._heap = kept
+        heapq.heapify(self._heap)
+        return dropped
+
+    def charge(self, priority, requests=1):
+        """Count page requests made for items of a priority"""
+        self.requests[PRIORITY_NAMES[priority]] += requests
+
+    def batches(self, batch_size=BATCH_SIZE):
+        """
+        Yield (priority, items) batches, highest priority first, until the queue
+        is empty or the budget is spent.
+
+        A PAGE batch is a single result page number; detail batches hold up to
+        batch_size URLs of one priority, and no more than the requests left.
+        Items added while a batch is being handled are served in priority order
+        with the rest.
+        """
+        while self._heap and not self.exhausted():
+            priority = self._heap[0][0]
+            limit = 1 if priority == PAGE else batch_size
+            requests_left = self.requests_left()
+            if requests_left is not None:
+                limit = min(limit, requests_left)
+            items = []
+            while self._heap and self._heap[0][0] == priority and len(items) < limit:
+                _, _, item = heapq.heappop(self._heap)
+                self._queued.discard(item)
+                items.append(item)
+            yield priority, items
+
+    def fetch_batch(self, priority, urls, fetch, browser, pool=None):
+        """
+        Fetch a batch of detail pages, one at a time with fetch(url, browser)
+        or through a WorkerPool, charging a request per page.
+
+        URLs not fetched before the budget ran out go back in the queue.
+
+        Returns:
+            dict: {url: record or None} of the URLs that were fetched
+        """
+        if pool is not None:
+            records = pool.fetch(urls, self.deadline)
+            self.charge(priority, len(records))
+        else:
+            records = {}
+            for url in urls:
+                if self.exhausted():
+                    break
+                records[url] = fetch(url, browser)
+                self.charge(priority)
+        for url in urls:
+            if url not in records:
+                self.add(priority, url)
+        return records
+
+    def deferred(self):
+        """Queued items in the order they would have been served, as (priority, item) pairs"""
+        return [(priority, item) for priority, _, item in sorted(self._heap)]
+
+    def carry_over(self):
+        """Deferred detail URLs to store for the next run, as (url, priority) pairs"""
+        return [(item, priority) for priority, item in self.deferred() if priority in CARRIED_OVER]
+
+    def summary(self):
+        """
+        Run counters: requests per priority, the request budget, deferred items
+        per priority, and whether the budget ran out with work left
+        """
+        deferred = {name: 0 for name in PRIORITY_NAMES.values()}
+        for priority, _ in self.deferred():
+            deferred[PRIORITY_NAMES[priority]] += 1
+        return {
+            "requests": sum(self.requests.values()),
+            "request_budget": self.max_requests,
+            **{f"requests_{name}": count for name, count in self.requests.items()},
+            **{f"deferred_{name}": count for name, count in deferred.items()},
+            "budget_exhausted": bool(self._heap) and self.exhausted(),
+        }
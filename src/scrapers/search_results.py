@@ -0,0 +1,138 @@
+"""
+Parsing of search result pages (/bostader and /salda/bostader) for fast mode.
+
+Result pages carry a card per listing or sale in their own __NEXT_DATA__
+Apollo state, fetched with utils.playwright_utils.fetch_page_payload. Cards
+hold formatted strings ("4 195 000 kr", "75 m²", "Såld 12 mars 2024"), which
+are parsed with utils.parsing_utils.
+"""
+import re
+
+from utils.parsing_utils import (
+    parse_area,
+    parse_coordinates,
+    parse_currency,
+    parse_sold_date,
+    parse_sold_timestamp,
+)
+
+# Apollo state key prefixes of the cards, passed to fetch_page_payload
+LISTING_CARD_PREFIXES = ("ListingCard:",)
+SALE_CARD_PREFIXES = ("SaleCard:",)
+
+# property_sales columns that are NOT NULL; a sale card without any of them needs its detail page
+REQUIRED_SALE_FIELDS = ("sale_hemnet_id", "original_hemnet_id", "final_price", "sale_date", "url")
+
+_TRAILING_ID_RE = re.compile(r"-(\d+)/?(?:[?#].*)?$")
+_PERCENT_RE = re.compile("[-\u2212+]?\\d+(?:[.,]\\d+)?")
+
+
+def _amount(value):
+    # Cards give money either formatted ("4 195 000 kr") or as {"amount": 4195000}
+    if value is None:
+        return None
+    if isinstance(value, dict):
+        value = value.get("amount", value.get("formatted"))
+    if isinstance(value, (int, float)):
+        return int(value)
+    return parse_currency(value)
+
+def _area(value):
+    if isinstance(value, dict):
+        value = value.get("value", value.get("formatted"))
+    if isinstance(value, (int, float)):
+        return float(value)
+    return parse_area(value)
+
+def _percentage(value):
+    if isinstance(value, (int, float)) or value is None:
+        return value
+    match = _PERCENT_RE.search(value)
+    return float(match.group().replace("\u2212", "-").replace(",", ".")) if match else None
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def href_id(href):
+    """The id at the end of a result link, or None"""
+    match = _TRAILING_ID_RE.search(href or "")
+    return int(match.group(1)) if match else None
+
+def parse_listing_cards(apollo_state):
+    """
+    Active listing cards by listing id.
+
+    Returns:
+        dict: {hemnet_id: {"hemnet_id", "asking_price", "living_area", "number_of_rooms", "street_address"}}
+    """
+    cards = {}
+    for key, card in apollo_state.items():
+        if not key.startswith(LISTING_CARD_PREFIXES):
+            continue
+        hemnet_id = _int(card.get("id"))
+        if hemnet_id is None:
+            continue
+        cards[hemnet_id] = {
+            "hemnet_id": hemnet_id,
+            "asking_price": _amount(card.get("askingPrice")),
+            "living_area": _area(card.get("livingArea", card.get("livingAndSupplementalAreas"))),
+            "number_of_rooms": _area(card.get("rooms", card.get("numberOfRooms"))),
+            "street_address": card.get("streetAddress"),
+        }
+    return cards
+
+def parse_sale_cards(apollo_state, hrefs, base_url):
+    """
+    Sale cards as store_sold_listing records, by sale id.
+
+    A card's URL comes from its slug or, failing that, the result link ending
+    in its id; cards without one are left without "url" and so need their
+    detail page.
+
+    Returns:
+        dict: {sale_hemnet_id: record}
+    """
+    href_by_id = {href_id(href): href for href in hrefs}
+    cards = {}
+    for key, card in apollo_state.items():
+        if not key.startswith(SALE_CARD_PREFIXES):
+            continue
+        sale_id = _int(card.get("id"))
+        if sale_id is None:
+            continue
+
+        href = f"/salda/{card['slug']}" if card.get("slug") else href_by_id.get(sale_id)
+        # formattedSoldAt is what the detail page stores too; the raw soldAt is only a fallback
+        sale_date_str = card.get("formattedSoldAt") or ""
+        sale_date = parse_sold_date(sale_date_str) or parse_sold_timestamp(card.get("soldAt"))
+        latitude, longitude = parse_coordinates(card.get("coordinates"))
+        agency = card.get("brokerAgencyName") or card.get("brokerAgency")
+        record = {
+            "sale_hemnet_id": sale_id,
+            "original_hemnet_id": _int(card.get("listingId")),
+            "final_price": _amount(card.get("finalPrice", card.get("sellingPrice"))),
+            "asking_price": _amount(card.get("askingPrice")),
+            "price_change": _amount(card.get("priceChange")),
+            "price_change_percentage": _percentage(card.get("priceChangePercentage", card.get("formattedPriceChange"))),
+            "sale_date_str": sale_date_str,
+            "sale_date": sale_date,
+            "living_area": _area(card.get("livingArea")),
+            "land_area": _area(card.get("landArea")),
+            "rooms": _area(card.get("rooms", card.get("numberOfRooms"))),
+            "street_address": card.get("streetAddress", ""),
+            "area": card.get("locationDescription", card.get("area", "")),
+            "broker_agency": agency.get("name", "") if isinstance(agency, dict) else (agency or ""),
+            "latitude": latitude,
+            "longitude": longitude,
+        }
+        if href:
+            record["url"] = base_url + href
+        cards[sale_id] = record
+    return cards
+
+def missing_sale_fields(record):
+    """Names of REQUIRED_SALE_FIELDS a card record lacks"""
+    return [field for field in REQUIRED_SALE_FIELDS if record.get(field) in (None, "")]
@@ -0,0 +1,351 @@
+"""
+Historical backfill of sold listings by search slices.
+
+The sold search only pages through its first 50 result pages, so the regular
+crawl can't reach sales older than the newest few thousand. The backfill splits
+the search into slices, one per region (a county's Hemnet location id), item
+type and selling price band, each small enough to page through completely.
+Hemnet's sold search only filters dates by a relative sold_age window, which
+can't partition the history, so the price band is what gets narrowed: a slice
+that still has results on the last page is split into two price halves.
+
+Slices are checkpoints in the backfill_slices table. Workers claim pending
+slices with FOR UPDATE SKIP LOCKED, record the last stored page after every
+page and mark the slice completed at the end, so a backfill that is stopped
+resumes where it left off, also across containers. Each worker thread runs its
+own browser.
+"""
+import logging
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from utils.database_utils import get_db_connection
+from utils.known_ids import load_known_sale_urls, url_key
+from utils.playwright_utils import browser_context, fetch_page_payload, page_context
+from scrapers.sold_listings_scraper import get_sold_listing_data, store_sale_batch
+
+logger = logging.getLogger(__name__)
+
+SOLD_SEARCH_URL = "https://www.hemnet.se/salda/bostader"
+MAX_PAGES = 50
+
+ITEM_TYPES = ("villa", "radhus", "bostadsratt", "fritidshus", "tomt", "gard", "other")
+
+# Initial selling price bands in SEK, each from its bound up to just below the next; None is open-ended.
+# Slice bounds are inclusive on both ends, so adjacent slices don't both list a sale at a round price.
+PRICE_BANDS = (0, 1000000, 2000000, 3000000, 4000000, 6000000, 10000000, None)
+MIN_PRICE_BAND = 100000         # narrower bands are not split further
+PRICE_STEP = 50000              # split points are rounded to this
+
+DEFAULT_WORKERS = 4
+DEFAULT_REGION_TYPE = "county"
+STALE_CLAIM_MINUTES = 15        # in-progress slices without a checkpoint for this long are reclaimed
+MAX_ATTEMPTS = 3
+
+_SLICE_COLUMNS = (
+    "slice_key", "location_hemnet_id", "item_type", "price_min", "price_max", "sold_age", "last_page", "attempts",
+)
+
+# Slices already checkpointed keep their progress
+_INSERT_SLICE_SQL = """
+    INSERT INTO backfill_slices
+        (slice_key, location_hemnet_id, item_type, price_min, price_max, sold_age, parent_key)
+    VALUES (%(slice_key)s, %(location_hemnet_id)s, %(item_type)s, %(price_min)s,
+            %(price_max)s, %(sold_age)s, %(parent_key)s)
+    ON CONFLICT (slice_key) DO NOTHING
+"""
+
+
+def slice_query(location_hemnet_id, item_type, price_min, price_max, sold_age=None):
+    """Search parameters of a slice, in a fixed order so they double as its key"""
+    params = [
+        ("location_ids[]", location_hemnet_id),
+        ("item_types[]", item_type),
+        ("selling_price_min", price_min),
+    ]
+    if price_max is not None:
+        params.append(("selling_price_max", price_max))
+    if sold_age:
+        params.append(("sold_age", sold_age))
+    return urlencode(params, safe="[]")
+
+def make_slice(location_hemnet_id, item_type, price_min, price_max, sold_age=None, parent_key=None):
+    return {
+        "slice_key": slice_query(location_hemnet_id, item_type, price_min, price_max, sold_age),
+        "location_hemnet_id": location_hemnet_id,
+        "item_type": item_type,
+        "price_min": price_min,
+        "price_max": price_max,
+        "sold_age": sold_age,
+        "parent_key": parent_key,
+    }
+
+def plan_slices(location_ids, item_types=ITEM_TYPES, sold_age=None):
+    """Initial slices: every region x item type x price band"""
+    return [
+        make_slice(location_id, item_type, low, high - 1 if high is not None else None, sold_age)
+        for location_id in location_ids
+        for item_type in item_types
+        for low, high in zip(PRICE_BANDS[:-1], PRICE_BANDS[1:])
+    ]
+
+def split_price_band(price_min, price_max):
+    """
+    Two halves of a price band, or None if it is too narrow to split.
+
+    Bounds are inclusive, so the lower half ends just below where the upper
+    half starts. An open-ended band is split at twice its lower bound.
+    """
+    if price_max is None:
+        middle = max(price_min * 2, price_min + MIN_PRICE_BAND)
+    else:
+        if price_max + 1 - price_min < 2 * MIN_PRICE_BAND:
+            return None
+        middle = price_min + (price_max + 1 - price_min) // 2
+    middle = middle // PRICE_STEP * PRICE_STEP
+    return (price_min, middle - 1), (middle, price_max)
+
+def load_region_ids(region_type=DEFAULT_REGION_TYPE):
+    """Hemnet ids of the stored locations of a type, e.g. every county"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT location_hemnet_id FROM locations WHERE type = %s ORDER BY location_hemnet_id",
+            (region_type,)
+        )
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+        conn.close()
+
+def seed_slices(slices):
+    """Add slices that aren't checkpointed yet; existing slices keep their progress"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        added = 0
+        for slice_ in slices:
+            cursor.execute(_INSERT_SLICE_SQL, slice_)
+            added += cursor.rowcount
+        conn.commit()
+        return added
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+def claim_slice(conn, worker):
+    """
+    Claim the next pending slice, or a stale in-progress one.
+
+    Returns:
+        The slice as a dictionary, or None when there is nothing left to claim
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            UPDATE backfill_slices
+            SET status = 'in_progress', claimed_by = %s, claimed_at = now(), attempts = attempts + 1
+            WHERE slice_key = (
+                SELECT slice_key FROM backfill_slices
+                WHERE status = 'pending'
+                   OR (status = 'in_progress' AND claimed_at < now() - interval '{STALE_CLAIM_MINUTES} minutes')
+                ORDER BY status, slice_key
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING {", ".join(_SLICE_COLUMNS)}
+        """, (worker,))
+        row = cursor.fetchone()
+        conn.commit()
+        return dict(zip(_SLICE_COLUMNS, row)) if row else None
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def checkpoint_slice(conn, slice_key, last_page, sales_found, sales_inserted):
+    """Record a stored page; also refreshes the claim"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            UPDATE backfill_slices
+            SET last_page = %s, sales_found = sales_found + %s, sales_inserted = sales_inserted + %s,
+                claimed_at = now()
+            WHERE slice_key = %s
+        """, (last_page, sales_found, sales_inserted, slice_key))
+        conn.commit()
+    finally:
+        cursor.close()
+
+def finish_slice(conn, slice_, status, truncated=False, error=None, children=()):
+    """
+    Mark a slice completed, split (adding its children), pending again or failed.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            UPDATE backfill_slices
+            SET status = %s, truncated = %s, error = %s, claimed_by = NULL,
+                completed_at = CASE WHEN %s IN ('completed', 'split') THEN now() END
+            WHERE slice_key = %s
+        """, (status, truncated, error, status, slice_["slice_key"]))
+        for child in children:
+            cursor.execute(_INSERT_SLICE_SQL, child)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def get_slice_page(slice_, page_number, browser):
+    """Result links of one page of a slice's search"""
+    url = f"{SOLD_SEARCH_URL}?{slice_['slice_key']}&page={page_number}"
+    with page_context(browser) as page:
+        payload = fetch_page_payload(page, url, link_prefix='/salda')
+    return payload["links"] if payload else []
+
+def backfill_slice(slice_, browser, known_urls, conn, deadline=None):
+    """
+    Page through one slice from its checkpoint, storing the sales not stored yet.
+
+    Returns:
+        tuple: (status, stats) where status is "completed", "truncated" (results
+        continued on the last page) or "stopped" (deadline reached)
+    """
+    stats = {"sales_processed": 0, "sales_inserted": 0, "records_rejected": 0, "rejected_fields": {}}
+    for page_number in range(slice_["last_page"] + 1, MAX_PAGES + 1):
+        if deadline is not None and time.monotonic() >= deadline:
+            return "stopped", stats
+
+        hrefs = get_slice_page(slice_, page_number, browser)
+        if not hrefs:
+            return "completed", stats
+
+        page_stats = {"sales": 0, "inserted": 0, "known": 0, "rejected": 0, "fetch_seconds": 0.0, "save_seconds": 0.0}
+        batch = []
+        for href in dict.fromkeys(hrefs):
+            full_url = "https://www.hemnet.se" + href
+            page_stats["sales"] += 1
+            if url_key(full_url) in known_urls:
+                page_stats["known"] += 1
+                continue
+            fetch_start = time.monotonic()
+            data = get_sold_listing_data(full_url, browser)
+            page_stats["fetch_seconds"] += time.monotonic() - fetch_start
+            if data:
+                batch.append(data)
+
+        inserted_before = stats["sales_inserted"]
+        store_sale_batch(batch, known_urls, stats, page_stats)
+        stats["sales_processed"] += page_stats["sales"]
+        checkpoint_slice(conn, slice_["slice_key"], page_number, page_stats["sales"], stats["sales_inserted"] - inserted_before)
+
+    # Still results on the last reachable page: the slice is too wide
+    return "truncated", stats
+
+def _merge_stats(total, stats):
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            merged = total.setdefault(key, {})
+            for field, count in value.items():
+                merged[field] = merged.get(field, 0) + count
+        else:
+            total[key] = total.get(key, 0) + value
+
+def run_worker(worker, known_urls, totals, lock, deadline=None):
+    """Claim and backfill slices until none are left or the deadline passes"""
+    conn = get_db_connection()
+    stats = {"slices_completed": 0, "slices_split": 0, "slices_failed": 0}
+    try:
+        with browser_context() as (_, browser):
+            while deadline is None or time.monotonic() < deadline:
+                slice_ = claim_slice(conn, worker)
+                if slice_ is None:
+                    break
+                logger.info(
+                    "%s: backfilling %s from page %d", worker, slice_["slice_key"], slice_["last_page"] + 1,
+                    extra={"worker": worker, "slice": slice_["slice_key"]},
+                )
+                try:
+                    status, slice_stats = backfill_slice(slice_, browser, known_urls, conn, deadline)
+                except Exception as e:
+                    logger.error(f"{worker}: error backfilling {slice_['slice_key']}: {e}")
+                    conn.rollback()
+                    failed = slice_["attempts"] >= MAX_ATTEMPTS
+                    finish_slice(conn, slice_, "failed" if failed else "pending", error=str(e))
+                    stats["slices_failed"] += failed
+                    continue
+                _merge_stats(stats, slice_stats)
+
+                if status == "stopped":
+                    finish_slice(conn, slice_, "pending")
+                elif status == "completed":
+                    finish_slice(conn, slice_, "completed")
+                    stats["slices_completed"] += 1
+                else:
+                    halves = split_price_band(slice_["price_min"], slice_["price_max"])
+                    if halves is None:
+                        logger.warning(f"{worker}: {slice_['slice_key']} exceeds {MAX_PAGES} pages and can't be split")
+                        finish_slice(conn, slice_, "completed", truncated=True)
+                        stats["slices_completed"] += 1
+                    else:
+                        children = [
+                            make_slice(slice_["location_hemnet_id"], slice_["item_type"], low, high,
+                                       slice_["sold_age"], parent_key=slice_["slice_key"])
+                            for low, high in halves
+                        ]
+                        finish_slice(conn, slice_, "split", truncated=True, children=children)
+                        stats["slices_split"] += 1
+    finally:
+        conn.close()
+        with lock:
+            _merge_stats(totals, stats)
+    logger.info(f"{worker} finished: {stats}", extra={"worker": worker})
+
+def run_backfill(location_ids=None, item_types=ITEM_TYPES, sold_age=None, workers=DEFAULT_WORKERS,
+                 region_type=DEFAULT_REGION_TYPE, deadline=None):
+    """
+    Seed the slices and backfill them with parallel workers.
+
+    Args:
+        location_ids: Hemnet location ids of the regions (default: every stored
+            location of region_type)
+        item_types: Hemnet item types to slice by
+        sold_age: Optional sold_age search filter applied to every slice
+        workers: Number of worker threads, each with its own browser
+        region_type: Location type used when location_ids isn't given
+        deadline: Optional time.monotonic() value after which workers stop at
+            the next page and leave their slice pending
+
+    Returns:
+        Dictionary of run counters summed over the workers
+    """
+    location_ids = location_ids or load_region_ids(region_type)
+    if not location_ids:
+        logger.warning(f"No regions to backfill: no stored locations of type '{region_type}'")
+        return {"slices_seeded": 0}
+
+    seeded = seed_slices(plan_slices(location_ids, item_types, sold_age))
+    logger.info(f"Backfill of {len(location_ids)} regions, {seeded} new slices, {workers} workers")
+
+    known_urls = load_known_sale_urls()
+    totals = {"slices_seeded": seeded}
+    lock = threading.Lock()
+    host = socket.gethostname()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(run_worker, f"{host}-{i}", known_urls, totals, lock, deadline)
+            for i in range(workers)
+        ]
+        for future in futures:
+            future.result()
+    return totals
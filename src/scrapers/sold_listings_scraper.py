@@ -1,115 +1,86 @@
 import gc
-from bs4 import BeautifulSoup, SoupStrainer
-import json
-from datetime import datetime
-import locale
+import time
 from utils.logging_setup import setup_logging
-from utils.playwright_utils import browser_context, page_context
-from utils.database_utils import store_sold_listing
+from utils.profiling import stage
+from utils.playwright_utils import browser_context, fetch_page_payload, page_context
+from utils.database_utils import load_deferred_urls, save_deferred_urls, store_sold_listing
+from utils.known_ids import load_known_sale_urls, url_key
+from utils.parsing_utils import parse_coordinates, parse_sold_date
+from utils.validation import quarantine_rejects, validate_batch
+from scrapers.search_results import SALE_CARD_PREFIXES, missing_sale_fields, parse_sale_cards
+from scrapers.crawl_planner import NEW, PAGE, PRIORITY_NAMES, CrawlPlanner
+from scrapers.worker_pool import WorkerPool
 
 logger = setup_logging()
 
-def parse_swedish_date(date_str):
-    if not date_str:
-        return None
-    
-    try:
-        # Try to set Swedish locale for month name parsing
-        try:
-            # First try Swedish locale
-            locale.setlocale(locale.LC_TIME, 'sv_SE.UTF-8')
-        except locale.Error:
-            try:
-                # Fallback to Swedish locale with different format
-                locale.setlocale(locale.LC_TIME, 'sv_SE')
-            except locale.Error:
-                # If neither works, we'll handle month mapping manually
-                pass
-                
-        # Remove "Såld " prefix if present
-        if date_str.startswith("Såld "):
-            date_str = date_str[5:]
-            
-        # Try to parse with locale
-        try:
-            # Try to parse with day month year format
-            return datetime.strptime(date_str, "%d %B %Y")
-        except ValueError:
-            # If locale parsing fails, manually map Swedish month names
-            months = {
-                'januari': 1, 'jan': 1,
-                'februari': 2, 'feb': 2,
-                'mars': 3, 'mar': 3,
-                'april': 4, 'apr': 4,
-                'maj': 5,
-                'juni': 6, 'jun': 6,
-                'juli': 7, 'jul': 7,
-                'augusti': 8, 'aug': 8,
-                'september': 9, 'sep': 9,
-                'oktober': 10, 'okt': 10,
-                'november': 11, 'nov': 11,
-                'december': 12, 'dec': 12
-            }
-            
-            # Split the date string
-            parts = date_str.split()
-            if len(parts) == 3:
-                day = int(parts[0])
-                month_name = parts[1].lower()
-                year = int(parts[2])
-                
-                if month_name in months:
-                    return datetime(year, months[month_name], day)
-    except Exception as e:
-        logger.error(f"Error parsing date '{date_str}': {e}")
-    
-    return None
-
 BASE_URL_SOLD = "https://www.hemnet.se/salda/bostader?page="
+MAX_PAGES = 50
+
+# Apollo state entries a sold listing page is parsed from
+SALE_STATE_PREFIXES = ("SoldPropertyListing:", "BrokerAgency:")
 
+@stage("get_listing_urls")
 def get_sold_listing_urls(page_number, browser):
-    url = f"https://www.hemnet.se/salda/bostader?page={page_number}"
-    logger.info(f"Fetching sold listings from page {page_number}: {url}")
+    url = f"{BASE_URL_SOLD}{page_number}"
+    logger.info("Fetching sold listings from page %d: %s", page_number, url)
     
     with page_context(browser) as page:
         try:
-            page.goto(url, wait_until="domcontentloaded")            
-            parse_only = SoupStrainer('div', attrs={'data-testid': 'result-list'})
-            soup = BeautifulSoup(page.content(), 'html.parser', parse_only=parse_only)
-            
-            if not soup:
-                logger.warning(f"Result list not found on page {page_number}")
-                return
-            
-            for link in soup.find_all('a'):
-                href = link.get('href')
-                if href and href.startswith('/salda'):
-                    yield href
-                    
+            payload = fetch_page_payload(page, url, link_prefix='/salda')
         except Exception as e:
             logger.error(f"Error fetching sold listing URLs from page {page_number}: {e}")
+            return []
+    
+    if not payload or not payload["links"]:
+        logger.warning(f"Result list not found on page {page_number}")
+        return []
+    return payload["links"]
 
-def extract_listing_data_from_json(html_content):
-    """Extract listing data with minimal memory usage"""
-    # Only parse the script tag we need
-    parse_only = SoupStrainer('script', id='__NEXT_DATA__')
-    soup = BeautifulSoup(html_content, 'html.parser', parse_only=parse_only)
-    
-    next_data_script = soup.find()
-    if not next_data_script or not next_data_script.string:
-        logger.warning("No __NEXT_DATA__ script found in the page")
-        return None, None, {}
+@stage("get_listing_urls")
+def get_sold_search_page(page_number, browser):
+    """
+    Fetch one sold result page for fast mode.
+    
+    Returns:
+        tuple: (sale hrefs in page order, {url: card record} for the page's sale cards)
+    """
+    url = f"{BASE_URL_SOLD}{page_number}"
+    logger.info("Fetching sale cards from page %d: %s", page_number, url)
     
+    with page_context(browser) as page:
+        try:
+            payload = fetch_page_payload(page, url, SALE_CARD_PREFIXES, link_prefix='/salda')
+        except Exception as e:
+            logger.error(f"Error fetching sale cards from page {page_number}: {e}")
+            return [], {}
+    
+    if not payload or not payload["links"]:
+        logger.warning(f"Result list not found on page {page_number}")
+        return [], {}
+    hrefs = payload["links"]
+    cards = parse_sale_cards(payload["apolloState"], hrefs, "https://www.hemnet.se")
+    return hrefs, {card["url"]: card for card in cards.values() if "url" in card}
+
+@stage("extract_data")
+def extract_listing_data(page_props, apollo_state):
+    """
+    Extract a sale from a sold listing page's data.
+    
+    Args:
+        page_props: The page's __NEXT_DATA__ page props
+        apollo_state: Its Apollo state, at least the SALE_STATE_PREFIXES entries
+    
+    Returns:
+        tuple: (sale_id, original listing id, extracted data), with an empty
+        dictionary as data if the sale is not in the state
+    """
     try:
-        data = json.loads(next_data_script.string)
-        page_props = data.get("props", {}).get("pageProps", {})
         sale_id = page_props.get("saleId")
         
         if not sale_id:
             logger.warning("No sale ID found in the page data")
             return None, None, {}
         
-        apollo_state = page_props.get("__APOLLO_STATE__", {})
         listing_key = f"SoldPropertyListing:{sale_id}"
         
         if listing_key not in apollo_state:
@@ -119,14 +90,15 @@ def extract_listing_data_from_json(html_content):
         listing_data = apollo_state[listing_key]
         original_listing_id = listing_data.get("listingId")
         sale_date_str = listing_data.get("formattedSoldAt", "")
-        sale_date_datetime = parse_swedish_date(sale_date_str)
+        sale_date = parse_sold_date(sale_date_str)
+        latitude, longitude = parse_coordinates(listing_data.get("coordinates"))
         
         # Extract only needed data
         extracted_data = {
             "title": f"{listing_data.get('housingForm', {}).get('name', '')} {listing_data.get('formattedLivingArea', '')} - {listing_data.get('locationName', '')}",
             "final_price": listing_data.get("sellingPrice", {}).get("amount") if listing_data.get("sellingPrice") else None,
             "sale_date_str": sale_date_str,
-            "sale_date": parse_swedish_date(listing_data.get("formattedSoldAt")),
+            "sale_date": sale_date,
             "asking_price": listing_data.get("askingPrice", {}).get("amount") if listing_data.get("askingPrice") else None,
             "price_change": listing_data.get("priceChange", {}).get("amount") if listing_data.get("priceChange") else None,
             "price_change_percentage": listing_data.get("priceChangePercentage") if "priceChangePercentage" in listing_data else None,
@@ -136,30 +108,30 @@ def extract_listing_data_from_json(html_content):
             "area": listing_data.get("area", ""),
             "municipality": listing_data.get("municipality", {}).get("__ref", "").split(":")[-1] if listing_data.get("municipality") else "",
             "running_costs": listing_data.get("runningCosts", {}).get("amount") if listing_data.get("runningCosts") else None,
+            "latitude": latitude,
+            "longitude": longitude,
             "rooms": listing_data.get("numberOfRooms"),
-            "construction_year": listing_data.get("legacyConstructionYear", ""),
+            # Unknown years come as "", which an INTEGER column rejects
+            "construction_year": listing_data.get("legacyConstructionYear") or None,
             "broker_agency": apollo_state.get(listing_data.get("brokerAgency", {}).get("__ref", ""), {}).get("name", "") if listing_data.get("brokerAgency") else ""            # ...other needed fields...
         }
         
-        # Clean up large objects
-        del data
-        del page_props
-        del apollo_state
-        
         return sale_id, listing_data.get("listingId"), extracted_data
         
     except Exception as e:
         logger.error(f"Error extracting data from JSON: {e}")
         return None, None, {}
 
+@stage("get_listing_data")
 def get_sold_listing_data(url, browser):
-    logger.info(f"Fetching data for sold listing: {url}")
+    logger.debug("Fetching data for sold listing: %s", url)
     
     with page_context(browser) as page:
         try:
-            page.goto(url, wait_until="domcontentloaded")            
-            html_content = page.content()
-            sale_id, original_listing_id, json_data = extract_listing_data_from_json(html_content)
+            payload = fetch_page_payload(page, url, SALE_STATE_PREFIXES)
+            if not payload:
+                return {}
+            sale_id, original_listing_id, json_data = extract_listing_data(payload["pageProps"], payload["apolloState"])
             
             if json_data:
                 json_data["sale_hemnet_id"] = sale_id
@@ -172,39 +144,214 @@ def get_sold_listing_data(url, browser):
             logger.error(f"Error processing sold listing {url}: {e}")
             return {}
 
-def main():
-    with browser_context() as (playwright, browser):
+def store_sale_batch(batch, known_urls, stats, page_stats):
+    """
+    Validate one page of new sales and store the valid ones.
+    
+    Sales that would violate a schema constraint are quarantined in
+    ingest_rejects instead of being sent to the database.
+    
+    Returns:
+        Number of sales the database already had
+    """
+    valid, rejects = validate_batch(batch, "sale")
+    quarantine_rejects("sale", rejects, stats)
+    page_stats["rejected"] += len(rejects)
+    
+    already_existing = 0
+    for data in valid:
+        save_start = time.monotonic()
+        success, already_exists = store_sold_listing(data)
+        save_seconds = time.monotonic() - save_start
+        page_stats["save_seconds"] += save_seconds
+        
+        if already_exists:
+            page_stats["known"] += 1
+            already_existing += 1
+        elif success:
+            known_urls.add(url_key(data["url"]))
+            logger.info(
+                "Saved sale %s", data["sale_hemnet_id"],
+                extra={"sample": True, "sale_id": data["sale_hemnet_id"], "save_seconds": round(save_seconds, 3)},
+            )
+            stats["sales_inserted"] += 1
+            page_stats["inserted"] += 1
+    return already_existing
+
+def main(deadline=None, browser=None, fast=False, workers=None, max_requests=None):
+    """
+    Scrape sold listings, serving the run's work from a crawl planner.
+    
+    Result pages are walked until 50 consecutive known sales are found, and
+    each page's new sales are fetched and stored before the next page is
+    walked. New sales the budget didn't reach are stored for the next run,
+    which serves them first.
+    
+    In fast mode sales are stored from their search result card when the card
+    has every required field; the detail page is only fetched otherwise.
+    
+    Args:
+        deadline: Optional time.monotonic() value after which the crawl stops
+            before the next batch or detail page
+        browser: Already running browser to reuse (daemon mode); one is
+            launched and closed for this run otherwise
+        fast: Store sales from result cards where possible (see above)
+        workers: Fetch detail pages in this many browser processes
+            (scrapers.worker_pool) instead of one at a time here
+        max_requests: Optional number of result and detail pages the run may fetch
+    
+    Returns:
+        Dictionary of run counters used to decide which analytics views to refresh
+    """
+    stats = {
+        "sales_processed": 0,
+        "sales_skipped_known": 0,
+        "duplicate_hrefs": 0,
+        "sales_inserted": 0,
+        "sales_from_cards": 0,
+        "records_rejected": 0,
+        "rejected_fields": {},
+        "budget_exhausted": False,
+        "ramp_up_seconds": None,
+        "fetch_seconds": 0.0,
+        "save_seconds": 0.0,
+    }
+    
+    start_time = time.monotonic()
+    base_url = "https://www.hemnet.se"
+    # Stored sales are recognised by their URL, which is known before the page is fetched
+    known_urls = load_known_sale_urls()
+    seen_urls = set()
+    
+    planner = CrawlPlanner(deadline, max_requests)
+    for url, priority in load_deferred_urls("sold"):
+        if url_key(url) in known_urls:
+            continue
+        seen_urls.add(url[len(base_url):])
+        planner.add(priority, url)
+    stats["deferred_from_last_run"] = len(planner.deferred())
+    planner.add(PAGE, 1)
+    
+    pool = WorkerPool("sale", workers) if workers else None
+    with browser_context(browser) as (playwright, browser):
+        if playwright is not None:
+            stats["browser_startup_seconds"] = round(time.monotonic() - start_time, 3)
+        if pool is not None:
+            pool.start()
         try:
             consecutive_existing_count = 0
             
-            for page in range(1, 51):                
-                for url in get_sold_listing_urls(page, browser):
-                    try:
-                        data = get_sold_listing_data("https://www.hemnet.se" + url, browser)
-                        if data:
-                            success, already_exists = store_sold_listing(data)
-                            
-                            if already_exists:
-                                consecutive_existing_count += 1
-                                if consecutive_existing_count >= 50:
-                                    logger.info("Found 50 consecutive existing sales, stopping execution")
-                                    return
-                            else:
-                                consecutive_existing_count = 0
-                            
-                            # Clean up data after processing
-                            del data
-                            
-                    except Exception as e:
-                        logger.error(f"Error processing individual sold listing {url}: {e}")
+            for priority, items in planner.batches():
+                if priority == PAGE:
+                    page_number = items[0]
+                    page_stats = {
+                        "sales": 0, "new": 0, "inserted": 0, "known": 0, "rejected": 0,
+                        "fetch_seconds": 0.0, "save_seconds": 0.0,
+                    }
+                    fetch_start = time.monotonic()
+                    if fast:
+                        hrefs, cards = get_sold_search_page(page_number, browser)
+                    else:
+                        hrefs, cards = get_sold_listing_urls(page_number, browser), {}
+                    page_stats["fetch_seconds"] += time.monotonic() - fetch_start
+                    planner.charge(PAGE)
+                    # Sales complete on their result card, stored without a detail page
+                    card_batch = []
+                    
+                    for url in hrefs:
+                        if url in seen_urls:
+                            stats["duplicate_hrefs"] += 1
+                            continue
+                        seen_urls.add(url)
+                        stats["sales_processed"] += 1
+                        page_stats["sales"] += 1
+                        
+                        full_url = base_url + url
+                        if url_key(full_url) in known_urls:
+                            stats["sales_skipped_known"] += 1
+                            page_stats["known"] += 1
+                            consecutive_existing_count += 1
+                            continue
                         consecutive_existing_count = 0
-                        continue
+                        
+                        card = cards.get(full_url)
+                        if card and not missing_sale_fields(card):
+                            stats["sales_from_cards"] += 1
+                            card_batch.append(card)
+                        else:
+                            planner.add(NEW, full_url)
+                            page_stats["new"] += 1
+                    
+                    # Sales the database already had by id count towards the consecutive stop
+                    consecutive_existing_count += store_sale_batch(card_batch, known_urls, stats, page_stats)
+                    del card_batch
+                    
+                    if page_number < MAX_PAGES and (hrefs or not fast):
+                        if consecutive_existing_count >= 50:
+                            logger.info("Found 50 consecutive existing sales, not walking past page %d", page_number)
+                        else:
+                            planner.add(PAGE, page_number + 1)
+                    
+                    # One aggregated line per result page instead of one per sale
+                    stats["fetch_seconds"] += page_stats["fetch_seconds"]
+                    stats["save_seconds"] += page_stats["save_seconds"]
+                    logger.info(
+                        "Page %d: %d sales, %d new, %d inserted from cards, %d already known, %d rejected",
+                        page_number, page_stats["sales"], page_stats["new"], page_stats["inserted"],
+                        page_stats["known"], page_stats["rejected"],
+                        extra={"page": page_number, **{key: round(value, 3) for key, value in page_stats.items()}},
+                    )
+                    # Force garbage collection after each page
+                    gc.collect()
+                    continue
+                
+                batch_stats = {
+                    "fetched": 0, "inserted": 0, "known": 0, "rejected": 0,
+                    "fetch_seconds": 0.0, "save_seconds": 0.0,
+                }
+                fetch_start = time.monotonic()
+                fetched = planner.fetch_batch(priority, items, get_sold_listing_data, browser, pool)
+                batch_stats["fetch_seconds"] += time.monotonic() - fetch_start
+                if stats["ramp_up_seconds"] is None:
+                    stats["ramp_up_seconds"] = round(time.monotonic() - start_time, 3)
+                batch = [data for data in fetched.values() if data]
+                batch_stats["fetched"] = len(batch)
                 
-                # Force garbage collection after each page
-                gc.collect()
+                already_existing = store_sale_batch(batch, known_urls, stats, batch_stats)
+                if batch and already_existing == len(batch):
+                    consecutive_existing_count += already_existing
+                elif batch:
+                    consecutive_existing_count = 0
+                if consecutive_existing_count >= 50 and planner.cancel(PAGE):
+                    logger.info("Found 50 consecutive existing sales, not walking further result pages")
+                del batch, fetched
+                
+                stats["fetch_seconds"] += batch_stats["fetch_seconds"]
+                stats["save_seconds"] += batch_stats["save_seconds"]
+                logger.info(
+                    "Batch of %d %s sales: %d fetched, %d inserted, %d already known, %d rejected",
+                    len(items), PRIORITY_NAMES[priority], batch_stats["fetched"], batch_stats["inserted"],
+                    batch_stats["known"], batch_stats["rejected"],
+                    extra={"batch": PRIORITY_NAMES[priority], **{key: round(value, 3) for key, value in batch_stats.items()}},
+                )
                 
         except Exception as e:
             logger.error(f"Error in main page processing loop: {e}")
+        finally:
+            if pool is not None:
+                pool.close()
+                stats.update(pool.stats())
+            save_deferred_urls("sold", planner.carry_over())
+            stats.update(planner.summary())
+            if stats["budget_exhausted"]:
+                logger.info(
+                    "Budget reached, deferred %d new sales and %d result pages",
+                    stats["deferred_new"], stats["deferred_page"],
+                )
+            stats["fetch_seconds"] = round(stats["fetch_seconds"], 3)
+            stats["save_seconds"] = round(stats["save_seconds"], 3)
+    
+    return stats
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,269 @@
+"""
+Detail page fetching in parallel browser processes.
+
+The Playwright sync API drives one browser from one thread, so a crawl that
+renders and extracts pages in a single process uses about one core.
+WorkerPool starts N processes (default: one per CPU), each with its own
+browser_context, that fetch detail pages and send back the extracted records.
+The crawl's own process stays the single writer: it walks the search pages,
+hands detail URLs to the pool and validates and saves the records it gets back.
+
+The parent dispatches URLs to the workers itself, a few at a time per worker,
+so it always knows which URLs a worker holds. A worker that dies (browser or
+driver crash, OOM kill) is restarted and its URLs are handed out again, up to
+MAX_ATTEMPTS per URL. A worker whose fetches keep failing exits so that it is
+restarted with a fresh browser.
+
+Workers don't write the log file themselves: their records go to the parent
+over a queue and are logged there (utils.logging_setup.setup_worker_logging).
+"""
+import importlib
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import time
+from collections import deque
+
+from utils.logging_setup import setup_worker_logging, start_worker_log_listener
+from utils.playwright_utils import browser_context
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROCESS_WORKERS = os.cpu_count() or 1
+
+# Fetch functions by record kind, as "module:function" so spawned workers can import them.
+# Each is called as fetch(url, browser) and returns the record, or a falsy value on failure.
+FETCHERS = {
+    "listing": "scrapers.active_listings_scraper:get_listing_data",
+    "sale": "scrapers.sold_listings_scraper:get_sold_listing_data",
+}
+
+PREFETCH = 2                    # URLs handed to a worker ahead of its current one
+MAX_ATTEMPTS = 2                # dispatches per URL before it is given up on
+MAX_CONSECUTIVE_FAILURES = 5    # failed fetches in a row after which a worker restarts its browser
+MAX_RESTARTS = 20               # per pool; past this dead workers aren't replaced
+POLL_SECONDS = 1.0
+RESTART_EXIT_CODE = 3
+
+
+def _load_fetcher(kind):
+    module_name, function_name = FETCHERS[kind].split(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+def _worker_main(worker_id, kind, tasks, results, log_queue):
+    """
+    Fetch URLs from tasks until a None arrives, posting one result message per URL.
+
+    Exits with code RESTART_EXIT_CODE when the browser is lost or keeps failing;
+    the parent sees the worker is gone and starts a new one.
+    """
+    setup_worker_logging(log_queue)
+    fetch = _load_fetcher(kind)
+    start_time = time.monotonic()
+    restart = False
+    with browser_context() as (_, browser):
+        results.put(("ready", worker_id, os.getpid(), time.monotonic() - start_time))
+        failures = 0
+        while True:
+            url = tasks.get()
+            if url is None:
+                break
+            fetch_start = time.monotonic()
+            try:
+                record = fetch(url, browser) or None
+            except Exception as e:
+                logger.error(f"Worker {worker_id}: error fetching {url}: {e}")
+                record = None
+            results.put(("done", worker_id, url, record, time.monotonic() - fetch_start))
+
+            failures = 0 if record else failures + 1
+            if failures >= MAX_CONSECUTIVE_FAILURES or not browser.is_connected():
+                logger.warning(f"Worker {worker_id}: {failures} failed fetches in a row or browser lost, restarting")
+                restart = True
+                break
+
+    # put() only buffers; wait for the feeder threads to deliver the last result and log records
+    for channel in (results, log_queue):
+        channel.close()
+        channel.join_thread()
+    if restart:
+        sys.exit(RESTART_EXIT_CODE)
+
+
+class WorkerPool:
+    """
+    Processes that fetch detail pages of one record kind ("listing" or "sale").
+
+    Use as a context manager, then call fetch() per batch of URLs:
+
+        with WorkerPool("listing", workers=8) as pool:
+            records = pool.fetch(urls)
+        pool.stats()
+    """
+
+    def __init__(self, kind, workers=DEFAULT_PROCESS_WORKERS):
+        if kind not in FETCHERS:
+            raise ValueError(f"Unknown record kind: {kind}")
+        self.kind = kind
+        self.size = max(1, workers)
+        # Spawned, not forked: a forked child would inherit the parent's Playwright driver threads
+        self._mp = multiprocessing.get_context("spawn")
+        self._results = self._mp.Queue()
+        self._log_queue = self._mp.Queue()
+        self._log_listener = None
+        self._workers = {}
+        self._worker_stats = {}
+        self._attempts = {}
+        self.restarts = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start(self):
+        self._log_listener = start_worker_log_listener(self._log_queue)
+        for worker_id in range(self.size):
+            self._start_worker(worker_id)
+
+    def _start_worker(self, worker_id):
+        tasks = self._mp.Queue()
+        process = self._mp.Process(
+            target=_worker_main, args=(worker_id, self.kind, tasks, self._results, self._log_queue),
+            name=f"{self.kind}-worker-{worker_id}", daemon=True,
+        )
+        process.start()
+        self._workers[worker_id] = {"process": process, "tasks": tasks, "in_flight": set()}
+        stats = self._worker_stats.setdefault(
+            worker_id, {"fetched": 0, "failed": 0, "fetch_seconds": 0.0, "restarts": 0, "startup_seconds": 0.0}
+        )
+        stats["pid"] = process.pid
+
+    def _handle_message(self, message, records):
+        if message[0] == "ready":
+            _, worker_id, pid, startup_seconds = message
+            self._worker_stats[worker_id]["startup_seconds"] += startup_seconds
+            return
+        _, worker_id, url, record, seconds = message
+        worker = self._workers.get(worker_id)
+        if worker is not None:
+            worker["in_flight"].discard(url)
+        stats = self._worker_stats[worker_id]
+        stats["fetch_seconds"] += seconds
+        stats["fetched" if record else "failed"] += 1
+        records[url] = record
+        self._attempts.pop(url, None)
+
+    def _replace_dead_workers(self, pending, failed, records):
+        """Restart dead workers and put the URLs they held back in pending (or failed)"""
+        if any(not worker["process"].is_alive() for worker in self._workers.values()):
+            # A worker flushes its results before exiting, so take them first
+            # rather than requeueing URLs it has already fetched
+            while True:
+                try:
+                    self._handle_message(self._results.get_nowait(), records)
+                except queue.Empty:
+                    break
+        for worker_id, worker in list(self._workers.items()):
+            if worker["process"].is_alive():
+                continue
+            exitcode = worker["process"].exitcode
+            logger.warning(
+                f"{self.kind} worker {worker_id} exited with code {exitcode} holding {len(worker['in_flight'])} URLs",
+                extra={"worker": worker_id, "exitcode": exitcode},
+            )
+            for url in worker["in_flight"]:
+                if self._attempts.get(url, 0) >= MAX_ATTEMPTS:
+                    failed.append(url)
+                else:
+                    pending.appendleft(url)
+            del self._workers[worker_id]
+
+            if self.restarts >= MAX_RESTARTS:
+                logger.error(f"{self.kind} worker pool reached {MAX_RESTARTS} restarts, not restarting worker {worker_id}")
+                continue
+            self.restarts += 1
+            self._worker_stats[worker_id]["restarts"] += 1
+            self._start_worker(worker_id)
+
+    def _dispatch(self, pending):
+        for worker in self._workers.values():
+            while pending and len(worker["in_flight"]) <= PREFETCH:
+                url = pending.popleft()
+                self._attempts[url] = self._attempts.get(url, 0) + 1
+                worker["in_flight"].add(url)
+                worker["tasks"].put(url)
+
+    def fetch(self, urls, deadline=None):
+        """
+        Fetch the records of a batch of URLs.
+
+        Args:
+            urls: Detail page URLs
+            deadline: Optional time.monotonic() value after which no further
+                URLs are handed out; URLs already being fetched are waited for
+
+        Returns:
+            dict: {url: record or None} for every URL that was fetched or given
+            up on; URLs left undispatched at the deadline are missing
+        """
+        pending = deque(dict.fromkeys(urls))
+        records = {}
+        failed = []
+        while pending or any(worker["in_flight"] for worker in self._workers.values()):
+            if deadline is not None and time.monotonic() >= deadline:
+                pending.clear()
+            self._replace_dead_workers(pending, failed, records)
+            self._dispatch(pending)
+            if not self._workers:
+                logger.error(f"No {self.kind} workers left, giving up on {len(pending)} URLs")
+                failed.extend(pending)
+                break
+            try:
+                message = self._results.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                continue
+            self._handle_message(message, records)
+
+        for url in failed:
+            records[url] = None
+            self._attempts.pop(url, None)
+        return records
+
+    def close(self):
+        for worker in self._workers.values():
+            worker["tasks"].put(None)
+        for worker in self._workers.values():
+            worker["process"].join(timeout=30)
+            if worker["process"].is_alive():
+                worker["process"].terminate()
+        self._workers = {}
+        if self._log_listener is not None:
+            self._log_listener.stop()
+            self._log_listener = None
+
+    def stats(self):
+        """
+        Per-worker and total counters for the run summary.
+
+        Returns:
+            Dictionary with "workers" ({worker id: counters}) and totals of
+            fetched, failed and restarts
+        """
+        workers = {
+            str(worker_id): {
+                key: round(value, 3) if isinstance(value, float) else value for key, value in stats.items()
+            }
+            for worker_id, stats in sorted(self._worker_stats.items())
+        }
+        return {
+            "worker_processes": self.size,
+            "worker_fetched": sum(stats["fetched"] for stats in self._worker_stats.values()),
+            "worker_failed": sum(stats["failed"] for stats in self._worker_stats.values()),
+            "worker_restarts": self.restarts,
+            "workers": workers,
+        }
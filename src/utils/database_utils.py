@@ -1,7 +1,12 @@
 import psycopg2
+from psycopg2.extras import Json, execute_values
+import json
 import logging
 import os
 import time
+from contextlib import contextmanager
+
+from utils.profiling import stage
 
 logger = logging.getLogger(__name__)
 
@@ -336,12 +341,56 @@ def listing_exists_in_database(hemnet_id):
         logger.error(f"Error checking if listing exists: {e}")
         return False
 
-def save_to_database(data):
+def use_server_ingest():
+    """Whether USE_SERVER_INGEST asks for listings to be stored with the ingest_listing database function"""
+    return os.environ.get("USE_SERVER_INGEST", "").strip().lower() in ("1", "true", "yes")
+
+def save_to_database_server_side(data):
+    """
+    Save the scraped listing data with the ingest_listing database function.
+    
+    The whole listing, including its lookup values, broker, agencies, locations
+    and amenities, is sent as one JSONB argument and stored in a single
+    transaction: one round trip and one commit per listing.
+    
+    Args:
+        data: Dictionary containing the listing data
+        
+    Returns:
+        Boolean indicating success or failure
+    """
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                "SELECT ingest_listing(%s)",
+                (Json(data, dumps=lambda value: json.dumps(value, default=str, ensure_ascii=False)),)
+            )
+            cursor.fetchone()
+            conn.commit()
+            logger.debug("Successfully saved listing %s to database", data['hemnet_id'])
+            return True
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error inserting listing {data['hemnet_id']}: {e}")
+            return False
+        finally:
+            cursor.close()
+            conn.close()
+    except Exception as e:
+        logger.error(f"Database error while saving listing {data.get('hemnet_id')}: {e}")
+        return False
+
+@stage("save_to_database")
+def save_to_database(data, server_side=None):
     """
     Save the scraped listing data to the database.
     
     Args:
         data: Dictionary containing the listing data
+        server_side: Store it with the ingest_listing database function instead
+            of one statement per row (default: the USE_SERVER_INGEST setting)
         
     Returns:
         Boolean indicating success or failure
@@ -350,6 +399,11 @@ def save_to_database(data):
         logger.error("Invalid listing data, missing hemnet_id")
         return False
     
+    if server_side is None:
+        server_side = use_server_ingest()
+    if server_side:
+        return save_to_database_server_side(data)
+    
     try:
         conn = get_db_connection()
         
@@ -423,8 +477,8 @@ def save_to_database(data):
                 data.get("closest_water_distance_meters"),
                 data.get("coastline_distance_meters"),
                 data.get("description"),
-                None,  # latitude - not provided in your extraction method, add if needed
-                None   # longitude - not provided in your extraction method, add if needed
+                data.get("latitude"),
+                data.get("longitude")
             ))
             
             listing_id = cursor.fetchone()[0]
@@ -461,7 +515,7 @@ def save_to_database(data):
                         )
             
             conn.commit()
-            logger.info(f"Successfully saved listing {data['hemnet_id']} to database")
+            logger.debug("Successfully saved listing %s to database", data['hemnet_id'])
             return True
             
         except Exception as e:
@@ -523,6 +577,7 @@ def find_matching_listing_id(original_hemnet_id):
         logger.error(f"Error finding matching listing ID: {e}")
         return None
 
+@stage("save_to_database")
 def store_sold_listing(data):
     """
     Store the sold listing data in the database.
@@ -539,15 +594,24 @@ def store_sold_listing(data):
     
     sale_hemnet_id = data.get("sale_hemnet_id")
     
-    # Check if this sale already exists in our database
-    if sale_exists_in_database(sale_hemnet_id):
-        logger.info(f"Sale {sale_hemnet_id} already exists in database, skipping")
-        return False, True  # Not stored, already exists
-    
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
         
+        # Claim the sale's keys first: property_sales only enforces them per sale_date, and
+        # a concurrent writer with the same sale waits here until this transaction ends
+        cursor.execute("""
+            INSERT INTO sale_keys (sale_hemnet_id, url) VALUES (%s, %s)
+            ON CONFLICT DO NOTHING
+            RETURNING sale_hemnet_id
+        """, (sale_hemnet_id, data.get("url")))
+        if cursor.fetchone() is None:
+            conn.rollback()
+            cursor.close()
+            conn.close()
+            logger.debug("Sale %s already exists in database, skipping", sale_hemnet_id)
+            return False, True  # Not stored, already exists
+        
         # Find matching listing_id if we have the original listing
         original_hemnet_id = data.get("original_hemnet_id")
         listing_id = None
@@ -560,9 +624,9 @@ def store_sold_listing(data):
                 sale_hemnet_id, listing_id, listing_hemnet_id, final_price, asking_price,
                 price_change, price_change_percentage, sale_date, sale_date_str,
                 broker_agency, living_area, land_area, number_of_rooms, construction_year,
-                street_address, area, municipality, running_costs, url
+                street_address, area, municipality, running_costs, url, latitude, longitude
             ) VALUES (
-                %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
+                %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
             )
         """, (
             sale_hemnet_id,
@@ -583,7 +647,9 @@ def store_sold_listing(data):
             data.get("area"),
             data.get("municipality"),
             data.get("running_costs"),
-            data.get("url")
+            data.get("url"),
+            data.get("latitude"),
+            data.get("longitude")
         ))
         
         # Update status of the original listing if we found a match
@@ -593,13 +659,13 @@ def store_sold_listing(data):
                 SET status = 'sold' 
                 WHERE listing_id = %s
             """, (listing_id,))
-            logger.info(f"Updated status of listing {listing_id} to 'sold'")
+            logger.debug("Updated status of listing %s to 'sold'", listing_id)
         
         conn.commit()
         cursor.close()
         conn.close()
         
-        logger.info(f"Successfully saved sold listing {sale_hemnet_id} to database")
+        logger.debug("Successfully saved sold listing %s to database", sale_hemnet_id)
         return True, False  # Success, not already existing
         
     except Exception as e:
@@ -607,4 +673,403 @@ def store_sold_listing(data):
             conn.rollback()
             conn.close()
         logger.error(f"Error storing sold listing {sale_hemnet_id}: {e}")
-        return False, False  # Error, not already existing
\ No newline at end of file
+        return False, False  # Error, not already existing
+
+@stage("save_to_database")
+def update_asking_prices(prices):
+    """
+    Update the asking prices of stored listings in one statement.
+    
+    Used by fast mode with the prices shown on search result cards; rows whose
+    price has not changed are left untouched.
+    
+    Args:
+        prices: Iterable of (listing_hemnet_id, asking_price) pairs
+        
+    Returns:
+        Number of listings whose asking price changed
+    """
+    prices = list(prices)
+    if not prices:
+        return 0
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            execute_values(cursor, """
+                UPDATE listings l
+                SET asking_price = v.asking_price
+                FROM (VALUES %s) AS v (listing_hemnet_id, asking_price)
+                WHERE l.listing_hemnet_id = v.listing_hemnet_id
+                  AND l.asking_price IS DISTINCT FROM v.asking_price
+            """, prices, template="(%s::bigint, %s::numeric)", page_size=1000)
+            updated = cursor.rowcount
+            conn.commit()
+            logger.debug("Updated asking prices of %d of %d listings", updated, len(prices))
+            return updated
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error updating asking prices: {e}")
+            return 0
+        finally:
+            cursor.close()
+            conn.close()
+    except Exception as e:
+        logger.error(f"Database error while updating asking prices: {e}")
+        return 0
+
+def mark_listings_checked(hemnet_ids):
+    """
+    Record a change check of stored listings, from a refetched detail page or
+    a fast mode result card, in listing_checks.
+    
+    Args:
+        hemnet_ids: Iterable of listing_hemnet_ids
+        
+    Returns:
+        Number of listings marked
+    """
+    rows = [(hemnet_id,) for hemnet_id in set(hemnet_ids)]
+    if not rows:
+        return 0
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            execute_values(cursor, """
+                INSERT INTO listing_checks (listing_hemnet_id) VALUES %s
+                ON CONFLICT (listing_hemnet_id) DO UPDATE SET checked_at = EXCLUDED.checked_at
+            """, rows, page_size=1000)
+            conn.commit()
+            return len(rows)
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error marking listings checked: {e}")
+            return 0
+        finally:
+            cursor.close()
+            conn.close()
+    except Exception as e:
+        logger.error(f"Database error while marking listings checked: {e}")
+        return 0
+
+def store_ingest_rejects(record_type, id_field, rejects):
+    """
+    Quarantine records that failed validation in ingest_rejects.
+    
+    Args:
+        record_type: "listing" or "sale"
+        id_field: Field of the record holding its Hemnet id
+        rejects: List of (record, {field: reason}) pairs
+        
+    Returns:
+        Number of rejects stored
+    """
+    # Records hold dates and Decimals, which are stored as their string form
+    dumps = lambda value: json.dumps(value, default=str, ensure_ascii=False)
+    rows = [
+        (
+            record_type,
+            record.get(id_field) if isinstance(record.get(id_field), int) else None,
+            record.get("url"),
+            list(reasons),
+            Json(reasons, dumps=dumps),
+            Json(record, dumps=dumps),
+        )
+        for record, reasons in rejects
+    ]
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            execute_values(cursor, """
+                INSERT INTO ingest_rejects (record_type, hemnet_id, url, fields, reasons, record)
+                VALUES %s
+            """, rows)
+            conn.commit()
+            return len(rows)
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error storing rejected {record_type} records: {e}")
+            return 0
+        finally:
+            cursor.close()
+            conn.close()
+    except Exception as e:
+        logger.error(f"Database error while storing rejected {record_type} records: {e}")
+        return 0
+
+def link_unmatched_sales():
+    """
+    Link sales that were stored before their original listing to that listing.
+    
+    Matches property_sales.listing_hemnet_id against listings in a single
+    set-based UPDATE and marks the linked listings as sold in the same statement,
+    so both changes commit or roll back together.
+    
+    Returns:
+        tuple: (sales_linked: int, listings_marked_sold: int)
+    """
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                WITH linked AS (
+                    UPDATE property_sales ps
+                    SET listing_id = l.listing_id
+                    FROM listings l
+                    WHERE ps.listing_id IS NULL
+                      AND ps.listing_hemnet_id = l.listing_hemnet_id
+                    RETURNING ps.listing_id
+                ), marked_sold AS (
+                    UPDATE listings
+                    SET status = 'sold'
+                    WHERE listing_id IN (SELECT listing_id FROM linked)
+                      AND status <> 'sold'
+                    RETURNING listing_id
+                )
+                SELECT (SELECT COUNT(*) FROM linked), (SELECT COUNT(*) FROM marked_sold)
+            """)
+            sales_linked, listings_marked_sold = cursor.fetchone()
+            conn.commit()
+            logger.info(f"Linked {sales_linked} unmatched sales to listings, marked {listings_marked_sold} listings as sold")
+            return sales_linked, listings_marked_sold
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error linking unmatched sales: {e}")
+            return 0, 0
+        finally:
+            cursor.close()
+            conn.close()
+    except Exception as e:
+        logger.error(f"Database error while linking unmatched sales: {e}")
+        return 0, 0
+
+# Materialized analytics views and the run counters that can change their contents.
+# A view is only refreshed when at least one of its counters is non-zero.
+ANALYTICS_VIEW_DEPENDENCIES = {
+    "listing_sales_view": ("sales_inserted", "sales_linked", "asking_prices_updated"),
+    "location_market_performance": ("sales_inserted", "sales_linked"),
+    "housing_cooperative_performance": (
+        "cooperative_listings_inserted", "sales_inserted", "sales_linked", "asking_prices_updated",
+    ),
+}
+
+def refresh_analytics_views(changes):
+    """
+    Refresh the materialized analytics views affected by a scrape run.
+    
+    Args:
+        changes: Dictionary of run counters, e.g. {"sales_inserted": 12}
+        
+    Returns:
+        List of the view names that were refreshed
+    """
+    affected = [
+        view for view, counters in ANALYTICS_VIEW_DEPENDENCIES.items()
+        if any(changes.get(counter) for counter in counters)
+    ]
+    if not affected:
+        logger.info("No analytics views affected by this run, skipping refresh")
+        return []
+    
+    refreshed = []
+    try:
+        conn = get_db_connection()
+        # REFRESH ... CONCURRENTLY can't run inside a transaction block
+        conn.autocommit = True
+        cursor = conn.cursor()
+        try:
+            for view in affected:
+                start_time = time.time()
+                try:
+                    cursor.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {view}")
+                    refreshed.append(view)
+                    logger.info(f"Refreshed {view} in {time.time() - start_time:.2f}s")
+                except psycopg2.Error as e:
+                    logger.error(f"Error refreshing {view}: {e}")
+        finally:
+            cursor.close()
+            conn.close()
+    except Exception as e:
+        logger.error(f"Database error while refreshing analytics views: {e}")
+    
+    return refreshed
+
+# First key of the two-key advisory locks taken by the scheduler, so they can't collide
+# with locks other applications take on the same database
+SCRAPER_LOCK_NAMESPACE = 4836
+
+@contextmanager
+def scraper_job_lock(job):
+    """
+    Hold a session-level advisory lock for a scraper job while the block runs.
+    
+    The lock lives on its own connection, so it is released when the block exits
+    and also if the process dies, and it is shared by every container using the
+    same database.
+    
+    Yields:
+        Boolean, False if another session already holds the lock
+    """
+    conn = get_db_connection()
+    conn.autocommit = True
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "SELECT pg_try_advisory_lock(%s, hashtext(%s))", (SCRAPER_LOCK_NAMESPACE, job)
+        )
+        acquired = cursor.fetchone()[0]
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                cursor.execute(
+                    "SELECT pg_advisory_unlock(%s, hashtext(%s))", (SCRAPER_LOCK_NAMESPACE, job)
+                )
+    finally:
+        cursor.close()
+        conn.close()
+
+def start_scraper_run(job, time_budget_seconds=None, status="running"):
+    """
+    Record the start of a scraper job run.
+    
+    Returns:
+        The run_id, or None if the run couldn't be recorded
+    """
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                INSERT INTO scraper_runs (job, status, time_budget_seconds)
+                VALUES (%s, %s, %s)
+                RETURNING run_id
+            """, (job, status, time_budget_seconds))
+            run_id = cursor.fetchone()[0]
+            conn.commit()
+            return run_id
+        finally:
+            cursor.close()
+            conn.close()
+    except Exception as e:
+        logger.error(f"Error recording start of {job} run: {e}")
+        return None
+
+def finish_scraper_run(run_id, status, stats=None, items_processed=None, error=None):
+    """
+    Record the outcome of a scraper job run started with start_scraper_run.
+    
+    Args:
+        run_id: The run to update
+        status: "completed", "budget_exhausted", "failed" or "skipped"
+        stats: The job's run counters, stored as JSON
+        items_processed: Number of listings or sales the job processed
+        error: Error message for failed runs
+    
+    Runs that weren't skipped also bump data_version.
+    """
+    if run_id is None:
+        return
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                UPDATE scraper_runs
+                SET status = %s,
+                    finished_at = clock_timestamp(),
+                    duration_seconds = EXTRACT(EPOCH FROM clock_timestamp() - started_at),
+                    items_processed = %s,
+                    stats = %s,
+                    error = %s
+                WHERE run_id = %s
+            """, (status, items_processed, Json(stats) if stats is not None else None, error, run_id))
+            if status != "skipped":
+                # Tell read caches the data may have changed
+                cursor.execute("""
+                    UPDATE data_version
+                    SET version = version + 1, run_id = %s, updated_at = clock_timestamp()
+                """, (run_id,))
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+    except Exception as e:
+        logger.error(f"Error recording end of run {run_id}: {e}")
+
+def load_deferred_urls(job):
+    """
+    Detail URLs a job's previous run deferred, in the order it would have served them.
+    
+    Returns:
+        List of (url, crawl_planner priority) pairs
+    """
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+                SELECT url, priority FROM crawl_deferred
+                WHERE job = %s
+                ORDER BY priority, position
+            """, (job,))
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+            conn.close()
+    except Exception as e:
+        logger.error(f"Error loading deferred {job} URLs: {e}")
+        return []
+
+def save_deferred_urls(job, deferred):
+    """
+    Replace a job's deferred detail URLs with those of the run that just ended.
+    
+    Args:
+        job: Key of the scheduler's JOBS
+        deferred: List of (url, crawl_planner priority) pairs in serving order
+    """
+    rows = [(job, url, priority, position) for position, (url, priority) in enumerate(deferred)]
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("DELETE FROM crawl_deferred WHERE job = %s", (job,))
+            if rows:
+                execute_values(cursor, """
+                    INSERT INTO crawl_deferred (job, url, priority, position) VALUES %s
+                    ON CONFLICT (job, url) DO NOTHING
+                """, rows, page_size=1000)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Error saving deferred {job} URLs: {e}")
+        finally:
+            cursor.close()
+            conn.close()
+    except Exception as e:
+        logger.error(f"Database error while saving deferred {job} URLs: {e}")
+
+def get_data_version():
+    """
+    Current data_version, bumped by finish_scraper_run.
+    
+    Returns:
+        The version number, or None if it couldn't be read
+    """
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT version FROM data_version")
+            row = cursor.fetchone()
+            return row[0] if row else 0
+        finally:
+            cursor.close()
+            conn.close()
+    except Exception as e:
+        logger.error(f"Error reading data version: {e}")
+        return None
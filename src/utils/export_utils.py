@@ -0,0 +1,312 @@
+import json
+import logging
+import os
+import shutil
+import uuid
+from datetime import date, datetime, timezone
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from utils.database_utils import get_db_connection
+from utils.read_utils import stream_rows
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = "manifest.json"
+UNPARTITIONED = "all"
+
+_TIMESTAMP = pa.timestamp("us", tz="UTC")
+
+# Each dataset is exported as hive-style partitions (<dataset>/<partition>=YYYY-MM/part.parquet)
+# so notebooks can open the directory with pyarrow.dataset or pandas.read_parquet.
+# "partition_by" is a DATE column; datasets without it are written as a single file.
+EXPORT_DATASETS = {
+    "listings": {
+        "from": """
+            listings l
+            JOIN housing_form_types hft ON l.housing_form_id = hft.housing_form_id
+            JOIN tenure_types tt ON l.tenure_id = tt.tenure_id
+            LEFT JOIN energy_classifications ec ON l.energy_classification_id = ec.energy_classification_id
+            LEFT JOIN housing_cooperatives hc ON l.housing_cooperative_id = hc.housing_cooperative_id
+            LEFT JOIN brokers b ON l.broker_id = b.broker_id
+        """,
+        "partition_by": "l.published_date",
+        "partition_name": "published_month",
+        "updated_at": "l.updated_at",
+        "columns": [
+            ("listing_id", "l.listing_id", pa.int64()),
+            ("listing_hemnet_id", "l.listing_hemnet_id", pa.int64()),
+            ("url", "l.url", pa.string()),
+            ("street_address", "l.street_address", pa.string()),
+            ("postcode", "l.postcode", pa.string()),
+            ("housing_form", "hft.name", pa.string()),
+            ("tenure", "tt.name", pa.string()),
+            ("energy_classification", "ec.classification", pa.string()),
+            ("housing_cooperative_id", "l.housing_cooperative_id", pa.int64()),
+            ("housing_cooperative", "hc.name", pa.string()),
+            ("broker_id", "l.broker_id", pa.int64()),
+            ("broker_name", "b.name", pa.string()),
+            ("number_of_rooms", "l.number_of_rooms::float8", pa.float64()),
+            ("asking_price", "l.asking_price::float8", pa.float64()),
+            ("squaremeter_price", "l.squaremeter_price::float8", pa.float64()),
+            ("fee", "l.fee::float8", pa.float64()),
+            ("yearly_arrendee_fee", "l.yearly_arrendee_fee::float8", pa.float64()),
+            ("yearly_leasehold_fee", "l.yearly_leasehold_fee::float8", pa.float64()),
+            ("running_costs", "l.running_costs::float8", pa.float64()),
+            ("construction_year", "l.construction_year", pa.int32()),
+            ("living_area", "l.living_area::float8", pa.float64()),
+            ("supplemental_area", "l.supplemental_area::float8", pa.float64()),
+            ("land_area", "l.land_area::float8", pa.float64()),
+            ("is_foreclosure", "l.is_foreclosure", pa.bool_()),
+            ("is_new_construction", "l.is_new_construction", pa.bool_()),
+            ("is_project", "l.is_project", pa.bool_()),
+            ("is_upcoming", "l.is_upcoming", pa.bool_()),
+            ("floor", "l.floor", pa.int32()),
+            ("published_date", "l.published_date", pa.date32()),
+            ("status", "l.status", pa.string()),
+            ("closest_water_distance_meters", "l.closest_water_distance_meters", pa.int32()),
+            ("coastline_distance_meters", "l.coastline_distance_meters", pa.int32()),
+            ("latitude", "l.latitude::float8", pa.float64()),
+            ("longitude", "l.longitude::float8", pa.float64()),
+            ("description", "l.description", pa.string()),
+            ("created_at", "l.created_at", _TIMESTAMP),
+            ("updated_at", "l.updated_at", _TIMESTAMP),
+        ],
+    },
+    "property_sales": {
+        "from": "property_sales ps",
+        "partition_by": "ps.sale_date",
+        "partition_name": "sale_month",
+        "updated_at": "ps.updated_at",
+        "columns": [
+            ("sale_id", "ps.sale_id", pa.int64()),
+            ("sale_hemnet_id", "ps.sale_hemnet_id", pa.int64()),
+            ("listing_id", "ps.listing_id", pa.int64()),
+            ("listing_hemnet_id", "ps.listing_hemnet_id", pa.int64()),
+            ("final_price", "ps.final_price::float8", pa.float64()),
+            ("asking_price", "ps.asking_price::float8", pa.float64()),
+            ("price_change", "ps.price_change::float8", pa.float64()),
+            ("price_change_percentage", "ps.price_change_percentage::float8", pa.float64()),
+            ("sale_date", "ps.sale_date", pa.date32()),
+            ("broker_agency", "ps.broker_agency", pa.string()),
+            ("living_area", "ps.living_area::float8", pa.float64()),
+            ("land_area", "ps.land_area::float8", pa.float64()),
+            ("number_of_rooms", "ps.number_of_rooms::float8", pa.float64()),
+            ("construction_year", "ps.construction_year", pa.int32()),
+            ("street_address", "ps.street_address", pa.string()),
+            ("area", "ps.area", pa.string()),
+            ("municipality", "ps.municipality", pa.string()),
+            ("running_costs", "ps.running_costs::float8", pa.float64()),
+            ("url", "ps.url", pa.string()),
+            ("latitude", "ps.latitude::float8", pa.float64()),
+            ("longitude", "ps.longitude::float8", pa.float64()),
+            ("created_at", "ps.created_at", _TIMESTAMP),
+            ("updated_at", "ps.updated_at", _TIMESTAMP),
+        ],
+    },
+    "locations": {
+        "from": "locations loc",
+        "partition_by": None,
+        "updated_at": "loc.updated_at",
+        "columns": [
+            ("location_id", "loc.location_id", pa.int64()),
+            ("location_hemnet_id", "loc.location_hemnet_id", pa.int64()),
+            ("location_name", "loc.location_name", pa.string()),
+            ("type", "loc.type", pa.string()),
+            ("parent_location_id", "loc.parent_location_id", pa.int64()),
+            ("latitude", "loc.latitude::float8", pa.float64()),
+            ("longitude", "loc.longitude::float8", pa.float64()),
+            ("updated_at", "loc.updated_at", _TIMESTAMP),
+        ],
+    },
+    "listing_locations": {
+        "from": "listing_locations ll",
+        "partition_by": None,
+        "updated_at": "ll.created_at",
+        "columns": [
+            ("listing_id", "ll.listing_id", pa.int64()),
+            ("location_id", "ll.location_id", pa.int64()),
+            ("created_at", "ll.created_at", _TIMESTAMP),
+        ],
+    },
+}
+
+
+def get_export_dir():
+    """
+    Return the directory Parquet exports are written to.
+
+    Uses EXPORT_DIR when set, otherwise exports/ relative to the repository root.
+    """
+    if "EXPORT_DIR" in os.environ:
+        return os.environ["EXPORT_DIR"]
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    base_dir = os.path.dirname(os.path.dirname(script_dir))
+    return os.path.join(base_dir, "exports")
+
+def load_manifest(export_dir):
+    """Load the export manifest, or an empty one if nothing has been exported yet"""
+    path = os.path.join(export_dir, MANIFEST_FILENAME)
+    if not os.path.exists(path):
+        return {"datasets": {}}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def _save_manifest(export_dir, manifest):
+    path = os.path.join(export_dir, MANIFEST_FILENAME)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def _partition_expression(dataset):
+    if not dataset["partition_by"]:
+        return f"'{UNPARTITIONED}'"
+    return f"to_char({dataset['partition_by']}, 'YYYY-MM')"
+
+def _partition_dir(export_dir, name, dataset, partition):
+    if not dataset["partition_by"]:
+        return os.path.join(export_dir, name)
+    return os.path.join(export_dir, name, f"{dataset['partition_name']}={partition}")
+
+def _month_range(partition):
+    year, month = (int(part) for part in partition.split("-"))
+    start = date(year, month, 1)
+    end = date(year + month // 12, month % 12 + 1, 1)
+    return start, end
+
+def get_partition_stats(conn, dataset):
+    """
+    Return {partition: (max_updated_at_iso, row_count)} for a dataset, computed in the database.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+            SELECT {_partition_expression(dataset)}, MAX({dataset['updated_at']}), COUNT(*)
+            FROM {dataset['from']}
+            GROUP BY 1
+        """)
+        return {
+            partition: (max_updated.isoformat() if max_updated else None, count)
+            for partition, max_updated, count in cursor.fetchall()
+        }
+    finally:
+        cursor.close()
+
+def write_partition(conn, export_dir, name, dataset, partition, chunk_size=50000):
+    """
+    Stream one partition of a dataset from the database into a Parquet file.
+
+    The file is written next to its final location and moved into place once
+    complete, so readers never see a half-written partition.
+
+    Returns:
+        Number of rows written
+    """
+    schema = pa.schema([(column, arrow_type) for column, _, arrow_type in dataset["columns"]])
+    select_list = ", ".join(expression for _, expression, _ in dataset["columns"])
+    sql = f"SELECT {select_list} FROM {dataset['from']}"
+    params = ()
+    if dataset["partition_by"]:
+        sql += f" WHERE {dataset['partition_by']} >= %s AND {dataset['partition_by']} < %s"
+        params = _month_range(partition)
+
+    partition_dir = _partition_dir(export_dir, name, dataset, partition)
+    os.makedirs(partition_dir, exist_ok=True)
+    path = os.path.join(partition_dir, "part.parquet")
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+
+    rows_written = 0
+    writer = pq.ParquetWriter(tmp_path, schema, compression="zstd")
+    try:
+        for rows in stream_rows(conn, sql, params, chunk_size):
+            columns = list(zip(*rows))
+            batch = pa.record_batch(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                schema=schema,
+            )
+            writer.write_batch(batch)
+            rows_written += len(rows)
+    except Exception:
+        writer.close()
+        os.remove(tmp_path)
+        raise
+    writer.close()
+    os.replace(tmp_path, path)
+    return rows_written
+
+def export_to_parquet(export_dir=None, datasets=None, full=False):
+    """
+    Export listings, sales and their dimensions to partitioned Parquet files.
+
+    Only partitions whose row count or latest updated_at differ from the
+    manifest are rewritten; partitions that no longer exist are removed.
+
+    Args:
+        export_dir: Target directory (defaults to get_export_dir())
+        datasets: Names from EXPORT_DATASETS to export (defaults to all)
+        full: Rewrite every partition regardless of the manifest
+
+    Returns:
+        Dictionary of {dataset: number of partitions rewritten}
+    """
+    export_dir = export_dir or get_export_dir()
+    os.makedirs(export_dir, exist_ok=True)
+    manifest = load_manifest(export_dir)
+    summary = {}
+
+    conn = get_db_connection()
+    # One snapshot for the whole export, so partition stats match the rows written
+    conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+    try:
+        for name in datasets or EXPORT_DATASETS:
+            dataset = EXPORT_DATASETS[name]
+            columns = [column for column, _, _ in dataset["columns"]]
+            previous_entry = manifest["datasets"].get(name, {})
+            previous = previous_entry.get("partitions", {})
+            # Partitions written with a different column set would give the dataset mixed schemas
+            schema_changed = previous_entry.get("columns") != columns
+            current = get_partition_stats(conn, dataset)
+            partitions = {}
+            rewritten = 0
+
+            for partition, (max_updated_at, row_count) in sorted(current.items()):
+                entry = previous.get(partition)
+                path = os.path.join(_partition_dir(export_dir, name, dataset, partition), "part.parquet")
+                unchanged = (
+                    not full
+                    and not schema_changed
+                    and entry
+                    and entry["max_updated_at"] == max_updated_at
+                    and entry["rows"] == row_count
+                    and os.path.exists(path)
+                )
+                if unchanged:
+                    partitions[partition] = entry
+                    continue
+
+                rows = write_partition(conn, export_dir, name, dataset, partition)
+                partitions[partition] = {
+                    "max_updated_at": max_updated_at,
+                    "rows": rows,
+                    "exported_at": datetime.now(timezone.utc).isoformat(),
+                }
+                rewritten += 1
+
+            for partition in set(previous) - set(current):
+                shutil.rmtree(_partition_dir(export_dir, name, dataset, partition), ignore_errors=True)
+
+            manifest["datasets"][name] = {
+                "partition_column": dataset.get("partition_name"),
+                "columns": columns,
+                "partitions": partitions,
+            }
+            # Save after every dataset so an interrupted export keeps its progress
+            _save_manifest(export_dir, manifest)
+            summary[name] = rewritten
+            logger.info(f"Exported {name}: {rewritten} of {len(current)} partitions rewritten")
+    finally:
+        conn.close()
+
+    return summary
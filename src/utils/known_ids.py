@@ -0,0 +1,88 @@
+import hashlib
+import logging
+import time
+from array import array
+from bisect import bisect_left
+
+from utils.database_utils import get_db_connection
+from utils.read_utils import stream_rows
+
+logger = logging.getLogger(__name__)
+
+# 64-bit key of a URL: the first 16 hex digits of its MD5 as a signed bigint, so
+# PostgreSQL can compute the same key without sending the URLs
+URL_KEY_SQL = "('x' || left(md5({column}), 16))::bit(64)::bigint"
+
+
+class KnownIds:
+    """
+    Compact membership set of int64 ids known to be stored.
+
+    The ids loaded at startup live in a sorted array('q') (8 bytes per id,
+    searched with bisect); ids added during the run go to a small set.
+    """
+
+    def __init__(self, sorted_ids=None):
+        self._ids = sorted_ids if sorted_ids is not None else array('q')
+        self._added = set()
+
+    def __contains__(self, value):
+        i = bisect_left(self._ids, value)
+        return (i < len(self._ids) and self._ids[i] == value) or value in self._added
+
+    def __len__(self):
+        return len(self._ids) + len(self._added)
+
+    def add(self, value):
+        if value not in self:
+            self._added.add(value)
+
+    @classmethod
+    def from_query(cls, conn, sql, params=None):
+        """Load ids from a query returning one bigint column in ascending order"""
+        ids = array('q')
+        for rows in stream_rows(conn, sql, params):
+            for (value,) in rows:
+                # Partitioned tables can return the same id twice
+                if not ids or ids[-1] != value:
+                    ids.append(value)
+        return cls(ids)
+
+def url_key(url):
+    """Python side of URL_KEY_SQL"""
+    return int.from_bytes(hashlib.md5(url.encode("utf-8")).digest()[:8], "big", signed=True)
+
+def _load(description, sql, params=None):
+    start_time = time.monotonic()
+    conn = get_db_connection()
+    conn.set_session(readonly=True)
+    try:
+        known = KnownIds.from_query(conn, sql, params)
+    finally:
+        conn.rollback()
+        conn.close()
+    logger.info(
+        "Loaded %d known %s in %.2fs (%d KiB)",
+        len(known), description, time.monotonic() - start_time, len(known) * 8 // 1024,
+    )
+    return known
+
+def load_known_listing_ids():
+    """Hemnet ids of every stored listing"""
+    return _load("listing ids", "SELECT listing_hemnet_id FROM listings ORDER BY listing_hemnet_id")
+
+def load_known_sale_urls():
+    """Keys (see url_key) of every stored sale URL"""
+    key = URL_KEY_SQL.format(column="url")
+    return _load("sale URLs", f"SELECT {key} AS url_key FROM property_sales ORDER BY url_key")
+
+def load_due_listing_ids(check_interval_days):
+    """Hemnet ids of active listings whose last change check (or insert) is older than check_interval_days"""
+    return _load("listing ids due for a check", """
+        SELECT l.listing_hemnet_id
+        FROM listings l
+        LEFT JOIN listing_checks c ON l.listing_hemnet_id = c.listing_hemnet_id
+        WHERE l.status = 'active'
+          AND COALESCE(c.checked_at, l.created_at) < now() - make_interval(days => %s)
+        ORDER BY l.listing_hemnet_id
+    """, (check_interval_days,))
@@ -1,16 +1,92 @@
+import atexit
+import json
 import logging
+import multiprocessing
 import os
-from datetime import datetime
+import queue
 import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
-def setup_logging():
-    logger = logging.getLogger('hemnet_scraper')
-    
-    # Check if the logger has handlers already to avoid duplication
-    if logger.hasHandlers():
-        return logger
+LOG_FILENAME = "hemnet_scraper.log"
+
+# Size-based rotation: at most LOG_MAX_BYTES * (LOG_BACKUP_COUNT + 1) bytes in LOG_DIR
+DEFAULT_MAX_BYTES = 20 * 1024 * 1024
+DEFAULT_BACKUP_COUNT = 5
+
+# Per-item records logged with extra={"sample": True} are kept 1 in LOG_SAMPLE_RATE
+DEFAULT_SAMPLE_RATE = 100
+
+# Attributes every LogRecord has; anything else on a record came from extra= and is
+# written as its own JSON field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "sample", "sample_key"}
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with the message, level, logger and any extra= fields"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
 
-    # Configure logging
+class SamplingFilter(logging.Filter):
+    """
+    Keep one in `rate` records marked with extra={"sample": True}, counted per
+    message template, and every unmarked record.
+    """
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = max(int(rate), 1)
+        self.counts = {}
+
+    def filter(self, record):
+        if not getattr(record, "sample", False) or self.rate == 1:
+            return True
+        # Records from worker processes arrive formatted, with their template in sample_key
+        key = getattr(record, "sample_key", record.msg)
+        count = self.counts.get(key, 0)
+        self.counts[key] = count + 1
+        if count % self.rate:
+            return False
+        record.sampled_one_in = self.rate
+        return True
+
+class _DeferredQueueHandler(QueueHandler):
+    # QueueHandler.prepare formats the message in the logging thread; the queue is
+    # in-process, so pass the record through and let the listener thread format it
+    def prepare(self, record):
+        return record
+
+class _WorkerQueueHandler(QueueHandler):
+    # The record is pickled to the parent with its message formatted; the template
+    # is kept so the parent's SamplingFilter still counts per message
+    def prepare(self, record):
+        template = record.msg
+        record = super().prepare(record)
+        record.sample_key = template
+        return record
+
+class _ForwardingHandler(logging.Handler):
+    # Hands records received from worker processes to this process's loggers,
+    # so they go through the same sampling, queue and file handler
+    def emit(self, record):
+        logging.getLogger(record.name).handle(record)
+
+def get_log_directory():
+    """Directory for log and profile files: LOG_DIR, or logs/ in the repository, created if needed"""
     # For containers, use LOG_DIR env var
     # For local testing, fallback to a directory relative to the script
     if 'LOG_DIR' in os.environ:
@@ -30,34 +106,105 @@ def setup_logging():
         print(f"Falling back to current directory for logs: {log_directory}")
         os.makedirs(os.path.join(log_directory, 'logs'), exist_ok=True)
         log_directory = os.path.join(log_directory, 'logs')
+    return log_directory
+
+def setup_logging(filename=LOG_FILENAME):
+    """
+    Route all logging through a queue to a background listener thread.
+
+    Records are only put on a queue by the thread that logs them; formatting and
+    I/O happen in the listener, which writes JSON lines to a size-rotated file in
+    LOG_DIR and plain text to the console. Rotation is configured with
+    LOG_MAX_BYTES and LOG_BACKUP_COUNT, per-item sampling with LOG_SAMPLE_RATE.
 
-    log_filename = f"hemnet_scraper_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
-    log_path = os.path.join(log_directory, log_filename)
+    Each service writes its own file, since two processes rotating one file
+    lose lines and overwrite each other's backups; LOG_FILENAME overrides it.
 
-    logger.setLevel(logging.INFO)
+    Child processes are left unconfigured for the same reason; workers send
+    their records to the parent with setup_worker_logging instead.
+
+    Args:
+        filename: Log file name in LOG_DIR
+
+    Returns:
+        The 'hemnet_scraper' logger
+    """
+    global _listener
+    logger = logging.getLogger('hemnet_scraper')
+
+    # Only configure once per process, and only in the process that owns the log file
+    # (a spawned child has its name, but not yet its parent_process(), while it re-imports __main__)
+    if _listener is not None or multiprocessing.current_process().name != "MainProcess":
+        return logger
+
+    log_path = os.path.join(get_log_directory(), os.environ.get("LOG_FILENAME", filename))
+    handlers = []
 
     try:
-        file_handler = logging.FileHandler(log_path)
-        file_handler.setLevel(logging.INFO)
-        
-        # Modified formatter without %(z)s and with timezone info in datefmt
-        formatter = logging.Formatter(
-            '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-            datefmt='%Y-%m-%d %H:%M:%S %Z'
+        file_handler = RotatingFileHandler(
+            log_path,
+            maxBytes=int(os.environ.get("LOG_MAX_BYTES", DEFAULT_MAX_BYTES)),
+            backupCount=int(os.environ.get("LOG_BACKUP_COUNT", DEFAULT_BACKUP_COUNT)),
+            encoding="utf-8",
         )
-        
-        # Use localtime for correct timezone
-        formatter.converter = time.localtime
-        
-        file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
+        file_handler.setLevel(logging.INFO)
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
     except Exception as e:
         print(f"Warning: Could not set up file logging: {e}")
 
+    # Modified formatter without %(z)s and with timezone info in datefmt
+    formatter = logging.Formatter(
+        '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S %Z'
+    )
+    # Use localtime for correct timezone
+    formatter.converter = time.localtime
+
     console_handler = logging.StreamHandler()
     console_handler.setLevel(logging.INFO)
     console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
+    handlers.append(console_handler)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = _DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(os.environ.get("LOG_SAMPLE_RATE", DEFAULT_SAMPLE_RATE)))
+
+    # Attach to the root logger so module loggers (utils.*, analytics.*) share the queue
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(queue_handler)
+
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    # Flush what's still queued when the process exits
+    atexit.register(_listener.stop)
+
+    logger.info("Logging initialized. Log file: %s", log_path)
+    return logger
+
+def setup_worker_logging(log_queue):
+    """
+    Send a worker process's log records to its parent over a multiprocessing
+    queue, drained by start_worker_log_listener in the parent.
+
+    Call log_queue.close() and log_queue.join_thread() before the worker exits
+    so records still buffered in the queue's feeder thread are delivered.
+    """
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel(logging.INFO)
+    root.addHandler(_WorkerQueueHandler(log_queue))
+
+def start_worker_log_listener(log_queue):
+    """
+    Start a thread that logs the records worker processes put on log_queue
+    through this process's handlers.
 
-    logger.info(f"Logging initialized. Log file: {log_path}")
-    return logger
\ No newline at end of file
+    Returns:
+        The started QueueListener; stop() it after the workers have exited
+    """
+    listener = QueueListener(log_queue, _ForwardingHandler())
+    listener.start()
+    return listener
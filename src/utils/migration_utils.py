@@ -0,0 +1,115 @@
+import logging
+import os
+import re
+from datetime import date
+
+from utils.database_utils import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+_MIGRATION_FILE_RE = re.compile(r"^(\d+)_[\w-]+\.sql$")
+
+# pg_advisory_lock key serializing apply_migrations across processes
+MIGRATION_LOCK_ID = 720301
+
+
+def get_migrations_dir():
+    """
+    Return the directory holding the versioned .sql migrations.
+
+    Uses MIGRATIONS_DIR when set (the container copies them to /app/db/migrations),
+    otherwise db/migrations relative to the repository root.
+    """
+    if "MIGRATIONS_DIR" in os.environ:
+        return os.environ["MIGRATIONS_DIR"]
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    base_dir = os.path.dirname(os.path.dirname(script_dir))
+    return os.path.join(base_dir, "db", "migrations")
+
+def list_migrations(migrations_dir):
+    """
+    List the migrations in a directory, ordered by version.
+
+    Returns:
+        List of (version, path) tuples, e.g. [("001", ".../001_materialized_analytics_views.sql")]
+    """
+    migrations = []
+    for filename in os.listdir(migrations_dir):
+        match = _MIGRATION_FILE_RE.match(filename)
+        if match:
+            migrations.append((match.group(1), os.path.join(migrations_dir, filename)))
+    return sorted(migrations)
+
+def apply_migrations(migrations_dir=None):
+    """
+    Apply every migration that isn't recorded in schema_migrations yet.
+
+    Each migration runs in one transaction together with the insert of its
+    version, so a failing migration is rolled back without being recorded and
+    stops the run before later migrations are attempted. Migration files
+    therefore don't contain BEGIN/COMMIT themselves. The run holds an advisory
+    lock, so processes starting at the same time apply each migration once.
+
+    Returns:
+        List of the versions that were applied
+    """
+    migrations_dir = migrations_dir or get_migrations_dir()
+    if not os.path.isdir(migrations_dir):
+        logger.warning(f"Migrations directory {migrations_dir} not found, skipping migrations")
+        return []
+
+    applied = []
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        # Session level: held across the per-migration commits until the connection closes
+        cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version VARCHAR(50) PRIMARY KEY,
+                applied_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cursor.execute("SELECT version FROM schema_migrations")
+        done = {row[0] for row in cursor.fetchall()}
+        conn.commit()
+
+        for version, path in list_migrations(migrations_dir):
+            if version in done:
+                continue
+            logger.info(f"Applying migration {os.path.basename(path)}")
+            with open(path, encoding="utf-8") as f:
+                cursor.execute(f.read())
+            cursor.execute("INSERT INTO schema_migrations (version) VALUES (%s)", (version,))
+            conn.commit()
+            applied.append(version)
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Error applying migrations: {e}")
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+    if applied:
+        logger.info(f"Applied migrations: {', '.join(applied)}")
+    return applied
+
+def ensure_property_sales_partitions(years_ahead=1):
+    """
+    Make sure property_sales has yearly partitions up to years_ahead from now,
+    so new sales don't end up in the default partition.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        current_year = date.today().year
+        for year in range(current_year, current_year + years_ahead + 1):
+            cursor.execute("SELECT create_property_sales_partition(%s)", (year,))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Error creating property_sales partitions: {e}")
+    finally:
+        cursor.close()
+        conn.close()
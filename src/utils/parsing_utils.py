@@ -0,0 +1,203 @@
+import re
+from datetime import date, datetime, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+# Swedish month names as Hemnet writes them, built once at import time so
+# parsing never depends on the process-global (and thread-unsafe) locale.
+_MONTH_NAMES = (
+    ("januari", "jan"),
+    ("februari", "feb"),
+    ("mars", "mar"),
+    ("april", "apr"),
+    ("maj",),
+    ("juni", "jun"),
+    ("juli", "jul"),
+    ("augusti", "aug"),
+    ("september", "sep", "sept"),
+    ("oktober", "okt"),
+    ("november", "nov"),
+    ("december", "dec"),
+)
+
+SWEDISH_MONTHS = {
+    name: number
+    for number, names in enumerate(_MONTH_NAMES, start=1)
+    for alias in names
+    for name in (alias, alias + ".")
+}
+
+# Hemnet pads numbers with regular, non-breaking, narrow and thin spaces
+_SPACES = str.maketrans("", "", " \u00a0\u202f\u2009\t")
+
+_SOLD_PREFIX_RE = re.compile(r"^\s*s[åa]ld\s+", re.IGNORECASE)
+_DATE_RE = re.compile(r"^\s*(\d{1,2})\s+([^\W\d_]+\.?)\s+(\d{4})\s*$")
+_NUMBER_RE = re.compile("[-\u2212]?\\d[\\d \u00a0\u202f\u2009]*(?:[.,]\\d+)?")
+_FLOOR_RE = re.compile(r"^\s*([-\u2212]?\d+)(?:[.,]\d+)?")
+_LISTING_HREF_ID_RE = re.compile(r"^/bostad/(?:[^/?#]*-)?(\d+)/?(?:[?#].*)?$")
+
+# Sale days are Swedish calendar days
+_SALE_TIMEZONE = ZoneInfo("Europe/Stockholm")
+
+
+@lru_cache(maxsize=4096)
+def parse_swedish_date(date_str):
+    """
+    Parse a Swedish formatted date such as "12 mars 2024" or "3 okt. 2023".
+
+    Results are memoized; the cache is thread-safe and the function keeps no
+    other state, so it can be called freely from worker threads and processes.
+
+    Args:
+        date_str: The formatted date string
+
+    Returns:
+        A datetime for the given day, or None if the string can't be parsed
+    """
+    if not date_str:
+        return None
+
+    match = _DATE_RE.match(date_str)
+    if not match:
+        return None
+
+    month = SWEDISH_MONTHS.get(match.group(2).lower())
+    if not month:
+        return None
+
+    try:
+        return datetime(int(match.group(3)), month, int(match.group(1)))
+    except ValueError:
+        return None
+
+def parse_sold_date(sold_str):
+    """
+    Parse Hemnet's formattedSoldAt such as "Såld 12 mars 2024".
+
+    The "Såld" prefix is stripped before the lookup so the memoized date
+    parser is shared between prefixed and bare date strings.
+
+    Returns:
+        A datetime for the sale day, or None if the string can't be parsed
+    """
+    if not sold_str:
+        return None
+    return parse_swedish_date(_SOLD_PREFIX_RE.sub("", sold_str))
+
+def parse_sold_timestamp(value):
+    """
+    Parse a raw soldAt value: an ISO date or timestamp ("2024-03-12",
+    "2024-03-12T00:00:00Z") or a Unix timestamp in seconds or milliseconds.
+
+    Timestamps are converted to the Europe/Stockholm day they fall on; ISO
+    timestamps without an offset are taken as UTC.
+
+    Returns:
+        A datetime for the sale day, like parse_sold_date, or None if the value can't be parsed
+    """
+    if value is None or isinstance(value, bool) or value == "":
+        return None
+    try:
+        if isinstance(value, str) and not value.strip().isdigit():
+            text = value.strip()
+            if len(text) == 10:
+                day = date.fromisoformat(text)
+                return datetime(day.year, day.month, day.day)
+            moment = datetime.fromisoformat(text.replace("Z", "+00:00"))
+            if moment.tzinfo is None:
+                moment = moment.replace(tzinfo=timezone.utc)
+        else:
+            seconds = float(value)
+            if seconds > 1e11:
+                seconds /= 1000
+            moment = datetime.fromtimestamp(seconds, timezone.utc)
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+    day = moment.astimezone(_SALE_TIMEZONE)
+    return datetime(day.year, day.month, day.day)
+
+def _parse_number(value_str):
+    if value_str is None:
+        return None
+    if isinstance(value_str, (int, float)):
+        return value_str
+
+    match = _NUMBER_RE.search(value_str)
+    if not match:
+        return None
+
+    number = match.group(0).translate(_SPACES).replace("\u2212", "-").replace(",", ".")
+    try:
+        return float(number) if "." in number else int(number)
+    except ValueError:
+        return None
+
+def parse_currency(value_str):
+    """
+    Parse a formatted amount such as "4 195 000 kr", "3 250 kr/mån" or "-150 000 kr".
+
+    Returns:
+        The amount as an int, or None if no amount is found
+    """
+    amount = _parse_number(value_str)
+    return int(round(amount)) if amount is not None else None
+
+def parse_area(value_str):
+    """
+    Parse a formatted area such as "75,5 m²" or "1 203 m²".
+
+    Returns:
+        The area as a float, or None if no number is found
+    """
+    area = _parse_number(value_str)
+    return float(area) if area is not None else None
+
+def parse_coordinates(coordinates):
+    """
+    Parse an Apollo coordinates object such as {"lat": 59.33, "long": 18.06}.
+
+    Returns:
+        tuple: (latitude, longitude) as floats, or (None, None) if missing or out of range
+    """
+    if not coordinates:
+        return None, None
+
+    latitude = coordinates.get("lat", coordinates.get("latitude"))
+    longitude = coordinates.get("long", coordinates.get("longitude"))
+    try:
+        latitude, longitude = float(latitude), float(longitude)
+    except (TypeError, ValueError):
+        return None, None
+
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None, None
+    return latitude, longitude
+
+def parse_floor(value_str):
+    """
+    Parse Hemnet's formattedFloor such as "3 av 5, hiss finns" or "-1 av 4".
+
+    Returns:
+        The floor number as an int, or None if the string doesn't start with one
+    """
+    if not value_str:
+        return None
+
+    match = _FLOOR_RE.match(value_str)
+    if not match:
+        return None
+    return int(match.group(1).replace("\u2212", "-"))
+
+def parse_listing_id(href):
+    """
+    Parse the listing id from an active listing link such as
+    "/bostad/lagenhet-2rum-vasastan-stockholms-kommun-dalagatan-1-21345678".
+
+    Returns:
+        The listing's hemnet id as an int, or None if the link doesn't end with one
+    """
+    if not href:
+        return None
+
+    match = _LISTING_HREF_ID_RE.match(href)
+    return int(match.group(1)) if match else None
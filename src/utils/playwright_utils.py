@@ -1,7 +1,11 @@
-from playwright.sync_api import sync_playwright
+from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
+import logging
 import random
+import time
 from contextlib import contextmanager
 
+logger = logging.getLogger(__name__)
+
 # List of common user agents for rotation
 USER_AGENTS = [
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/111.0.0.0 Safari/537.36",
@@ -16,10 +20,18 @@ def get_random_user_agent():
     return random.choice(USER_AGENTS)
 
 @contextmanager
-def browser_context():
-    """Context manager for browser handling that ensures proper cleanup"""
+def browser_context(browser=None):
+    """
+    Context manager for browser handling that ensures proper cleanup
+    
+    When an already running browser is passed (daemon mode) it is yielded as is
+    and left running; playwright is None in that case.
+    """
+    if browser is not None:
+        yield None, browser
+        return
+    
     playwright = None
-    browser = None
     try:
         playwright = sync_playwright().start()
         browser = playwright.webkit.launch(headless=True)
@@ -40,4 +52,150 @@ def page_context(browser):
         yield page
     finally:
         page.close()
-        context.close()
\ No newline at end of file
+        context.close()
+
+DEFAULT_PAYLOAD_TIMEOUT_MS = 30000
+
+# Runs in the page: true once Next.js's __NEXT_DATA__ script, near the end of the
+# document, has been parsed completely. The element is attached as soon as its
+# start tag arrives and its text grows while the response streams in; it is
+# complete once the parser has moved past it.
+_NEXT_DATA_COMPLETE_JS = """
+() => {
+    const script = document.getElementById("__NEXT_DATA__");
+    return script !== null && (script.nextSibling !== null || document.readyState !== "loading");
+}
+"""
+
+# Runs in the page: parses __NEXT_DATA__ there and hands back only the page props,
+# the Apollo state entries whose keys start with one of `prefixes` and, when
+# `linkPrefix` is given, the result list's links starting with it
+_PAGE_PAYLOAD_JS = """
+({prefixes, linkPrefix}) => {
+    const script = document.getElementById("__NEXT_DATA__");
+    if (!script) return null;
+    const pageProps = (JSON.parse(script.textContent).props || {}).pageProps || {};
+    const state = pageProps.__APOLLO_STATE__ || {};
+    delete pageProps.__APOLLO_STATE__;
+    const apolloState = {};
+    for (const key of Object.keys(state)) {
+        if (prefixes.some(prefix => key.startsWith(prefix))) apolloState[key] = state[key];
+    }
+    let links = [];
+    if (linkPrefix !== null) {
+        links = Array.from(
+            document.querySelectorAll('div[data-testid="result-list"] a[href]'),
+            link => link.getAttribute("href"),
+        ).filter(href => href.startsWith(linkPrefix));
+    }
+    return {pageProps, apolloState, links};
+}
+"""
+
+def fetch_page_payload(page, url, apollo_prefixes=(), link_prefix=None, timeout_ms=DEFAULT_PAYLOAD_TIMEOUT_MS):
+    """
+    Navigate to a Hemnet page and extract its data inside the browser.
+    
+    Navigation only waits for the response to start arriving, then for the
+    __NEXT_DATA__ script to be parsed completely, instead of for
+    domcontentloaded.
+    The JSON is parsed and pruned in the page, so only the needed part of it
+    crosses over to Python instead of the serialized DOM.
+    
+    Args:
+        page: Playwright page
+        url: Page to load
+        apollo_prefixes: Apollo state key prefixes to keep, e.g. ("Broker:",)
+        link_prefix: Also return the result list links starting with this
+        timeout_ms: How long to wait for __NEXT_DATA__
+        
+    Returns:
+        Dictionary with "pageProps" (without the Apollo state), "apolloState"
+        (the kept entries) and "links", or None if the page has no __NEXT_DATA__
+    """
+    page.goto(url, wait_until="commit", timeout=timeout_ms)
+    try:
+        page.wait_for_function(_NEXT_DATA_COMPLETE_JS, timeout=timeout_ms)
+    except PlaywrightTimeoutError:
+        logger.warning(f"__NEXT_DATA__ not found within {timeout_ms} ms: {url}")
+        return None
+    return page.evaluate(_PAGE_PAYLOAD_JS, {"prefixes": list(apollo_prefixes), "linkPrefix": link_prefix})
+
+class BrowserManager:
+    """
+    Long-lived Playwright driver and WebKit browser shared by scheduled jobs in daemon mode.
+    
+    Call ensure_healthy() before each job: it checks that the browser can still
+    open a page and restarts it when it can't.
+    """
+    
+    def __init__(self, health_check_timeout_ms=10000):
+        self.health_check_timeout_ms = health_check_timeout_ms
+        self.playwright = None
+        self.browser = None
+        self.startup_seconds = None
+        self.restarts = 0
+    
+    def start(self):
+        """Start the driver and browser, returning the startup time in seconds"""
+        start_time = time.monotonic()
+        self.playwright = sync_playwright().start()
+        self.browser = self.playwright.webkit.launch(headless=True)
+        self.startup_seconds = time.monotonic() - start_time
+        logger.info(f"Browser started in {self.startup_seconds:.2f}s")
+        return self.startup_seconds
+    
+    def stop(self):
+        """Close the browser and driver, ignoring errors from an already dead browser"""
+        for close in (
+            self.browser.close if self.browser else None,
+            self.playwright.stop if self.playwright else None,
+        ):
+            if close is None:
+                continue
+            try:
+                close()
+            except Exception as e:
+                logger.warning(f"Error shutting down browser: {e}")
+        self.browser = None
+        self.playwright = None
+    
+    def is_healthy(self):
+        """Check that the browser is connected and can open and script a page"""
+        if self.browser is None or not self.browser.is_connected():
+            return False
+        try:
+            context = self.browser.new_context(user_agent=get_random_user_agent())
+            try:
+                page = context.new_page()
+                page.set_default_timeout(self.health_check_timeout_ms)
+                return page.evaluate("1 + 1") == 2
+            finally:
+                context.close()
+        except Exception as e:
+            logger.warning(f"Browser health check failed: {e}")
+            return False
+    
+    def ensure_healthy(self):
+        """
+        Health-check the browser and restart it if needed.
+        
+        Returns:
+            Dictionary for the run summary: the health check time, whether the
+            browser was restarted, the startup time this job paid (0 when the
+            warm browser was reused) and the latest launch's startup time
+        """
+        start_time = time.monotonic()
+        healthy = self.is_healthy()
+        summary = {
+            "browser_health_check_seconds": round(time.monotonic() - start_time, 3),
+            "browser_restarted": not healthy,
+            "browser_startup_seconds": 0.0,
+        }
+        if not healthy:
+            logger.warning("Browser is unhealthy, restarting it")
+            self.stop()
+            summary["browser_startup_seconds"] = round(self.start(), 3)
+            self.restarts += 1
+        summary["browser_last_launch_seconds"] = round(self.startup_seconds, 3)
+        return summary
@@ -0,0 +1,192 @@
+"""
+On-demand profiling of scraper runs.
+
+profile_run() wraps one run. While it is active, a sampling thread records
+the stack of every thread at a fixed interval, and functions decorated with
+@stage are timed and tagged in those stacks. With mode "cprofile", the run's
+thread is additionally traced with cProfile. Per-run files go to
+LOG_DIR/profiles:
+
+    <job>-<timestamp>.collapsed     folded stacks for flamegraph.pl / speedscope
+    <job>-<timestamp>.stages.json   calls and wall time per stage
+    <job>-<timestamp>.prof          cProfile stats (mode "cprofile" only)
+    <job>-<timestamp>.txt           top functions by cumulative time (mode "cprofile" only)
+
+Without an active run, a @stage-decorated call costs one global lookup.
+"""
+import cProfile
+import functools
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+from utils.logging_setup import get_log_directory
+
+logger = logging.getLogger(__name__)
+
+PROFILE_MODES = ("sample", "cprofile")
+DEFAULT_SAMPLE_INTERVAL = 0.005     # seconds between stack samples
+MAX_STACK_DEPTH = 200
+
+_session = None
+
+
+class ProfileSession:
+    """
+    Sampling profiler and stage timer for one run; see profile_run.
+    """
+
+    def __init__(self, name, mode="sample", interval=DEFAULT_SAMPLE_INTERVAL):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode: {mode}")
+        self.name = name
+        self.mode = mode
+        self.interval = interval
+        self.samples = Counter()
+        self.stage_times = {}
+        self._stages = {}           # thread id -> stack of stage names entered in it
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = None
+        self._profiler = None
+        self._start_time = None
+
+    @contextmanager
+    def stage(self, name):
+        stages = self._stages.setdefault(threading.get_ident(), [])
+        stages.append(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stages.pop()
+            with self._lock:
+                calls, total = self.stage_times.get(name, (0, 0.0))
+                self.stage_times[name] = (calls + 1, total + elapsed)
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.reverse()
+                # Stages are put at the root so each gets its own tower in the flame graph
+                stages = ["stage:" + name for name in self._stages.get(thread_id, ())]
+                if thread_id not in names:
+                    thread = threading._active.get(thread_id)
+                    names[thread_id] = thread.name if thread else str(thread_id)
+                self.samples[";".join([names[thread_id]] + stages + stack)] += 1
+
+    def start(self):
+        self._start_time = time.perf_counter()
+        self._sampler = threading.Thread(target=self._sample, name="profile-sampler", daemon=True)
+        self._sampler.start()
+        if self.mode == "cprofile":
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def stop(self):
+        if self._profiler is not None:
+            self._profiler.disable()
+        self._stop.set()
+        self._sampler.join()
+        return time.perf_counter() - self._start_time
+
+    def write(self, elapsed, directory=None):
+        """
+        Write the run's profile files.
+
+        Returns:
+            Dictionary of the written paths and per-stage timings, for the run summary
+        """
+        directory = directory or os.path.join(get_log_directory(), "profiles")
+        os.makedirs(directory, exist_ok=True)
+        prefix = os.path.join(directory, f"{self.name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}")
+
+        with open(prefix + ".collapsed", "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+        stages = {
+            name: {"calls": calls, "total_seconds": round(total, 3), "mean_ms": round(total * 1000 / calls, 2)}
+            for name, (calls, total) in sorted(self.stage_times.items(), key=lambda item: -item[1][1])
+        }
+        with open(prefix + ".stages.json", "w", encoding="utf-8") as f:
+            json.dump({"run_seconds": round(elapsed, 3), "samples": sum(self.samples.values()), "stages": stages}, f, indent=2)
+
+        files = [prefix + ".collapsed", prefix + ".stages.json"]
+        if self._profiler is not None:
+            self._profiler.dump_stats(prefix + ".prof")
+            report = io.StringIO()
+            pstats.Stats(self._profiler, stream=report).sort_stats("cumulative").print_stats(50)
+            with open(prefix + ".txt", "w", encoding="utf-8") as f:
+                f.write(report.getvalue())
+            files += [prefix + ".prof", prefix + ".txt"]
+        return {"profile_files": files, "profile_stages": stages}
+
+@contextmanager
+def profile_run(name, mode=None, interval=DEFAULT_SAMPLE_INTERVAL):
+    """
+    Profile the enclosed run when mode is "sample" or "cprofile"; do nothing when it is None.
+
+    Yields:
+        Dictionary that receives the written file paths and stage timings once
+        the block exits (empty when profiling is off)
+    """
+    global _session
+    summary = {}
+    if mode is None or _session is not None:
+        # Profiling is off, or an enclosing run is already being profiled
+        yield summary
+        return
+
+    session = ProfileSession(name, mode, interval)
+    _session = session
+    session.start()
+    try:
+        yield summary
+    finally:
+        elapsed = session.stop()
+        _session = None
+        try:
+            summary.update(session.write(elapsed))
+            logger.info(
+                f"Profile of {name} written to {summary['profile_files'][0]}",
+                extra={"profile_stages": summary["profile_stages"]},
+            )
+        except OSError as e:
+            logger.error(f"Could not write profile of {name}: {e}")
+
+def stage(name):
+    """
+    Decorator tagging a function as a profiling stage.
+
+    While a run is profiled, calls are timed and appear under "stage:<name>"
+    in the collapsed stacks.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            session = _session
+            if session is None:
+                return func(*args, **kwargs)
+            with session.stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,439 @@
+import logging
+import uuid
+from datetime import timezone
+
+import numpy as np
+
+from utils.database_utils import get_db_connection
+
+try:
+    import pandas as pd
+except ImportError:  # pandas is only needed for output="dataframe"
+    pd = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 50000
+
+# PostgreSQL type OIDs as reported in cursor.description, grouped by the NumPy dtype they map to
+_INTEGER_TYPES = {20, 21, 23}        # int8, int2, int4
+_FLOAT_TYPES = {700, 701, 1700}      # float4, float8, numeric
+_BOOL_TYPES = {16}
+_DATE_TYPES = {1082}
+_TIMESTAMP_TYPES = {1114, 1184}      # timestamp, timestamptz
+
+# Base relations the query builders read from, with the columns each filter applies to.
+# "location" filters go through listing_locations on the listing_id column.
+QUERY_SOURCES = {
+    "listings": {
+        "from": """
+            listings l
+            JOIN housing_form_types hft ON l.housing_form_id = hft.housing_form_id
+            JOIN tenure_types tt ON l.tenure_id = tt.tenure_id
+        """,
+        "default_columns": [
+            "l.listing_id", "l.listing_hemnet_id", "l.street_address", "l.postcode",
+            "hft.name AS housing_form", "tt.name AS tenure", "l.number_of_rooms",
+            "l.asking_price", "l.squaremeter_price", "l.fee", "l.living_area",
+            "l.construction_year", "l.published_date", "l.status", "l.housing_cooperative_id",
+            "l.broker_id", "l.latitude", "l.longitude",
+        ],
+        "date": "l.published_date",
+        "listing_id": "l.listing_id",
+        "housing_form": "hft.name",
+        "status": "l.status",
+    },
+    "sales": {
+        "from": """
+            property_sales ps
+            LEFT JOIN listings l ON ps.listing_id = l.listing_id
+            LEFT JOIN housing_form_types hft ON l.housing_form_id = hft.housing_form_id
+        """,
+        "default_columns": [
+            "ps.sale_id", "ps.sale_hemnet_id", "ps.listing_id", "ps.listing_hemnet_id",
+            "ps.final_price", "ps.asking_price", "ps.price_change", "ps.price_change_percentage",
+            "ps.sale_date", "ps.living_area", "ps.number_of_rooms", "ps.construction_year",
+            "ps.area", "ps.municipality", "hft.name AS housing_form", "l.published_date",
+            "ps.latitude", "ps.longitude",
+        ],
+        "date": "ps.sale_date",
+        "listing_id": "ps.listing_id",
+        "housing_form": "hft.name",
+        "status": None,
+    },
+    "listing_sales_view": {
+        "from": "listing_sales_view lsv",
+        "default_columns": ["lsv.*"],
+        "date": "lsv.sale_date",
+        "listing_id": "lsv.listing_id",
+        "housing_form": "lsv.housing_form_name",
+        "status": None,
+    },
+    # Matched sales with one row per location the listing belongs to, for per-location statistics
+    "listing_sales_by_location": {
+        "from": """
+            listing_sales_view lsv
+            JOIN listing_locations ll ON lsv.listing_id = ll.listing_id
+        """,
+        "default_columns": [
+            "lsv.sale_id", "ll.location_id", "lsv.housing_form_name AS housing_form",
+            "lsv.final_price::float8 AS final_price", "lsv.living_area::float8 AS living_area",
+            "lsv.final_price_per_sqm::float8 AS final_price_per_sqm",
+            "lsv.price_change_percentage::float8 AS price_change_percentage",
+            "lsv.days_on_market", "lsv.sale_date",
+        ],
+        "date": "lsv.sale_date",
+        "listing_id": "lsv.listing_id",
+        "location_id": "ll.location_id",
+        "housing_form": "lsv.housing_form_name",
+        "status": None,
+    },
+    # Recent matched sales with the attributes the comps engine compares on, one row per location;
+    # sale fields fall back to the listing's when the sale page didn't have them
+    "comparable_sales": {
+        "from": """
+            property_sales ps
+            JOIN listings l ON ps.listing_id = l.listing_id
+            JOIN housing_form_types hft ON l.housing_form_id = hft.housing_form_id
+            JOIN listing_locations ll ON l.listing_id = ll.listing_id
+        """,
+        "default_columns": [
+            "ps.sale_id", "ps.sale_date", "ll.location_id", "hft.name AS housing_form",
+            "COALESCE(ps.living_area, l.living_area)::float8 AS living_area",
+            "COALESCE(ps.number_of_rooms, l.number_of_rooms)::float8 AS number_of_rooms",
+            "ps.final_price::float8 AS final_price",
+            "COALESCE(ps.latitude, l.latitude)::float8 AS latitude",
+            "COALESCE(ps.longitude, l.longitude)::float8 AS longitude",
+        ],
+        "date": "ps.sale_date",
+        "listing_id": "ps.listing_id",
+        "location_id": "ll.location_id",
+        "housing_form": "hft.name",
+        "status": None,
+    },
+    "unmatched_sales_view": {
+        "from": "unmatched_sales_view usv",
+        "default_columns": ["usv.*"],
+        "date": "usv.sale_date",
+        "listing_id": None,
+        "housing_form": None,
+        "status": None,
+    },
+    "location_market_performance": {
+        "from": "location_market_performance lmp",
+        "default_columns": ["lmp.*"],
+        "date": None,
+        "listing_id": None,
+        "location_id": "lmp.location_id",
+        "location_type": "lmp.type",
+        "housing_form": None,
+        "status": None,
+    },
+    "housing_cooperative_performance": {
+        "from": "housing_cooperative_performance hcp",
+        "default_columns": ["hcp.*"],
+        "date": None,
+        "listing_id": None,
+        "housing_form": None,
+        "status": None,
+    },
+    # Listing and sale aggregates per broker; there is no materialized view for these
+    "broker_performance": {
+        "from": """
+            (
+                SELECT
+                    b.broker_id,
+                    b.broker_hemnet_id,
+                    b.name AS broker_name,
+                    COUNT(DISTINCT l.listing_id) AS total_listings,
+                    COUNT(DISTINCT l.listing_id) FILTER (WHERE l.status = 'active') AS active_listings,
+                    COUNT(DISTINCT ps.sale_id) AS total_sales,
+                    ROUND(AVG(l.asking_price), 2) AS avg_asking_price,
+                    ROUND(AVG(ps.final_price), 2) AS avg_final_price,
+                    ROUND(AVG(ps.price_change_percentage), 2) AS avg_price_change_percentage,
+                    ROUND(AVG(ps.sale_date - l.published_date), 1) AS avg_days_on_market
+                FROM brokers b
+                JOIN listings l ON b.broker_id = l.broker_id
+                LEFT JOIN property_sales ps ON l.listing_id = ps.listing_id
+                GROUP BY b.broker_id, b.broker_hemnet_id, b.name
+            ) bp
+        """,
+        "default_columns": ["bp.*"],
+        "date": None,
+        "listing_id": None,
+        "housing_form": None,
+        "status": None,
+    },
+}
+
+
+def build_query(source, columns=None, start_date=None, end_date=None, location_ids=None,
+                housing_forms=None, statuses=None, location_types=None, order_by=None, limit=None):
+    """
+    Build a SELECT over one of QUERY_SOURCES with the filters pushed down into SQL.
+
+    Args:
+        source: Key of QUERY_SOURCES, e.g. "sales" or "listing_sales_view"
+        columns: SQL column expressions (defaults to the source's default columns)
+        start_date: Inclusive lower bound on the source's date column
+        end_date: Exclusive upper bound on the source's date column
+        location_ids: Internal location_ids; rows must belong to at least one
+        housing_forms: Housing form names, e.g. ["Lägenhet", "Villa"]
+        statuses: Listing statuses, e.g. ["active"]
+        location_types: Location types, e.g. ["municipality"], for per-location sources
+        order_by: Optional ORDER BY expression
+        limit: Optional row limit
+
+    Returns:
+        tuple: (sql, params) ready for cursor.execute
+
+    Raises:
+        ValueError: If the source is unknown or doesn't support a requested filter
+    """
+    if source not in QUERY_SOURCES:
+        raise ValueError(f"Unknown query source: {source}")
+    spec = QUERY_SOURCES[source]
+
+    def filter_column(key):
+        column = spec.get(key)
+        if not column:
+            raise ValueError(f"{source} can't be filtered by {key}")
+        return column
+
+    conditions = []
+    params = []
+    if start_date is not None:
+        conditions.append(f"{filter_column('date')} >= %s")
+        params.append(start_date)
+    if end_date is not None:
+        conditions.append(f"{filter_column('date')} < %s")
+        params.append(end_date)
+    if location_ids:
+        if spec.get("location_id"):
+            conditions.append(f"{spec['location_id']} = ANY(%s)")
+        else:
+            conditions.append(
+                f"{filter_column('listing_id')} IN "
+                "(SELECT listing_id FROM listing_locations WHERE location_id = ANY(%s))"
+            )
+        params.append(list(location_ids))
+    if housing_forms:
+        conditions.append(f"{filter_column('housing_form')} = ANY(%s)")
+        params.append(list(housing_forms))
+    if statuses:
+        conditions.append(f"{filter_column('status')} = ANY(%s)")
+        params.append(list(statuses))
+    if location_types:
+        conditions.append(f"{filter_column('location_type')} = ANY(%s)")
+        params.append(list(location_types))
+
+    sql = f"SELECT {', '.join(columns or spec['default_columns'])} FROM {spec['from']}"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    if order_by:
+        sql += f" ORDER BY {order_by}"
+    if limit:
+        sql += " LIMIT %s"
+        params.append(limit)
+    return sql, tuple(params)
+
+def stream_rows(conn, sql, params=None, chunk_size=DEFAULT_CHUNK_SIZE, with_description=False):
+    """
+    Stream a query's result through a named (server-side) cursor.
+
+    Only one chunk of rows is held in client memory at a time.
+
+    Yields:
+        Lists of up to chunk_size row tuples, or (description, rows) tuples
+        when with_description is set
+    """
+    cursor = conn.cursor(name=f"read_{uuid.uuid4().hex}")
+    cursor.itersize = chunk_size
+    try:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield (cursor.description, rows) if with_description else rows
+    finally:
+        cursor.close()
+
+def _column_to_array(values, type_code):
+    if type_code in _INTEGER_TYPES:
+        if any(value is None for value in values):
+            return np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+        return np.array(values, dtype=np.int64)
+    if type_code in _FLOAT_TYPES:
+        return np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+    if type_code in _BOOL_TYPES and not any(value is None for value in values):
+        return np.array(values, dtype=bool)
+    if type_code in _DATE_TYPES:
+        return np.array(values, dtype="datetime64[D]")
+    if type_code in _TIMESTAMP_TYPES:
+        return np.array(
+            [value.astimezone(timezone.utc).replace(tzinfo=None) if value and value.tzinfo else value
+             for value in values],
+            dtype="datetime64[us]",
+        )
+    return np.array(values, dtype=object)
+
+def rows_to_arrays(description, rows):
+    """
+    Convert a chunk of rows into {column name: NumPy array}.
+
+    Integer columns with NULLs become float64 with NaN, dates and timestamps
+    become datetime64 with NaT, everything else not numeric stays object.
+    """
+    columns = list(zip(*rows))
+    return {
+        column.name: _column_to_array(values, column.type_code)
+        for column, values in zip(description, columns)
+    }
+
+def load_records(source, conn=None, **filters):
+    """
+    Run a query source and return its rows as dictionaries, for small results
+    such as aggregates and API responses.
+
+    Filters are the keyword arguments of build_query.
+    """
+    sql, params = build_query(source, **filters)
+    return _fetch_records(sql, params, conn)
+
+def _fetch_records(sql, params, conn=None):
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+        conn.set_session(readonly=True)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql, params)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+        if own_conn:
+            conn.rollback()
+            conn.close()
+
+def search_listings(query, statuses=None, min_price=None, max_price=None, location_ids=None,
+                    limit=50, columns=None, conn=None):
+    """
+    Keyword search over listing descriptions and street addresses, best matches first.
+
+    The query is parsed with websearch_to_tsquery using the Swedish
+    configuration ("balkong -hiss", "\"nära havet\"", "eldstad or kakelugn")
+    and matched against listings.search_vector, in which the address weighs
+    more than the description. A listing whose street address is similar to
+    the whole query (pg_trgm word similarity) also matches, so partial or
+    misspelled street names still find it. Both conditions are served by the
+    GIN indexes from migration 010.
+
+    Args:
+        query: Search text, e.g. "sjöutsikt balkong" or "Storgatan 12"
+        statuses: Listing statuses, e.g. ["active"]
+        min_price: Inclusive lower bound on the asking price
+        max_price: Inclusive upper bound on the asking price
+        location_ids: Internal location_ids; listings must belong to at least one
+        limit: Maximum number of listings returned
+        columns: SQL column expressions over the listings source (defaults to its default columns)
+        conn: Existing connection to use; a read-only one is opened and closed otherwise
+
+    Returns:
+        list: Listing dictionaries with a "rank" key, highest rank first
+    """
+    spec = QUERY_SOURCES["listings"]
+    conditions = ["(l.search_vector @@ q.ts OR q.term <%% l.street_address)"]
+    params = [query, query]
+    if statuses:
+        conditions.append("l.status = ANY(%s)")
+        params.append(list(statuses))
+    if min_price is not None:
+        conditions.append("l.asking_price >= %s")
+        params.append(min_price)
+    if max_price is not None:
+        conditions.append("l.asking_price <= %s")
+        params.append(max_price)
+    if location_ids:
+        conditions.append("l.listing_id IN (SELECT listing_id FROM listing_locations WHERE location_id = ANY(%s))")
+        params.append(list(location_ids))
+
+    rank = "ts_rank_cd(l.search_vector, q.ts) + word_similarity(q.term, l.street_address)"
+    sql = f"""
+        SELECT {', '.join(columns or spec['default_columns'])}, {rank} AS rank
+        FROM (SELECT websearch_to_tsquery('swedish', %s) AS ts, %s::text AS term) q,
+        {spec['from']}
+        WHERE {' AND '.join(conditions)}
+        ORDER BY rank DESC, l.listing_id DESC
+        LIMIT %s
+    """
+    params.append(limit)
+    return _fetch_records(sql, tuple(params), conn)
+
+def stream_query(sql, params=None, chunk_size=DEFAULT_CHUNK_SIZE, output="arrays", conn=None):
+    """
+    Stream a query's result in chunks.
+
+    Args:
+        sql: The query, typically from build_query
+        params: Query parameters
+        chunk_size: Rows fetched from the server per chunk
+        output: "arrays" for {column: NumPy array}, "dataframe" for pandas
+            DataFrames, or "rows" for lists of tuples
+        conn: Existing connection to use; a read-only one is opened and closed otherwise
+
+    Yields:
+        One chunk per fetch in the requested output format
+    """
+    if output == "dataframe" and pd is None:
+        raise ImportError("pandas is required for output='dataframe'")
+    if output not in ("arrays", "dataframe", "rows"):
+        raise ValueError(f"Unknown output format: {output}")
+
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+        conn.set_session(readonly=True)
+    try:
+        for description, rows in stream_rows(conn, sql, params, chunk_size, with_description=True):
+            if output == "rows":
+                yield rows
+                continue
+            arrays = rows_to_arrays(description, rows)
+            yield pd.DataFrame(arrays, copy=False) if output == "dataframe" else arrays
+    finally:
+        if own_conn:
+            conn.rollback()
+            conn.close()
+
+def stream_source(source, chunk_size=DEFAULT_CHUNK_SIZE, output="arrays", conn=None, **filters):
+    """
+    Stream a query source with filters, e.g.
+
+        for chunk in stream_source("sales", start_date=date(2024, 1, 1), housing_forms=["Lägenhet"]):
+            ...
+
+    Filters are the keyword arguments of build_query.
+    """
+    sql, params = build_query(source, **filters)
+    return stream_query(sql, params, chunk_size=chunk_size, output=output, conn=conn)
+
+def load_arrays(source, chunk_size=DEFAULT_CHUNK_SIZE, conn=None, **filters):
+    """
+    Load a whole query source into {column: NumPy array} by concatenating streamed chunks.
+
+    Only the final arrays are kept, so peak memory is the result plus one chunk
+    of Python rows rather than the full result as Python objects.
+    """
+    chunks = {}
+    for arrays in stream_source(source, chunk_size=chunk_size, output="arrays", conn=conn, **filters):
+        for name, array in arrays.items():
+            chunks.setdefault(name, []).append(array)
+    return {name: _concatenate(parts) for name, parts in chunks.items()}
+
+def _concatenate(parts):
+    # A column can be int64 in one chunk and float64 (NaN for NULL) in another
+    if len({part.dtype for part in parts}) > 1 and all(part.dtype.kind in "if" for part in parts):
+        parts = [part.astype(np.float64) for part in parts]
+    return np.concatenate(parts)
@@ -0,0 +1,195 @@
+"""
+Validation of scraped records against the schema before they are written.
+
+The rules mirror the constraints in db/init.sql: NOT NULL columns, CHECK
+constraints, VARCHAR lengths and DECIMAL precisions. Each page of extracted
+records is validated as a batch before it reaches the database; records that
+PostgreSQL would reject are quarantined in ingest_rejects with their reasons
+instead of costing an insert and a rollback.
+
+Rules are keyed by the field of the scraped record (dotted for nested dicts,
+e.g. "broker.name"), which is not always the column name.
+"""
+import logging
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from utils.database_utils import store_ingest_rejects
+
+logger = logging.getLogger(__name__)
+
+# Rule keys: not_null, varchar (max length), decimal ((precision, scale)),
+# integer, min, min_exclusive, max, max_current_year
+LISTING_RULES = {
+    "hemnet_id": {"not_null": True, "integer": True},
+    "street_address": {"not_null": True, "varchar": 255},
+    "post_code": {"varchar": 20},
+    "tenure": {"not_null": True, "varchar": 100},
+    "housing_form": {"not_null": True, "varchar": 100},
+    "energy_classification": {"varchar": 50},
+    "number_of_rooms": {"decimal": (4, 1)},
+    "asking_price": {"not_null": True, "decimal": (15, 2), "min": 0},
+    "square_meter_price": {"decimal": (15, 2)},
+    "fee": {"decimal": (10, 2)},
+    "yearly_arrende_fee": {"decimal": (10, 2)},
+    "yearly_leasehold_fee": {"decimal": (10, 2)},
+    "running_costs": {"decimal": (10, 2)},
+    "construction_year": {"integer": True, "min_exclusive": 1500, "max_current_year": True},
+    "living_area": {"decimal": (10, 2), "min": 0},
+    "supplemental_area": {"decimal": (10, 2)},
+    "land_area": {"decimal": (12, 2), "min": 0},
+    "floor": {"integer": True},
+    "published_date": {"not_null": True},
+    "is_foreclosure": {"not_null": True},
+    "is_new_construction": {"not_null": True},
+    "is_project": {"not_null": True},
+    "is_upcoming": {"not_null": True},
+    "broker.hemnetId": {"not_null": True, "integer": True},
+    "broker.name": {"not_null": True, "varchar": 255},
+    "closest_water_distance_meters": {"integer": True},
+    "coastline_distance_meters": {"integer": True},
+    "latitude": {"decimal": (10, 8), "min": -90, "max": 90},
+    "longitude": {"decimal": (11, 8), "min": -180, "max": 180},
+}
+
+SALE_RULES = {
+    "sale_hemnet_id": {"not_null": True, "integer": True},
+    "original_hemnet_id": {"not_null": True, "integer": True},
+    "final_price": {"not_null": True, "decimal": (15, 2), "min": 0},
+    "asking_price": {"decimal": (15, 2)},
+    "price_change": {"decimal": (15, 2)},
+    "price_change_percentage": {"decimal": (8, 2)},
+    "sale_date": {"not_null": True},
+    "sale_date_str": {"varchar": 50},
+    "broker_agency": {"varchar": 255},
+    "living_area": {"decimal": (10, 2)},
+    "land_area": {"decimal": (12, 2)},
+    "rooms": {"decimal": (4, 1)},
+    "construction_year": {"integer": True},
+    "street_address": {"varchar": 255},
+    "area": {"varchar": 255},
+    "municipality": {"varchar": 255},
+    "running_costs": {"decimal": (10, 2)},
+    "url": {"not_null": True, "varchar": 255},
+    "latitude": {"decimal": (10, 8), "min": -90, "max": 90},
+    "longitude": {"decimal": (11, 8), "min": -180, "max": 180},
+}
+
+RULES = {"listing": LISTING_RULES, "sale": SALE_RULES}
+ID_FIELDS = {"listing": "hemnet_id", "sale": "sale_hemnet_id"}
+
+
+def _get(record, field):
+    value = record
+    for key in field.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+def _as_number(value, integer):
+    # Mirrors PostgreSQL's input rules: numeric strings are accepted, "" is not
+    if isinstance(value, bool):
+        return None
+    if integer:
+        if isinstance(value, int):
+            return value
+        if isinstance(value, float):
+            return int(value) if value.is_integer() else None
+        try:
+            return int(str(value).strip())
+        except ValueError:
+            return None
+    try:
+        number = Decimal(str(value).strip())
+    except InvalidOperation:
+        return None
+    return number if number.is_finite() else None
+
+def check_value(value, rule):
+    """
+    Reason a value violates a column rule, or None if it is accepted.
+    """
+    if value is None:
+        return "null" if rule.get("not_null") else None
+
+    if "varchar" in rule:
+        if len(str(value)) > rule["varchar"]:
+            return f"longer than {rule['varchar']} characters"
+        return None
+
+    if not ("integer" in rule or "decimal" in rule):
+        return None
+
+    number = _as_number(value, rule.get("integer", False))
+    if number is None:
+        return "not an integer" if rule.get("integer") else "not a number"
+    if "decimal" in rule:
+        precision, scale = rule["decimal"]
+        # The value is rounded to `scale` decimals, leaving precision - scale integer digits
+        if abs(round(number, scale)) >= 10 ** (precision - scale):
+            return f"overflows DECIMAL({precision}, {scale})"
+    if "min" in rule and number < rule["min"]:
+        return f"below {rule['min']}"
+    if "min_exclusive" in rule and number <= rule["min_exclusive"]:
+        return f"not above {rule['min_exclusive']}"
+    if "max" in rule and number > rule["max"]:
+        return f"above {rule['max']}"
+    if rule.get("max_current_year") and number > date.today().year:
+        return "after the current year"
+    return None
+
+def validate_record(record, record_type):
+    """
+    Check one record against the rules of its target table.
+
+    Args:
+        record: Extracted listing or sale dictionary
+        record_type: "listing" or "sale"
+
+    Returns:
+        dict: {field: reason} for every violated rule, empty if the record is valid
+    """
+    reasons = {}
+    for field, rule in RULES[record_type].items():
+        reason = check_value(_get(record, field), rule)
+        if reason:
+            reasons[field] = reason
+    return reasons
+
+def validate_batch(records, record_type):
+    """
+    Split a batch of records into valid records and rejects.
+
+    Returns:
+        tuple: (valid records, [(record, {field: reason}), ...])
+    """
+    valid, rejects = [], []
+    for record in records:
+        reasons = validate_record(record, record_type)
+        if reasons:
+            rejects.append((record, reasons))
+        else:
+            valid.append(record)
+    return valid, rejects
+
+def quarantine_rejects(record_type, rejects, stats):
+    """
+    Store rejected records in ingest_rejects and add them to a run's counters.
+
+    stats gains "records_rejected" and "rejected_fields", a {field: count}
+    dictionary of the fields that failed validation.
+    """
+    if not rejects:
+        return
+    store_ingest_rejects(record_type, ID_FIELDS[record_type], rejects)
+
+    stats["records_rejected"] = stats.get("records_rejected", 0) + len(rejects)
+    field_counts = stats.setdefault("rejected_fields", {})
+    for record, reasons in rejects:
+        for field in reasons:
+            field_counts[field] = field_counts.get(field, 0) + 1
+        logger.warning(
+            "Rejected %s %s: %s", record_type, record.get(ID_FIELDS[record_type]), reasons,
+            extra={"record_type": record_type, "reasons": reasons},
+        )